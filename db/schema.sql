@@ -1,8 +1,115 @@
 CREATE TABLE notes(
-    uuid BLOB PRIMARY KEY,  -- valid UUID
+    id INTEGER PRIMARY KEY,
+    uuid BLOB NOT NULL UNIQUE,  -- valid UUID
     title TEXT NOT NULL,
     text TEXT NOT NULL,
-    creation_date TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,  -- YYYY-MM-DD HH:MM:SS
-    last_changed TEXT NOT NULL,  -- YYYY-MM-DDTHH:MM:SSZ
-    favorite INTEGER NOT NULL DEFAULT FALSE
+    creation_date INTEGER NOT NULL,  -- milliseconds since the epoch
+    last_changed INTEGER NOT NULL,  -- milliseconds since the epoch
+    favorite INTEGER NOT NULL DEFAULT FALSE,
+    revision INTEGER NOT NULL DEFAULT 1,  -- incremented on every change
+    compressed INTEGER NOT NULL DEFAULT FALSE  -- text is zlib compressed
+);
+CREATE INDEX notes_last_changed_uuid ON notes(last_changed, uuid);
+CREATE INDEX notes_creation_date_uuid ON notes(creation_date, uuid);
+CREATE INDEX notes_favorite_last_changed_uuid
+    ON notes(favorite, last_changed, uuid);
+
+CREATE VIRTUAL TABLE notes_fts USING fts5(title, text);
+-- Compressed texts are indexed by the application.
+CREATE TRIGGER notes_fts_insert AFTER INSERT ON notes
+    WHEN NOT NEW.compressed BEGIN
+    INSERT INTO notes_fts(rowid, title, text)
+        VALUES(NEW.id, NEW.title, NEW.text);
+END;
+CREATE TRIGGER notes_fts_title AFTER UPDATE OF title, text ON notes
+    WHEN NEW.text IS OLD.text AND NEW.title IS NOT OLD.title BEGIN
+    UPDATE notes_fts SET title = NEW.title WHERE rowid = NEW.id;
+END;
+CREATE TRIGGER notes_fts_update AFTER UPDATE OF text ON notes
+    WHEN NEW.text IS NOT OLD.text BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id;
+    INSERT INTO notes_fts(rowid, title, text)
+        SELECT NEW.id, NEW.title, NEW.text WHERE NOT NEW.compressed;
+END;
+CREATE TRIGGER notes_fts_delete AFTER DELETE ON notes BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id;
+END;
+
+CREATE TABLE deleted_notes(
+    uuid BLOB PRIMARY KEY,  -- valid UUID
+    deletion_date INTEGER NOT NULL  -- milliseconds since the epoch
+);
+CREATE INDEX deleted_notes_deletion_date ON deleted_notes(deletion_date);
+
+CREATE TABLE note_revisions(
+    note_uuid BLOB NOT NULL,  -- valid UUID
+    revision INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    last_changed INTEGER NOT NULL,  -- milliseconds since the epoch
+    -- 1 if data is the zlib compressed text of the note, 0 if it is a delta
+    -- to the previous revision in this table, 2 if it is the text as stored
+    -- in the notes table.
+    snapshot INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY(note_uuid, revision)
+);
+-- Revisions are recorded by triggers. The triggers store the text as it is
+-- stored in the notes table (snapshot = 2) or, if the text was not
+-- changed, an empty delta (snapshot = 0). The application replaces the
+-- stored texts by compressed snapshots and deltas later.
+CREATE INDEX note_revisions_text
+    ON note_revisions(note_uuid) WHERE snapshot = 2;
+CREATE TRIGGER note_revisions_insert AFTER INSERT ON notes BEGIN
+    INSERT OR REPLACE INTO note_revisions
+        (note_uuid, revision, title, last_changed, snapshot, data)
+        VALUES(NEW.uuid, NEW.revision, NEW.title, NEW.last_changed, 2, NEW.text);
+END;
+CREATE TRIGGER note_revisions_update AFTER UPDATE OF revision ON notes BEGIN
+    INSERT OR REPLACE INTO note_revisions
+        (note_uuid, revision, title, last_changed, snapshot, data)
+        VALUES(
+            NEW.uuid, NEW.revision, NEW.title, NEW.last_changed,
+            iif(NEW.text IS OLD.text, 0, 2),
+            iif(NEW.text IS OLD.text, X'', NEW.text)
+        );
+END;
+
+CREATE TABLE meta(
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE note_changes(
+    version INTEGER PRIMARY KEY,  -- notes_version after the change
+    uuid BLOB NOT NULL  -- valid UUID
 );
+
+INSERT INTO meta(key, value) VALUES('notes_version', 0);
+CREATE TRIGGER notes_version_insert AFTER INSERT ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+    INSERT INTO note_changes(version, uuid)
+        SELECT value, NEW.uuid FROM meta WHERE key = 'notes_version';
+    DELETE FROM note_changes WHERE version <= (
+        SELECT value - 1000 FROM meta WHERE key = 'notes_version'
+    );
+END;
+CREATE TRIGGER notes_version_update AFTER UPDATE ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+    INSERT INTO note_changes(version, uuid)
+        SELECT value, NEW.uuid FROM meta WHERE key = 'notes_version';
+    DELETE FROM note_changes WHERE version <= (
+        SELECT value - 1000 FROM meta WHERE key = 'notes_version'
+    );
+END;
+CREATE TRIGGER notes_version_delete AFTER DELETE ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+    INSERT INTO note_changes(version, uuid)
+        SELECT value, OLD.uuid FROM meta WHERE key = 'notes_version';
+    DELETE FROM note_changes WHERE version <= (
+        SELECT value - 1000 FROM meta WHERE key = 'notes_version'
+    );
+END;
+
+-- Incremented whenever revisions are removed, since this does not change
+-- notes_version.
+INSERT INTO meta(key, value) VALUES('history_version', 0);
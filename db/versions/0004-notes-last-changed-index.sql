@@ -0,0 +1,6 @@
+-- Schema: hej
+-- Dialect: sqlite
+-- Version: 4
+-- API-Level: 1
+
+CREATE INDEX IF NOT EXISTS notes_last_changed_uuid ON notes(last_changed, uuid);
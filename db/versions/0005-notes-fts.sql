@@ -0,0 +1,37 @@
+-- Schema: hej
+-- Dialect: sqlite
+-- Version: 5
+-- API-Level: 1
+
+-- Give notes a stable integer id, which is used as rowid of the full-text
+-- index. The implicit rowid of the old table could change on VACUUM.
+CREATE TABLE IF NOT EXISTS notes_new(
+    id INTEGER PRIMARY KEY,
+    uuid BLOB NOT NULL UNIQUE,  -- valid UUID
+    title TEXT NOT NULL,
+    text TEXT NOT NULL,
+    creation_date TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,  -- YYYY-MM-DD HH:MM:SS
+    last_changed TEXT NOT NULL,  -- YYYY-MM-DDTHH:MM:SSZ
+    favorite INTEGER NOT NULL DEFAULT FALSE
+);
+INSERT INTO notes_new(uuid, title, text, creation_date, last_changed, favorite)
+    SELECT uuid, title, text, creation_date, last_changed, favorite
+    FROM notes;
+DROP TABLE notes;
+ALTER TABLE notes_new RENAME TO notes;
+CREATE INDEX IF NOT EXISTS notes_last_changed_uuid ON notes(last_changed, uuid);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(title, text);
+INSERT INTO notes_fts(rowid, title, text) SELECT id, title, text FROM notes;
+
+CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts(rowid, title, text)
+        VALUES(NEW.id, NEW.title, NEW.text);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF title, text ON notes BEGIN
+    UPDATE notes_fts SET title = NEW.title, text = NEW.text
+        WHERE rowid = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id;
+END;
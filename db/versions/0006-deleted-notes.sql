@@ -0,0 +1,11 @@
+-- Schema: hej
+-- Dialect: sqlite
+-- Version: 6
+-- API-Level: 1
+
+CREATE TABLE IF NOT EXISTS deleted_notes(
+    uuid BLOB PRIMARY KEY,  -- valid UUID
+    deletion_date TEXT NOT NULL  -- YYYY-MM-DDTHH:MM:SSZ
+);
+CREATE INDEX IF NOT EXISTS deleted_notes_deletion_date
+    ON deleted_notes(deletion_date);
@@ -0,0 +1,21 @@
+-- Schema: hej
+-- Dialect: sqlite
+-- Version: 7
+-- API-Level: 1
+
+CREATE TABLE IF NOT EXISTS meta(
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+-- Incremented on every change to the notes table.
+INSERT OR IGNORE INTO meta(key, value) VALUES('notes_version', 0);
+CREATE TRIGGER IF NOT EXISTS notes_version_insert AFTER INSERT ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+END;
+CREATE TRIGGER IF NOT EXISTS notes_version_update AFTER UPDATE ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+END;
+CREATE TRIGGER IF NOT EXISTS notes_version_delete AFTER DELETE ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+END;
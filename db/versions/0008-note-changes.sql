@@ -0,0 +1,39 @@
+-- Schema: hej
+-- Dialect: sqlite
+-- Version: 8
+-- API-Level: 1
+
+-- Log of the last 1000 changes to the notes table, used to invalidate
+-- cached notes in other processes.
+CREATE TABLE IF NOT EXISTS note_changes(
+    version INTEGER PRIMARY KEY,  -- notes_version after the change
+    uuid BLOB NOT NULL  -- valid UUID
+);
+
+DROP TRIGGER IF EXISTS notes_version_insert;
+DROP TRIGGER IF EXISTS notes_version_update;
+DROP TRIGGER IF EXISTS notes_version_delete;
+CREATE TRIGGER notes_version_insert AFTER INSERT ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+    INSERT INTO note_changes(version, uuid)
+        SELECT value, NEW.uuid FROM meta WHERE key = 'notes_version';
+    DELETE FROM note_changes WHERE version <= (
+        SELECT value - 1000 FROM meta WHERE key = 'notes_version'
+    );
+END;
+CREATE TRIGGER notes_version_update AFTER UPDATE ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+    INSERT INTO note_changes(version, uuid)
+        SELECT value, NEW.uuid FROM meta WHERE key = 'notes_version';
+    DELETE FROM note_changes WHERE version <= (
+        SELECT value - 1000 FROM meta WHERE key = 'notes_version'
+    );
+END;
+CREATE TRIGGER notes_version_delete AFTER DELETE ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+    INSERT INTO note_changes(version, uuid)
+        SELECT value, OLD.uuid FROM meta WHERE key = 'notes_version';
+    DELETE FROM note_changes WHERE version <= (
+        SELECT value - 1000 FROM meta WHERE key = 'notes_version'
+    );
+END;
@@ -0,0 +1,7 @@
+-- Schema: hej
+-- Dialect: sqlite
+-- Version: 9
+-- API-Level: 1
+
+-- Incremented on every change to a note.
+ALTER TABLE notes ADD COLUMN revision INTEGER NOT NULL DEFAULT 1;
@@ -0,0 +1,44 @@
+-- Schema: hej
+-- Dialect: sqlite
+-- Version: 10
+-- API-Level: 1
+
+CREATE TABLE IF NOT EXISTS note_revisions(
+    note_uuid BLOB NOT NULL,  -- valid UUID
+    revision INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    last_changed TEXT NOT NULL,  -- YYYY-MM-DDTHH:MM:SSZ
+    -- 1 if data is the zlib compressed text of the note, 0 if it is a delta
+    -- to the previous revision in this table, 2 if it is the text as stored
+    -- in the notes table.
+    snapshot INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY(note_uuid, revision)
+);
+
+-- Revisions are recorded by triggers, so that changing a note takes a
+-- single statement. The triggers store the text as it is stored in the
+-- notes table (snapshot = 2) or, if the text was not changed, an empty
+-- delta (snapshot = 0). The application replaces the stored texts by
+-- compressed snapshots and deltas later.
+CREATE INDEX IF NOT EXISTS note_revisions_text
+    ON note_revisions(note_uuid) WHERE snapshot = 2;
+INSERT OR IGNORE INTO note_revisions
+    SELECT uuid, revision, title, last_changed, 2, text FROM notes;
+-- Incremented whenever revisions are removed, since this does not change
+-- notes_version.
+INSERT OR IGNORE INTO meta(key, value) VALUES('history_version', 0);
+CREATE TRIGGER IF NOT EXISTS note_revisions_insert AFTER INSERT ON notes BEGIN
+    INSERT OR REPLACE INTO note_revisions
+        (note_uuid, revision, title, last_changed, snapshot, data)
+        VALUES(NEW.uuid, NEW.revision, NEW.title, NEW.last_changed, 2, NEW.text);
+END;
+CREATE TRIGGER IF NOT EXISTS note_revisions_update AFTER UPDATE OF revision ON notes BEGIN
+    INSERT OR REPLACE INTO note_revisions
+        (note_uuid, revision, title, last_changed, snapshot, data)
+        VALUES(
+            NEW.uuid, NEW.revision, NEW.title, NEW.last_changed,
+            iif(NEW.text IS OLD.text, 0, 2),
+            iif(NEW.text IS OLD.text, X'', NEW.text)
+        );
+END;
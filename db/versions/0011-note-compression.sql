@@ -0,0 +1,33 @@
+-- Schema: hej
+-- Dialect: sqlite
+-- Version: 11
+-- API-Level: 1
+
+-- If true, text is the zlib compressed UTF-8 text of the note.
+ALTER TABLE notes ADD COLUMN compressed INTEGER NOT NULL DEFAULT FALSE;
+
+-- The triggers only index uncompressed texts, so that they don't depend on
+-- functions registered by the application. The application indexes
+-- compressed texts itself.
+DROP TRIGGER IF EXISTS notes_fts_insert;
+DROP TRIGGER IF EXISTS notes_fts_update;
+DROP TRIGGER IF EXISTS notes_fts_delete;
+
+CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes
+    WHEN NOT NEW.compressed BEGIN
+    INSERT INTO notes_fts(rowid, title, text)
+        VALUES(NEW.id, NEW.title, NEW.text);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_title AFTER UPDATE OF title, text ON notes
+    WHEN NEW.text IS OLD.text AND NEW.title IS NOT OLD.title BEGIN
+    UPDATE notes_fts SET title = NEW.title WHERE rowid = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF text ON notes
+    WHEN NEW.text IS NOT OLD.text BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id;
+    INSERT INTO notes_fts(rowid, title, text)
+        SELECT NEW.id, NEW.title, NEW.text WHERE NOT NEW.compressed;
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id;
+END;
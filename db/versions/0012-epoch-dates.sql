@@ -0,0 +1,139 @@
+-- Schema: hej
+-- Dialect: sqlite
+-- Version: 12
+-- API-Level: 1
+
+-- Dates are stored as integer milliseconds since the epoch (UTC) instead of
+-- text in two different formats. Integer columns need new tables, which
+-- keep the ids, so that the full-text index stays valid.
+
+-- The triggers would break renaming the new tables.
+DROP TRIGGER IF EXISTS notes_fts_insert;
+DROP TRIGGER IF EXISTS notes_fts_title;
+DROP TRIGGER IF EXISTS notes_fts_update;
+DROP TRIGGER IF EXISTS notes_fts_delete;
+DROP TRIGGER IF EXISTS notes_version_insert;
+DROP TRIGGER IF EXISTS notes_version_update;
+DROP TRIGGER IF EXISTS notes_version_delete;
+DROP TRIGGER IF EXISTS note_revisions_insert;
+DROP TRIGGER IF EXISTS note_revisions_update;
+DROP INDEX IF EXISTS notes_last_changed_uuid;
+
+CREATE TABLE IF NOT EXISTS notes_new(
+    id INTEGER PRIMARY KEY,
+    uuid BLOB NOT NULL UNIQUE,  -- valid UUID
+    title TEXT NOT NULL,
+    text TEXT NOT NULL,
+    creation_date INTEGER NOT NULL,  -- milliseconds since the epoch
+    last_changed INTEGER NOT NULL,  -- milliseconds since the epoch
+    favorite INTEGER NOT NULL DEFAULT FALSE,
+    revision INTEGER NOT NULL DEFAULT 1,  -- incremented on every change
+    compressed INTEGER NOT NULL DEFAULT FALSE  -- text is zlib compressed
+);
+INSERT INTO notes_new
+    SELECT id, uuid, title, text,
+        CAST(strftime('%s', creation_date) AS INTEGER) * 1000,
+        CAST(strftime('%s', last_changed) AS INTEGER) * 1000,
+        favorite, revision, compressed
+    FROM notes;
+DROP TABLE notes;
+ALTER TABLE notes_new RENAME TO notes;
+
+DROP INDEX IF EXISTS deleted_notes_deletion_date;
+CREATE TABLE IF NOT EXISTS deleted_notes_new(
+    uuid BLOB PRIMARY KEY,  -- valid UUID
+    deletion_date INTEGER NOT NULL  -- milliseconds since the epoch
+);
+INSERT INTO deleted_notes_new
+    SELECT uuid, CAST(strftime('%s', deletion_date) AS INTEGER) * 1000
+    FROM deleted_notes;
+DROP TABLE deleted_notes;
+ALTER TABLE deleted_notes_new RENAME TO deleted_notes;
+CREATE INDEX IF NOT EXISTS deleted_notes_deletion_date
+    ON deleted_notes(deletion_date);
+
+CREATE TABLE IF NOT EXISTS note_revisions_new(
+    note_uuid BLOB NOT NULL,  -- valid UUID
+    revision INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    last_changed INTEGER NOT NULL,  -- milliseconds since the epoch
+    -- 1 if data is the zlib compressed text of the note, 0 if it is a delta
+    -- to the previous revision in this table, 2 if it is the text as stored
+    -- in the notes table.
+    snapshot INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY(note_uuid, revision)
+);
+INSERT INTO note_revisions_new
+    SELECT note_uuid, revision, title,
+        CAST(strftime('%s', last_changed) AS INTEGER) * 1000, snapshot, data
+    FROM note_revisions;
+DROP TABLE note_revisions;
+ALTER TABLE note_revisions_new RENAME TO note_revisions;
+CREATE INDEX IF NOT EXISTS note_revisions_text
+    ON note_revisions(note_uuid) WHERE snapshot = 2;
+
+CREATE INDEX IF NOT EXISTS notes_last_changed_uuid
+    ON notes(last_changed, uuid);
+CREATE INDEX IF NOT EXISTS notes_creation_date_uuid
+    ON notes(creation_date, uuid);
+CREATE INDEX IF NOT EXISTS notes_favorite_last_changed_uuid
+    ON notes(favorite, last_changed, uuid);
+
+CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes
+    WHEN NOT NEW.compressed BEGIN
+    INSERT INTO notes_fts(rowid, title, text)
+        VALUES(NEW.id, NEW.title, NEW.text);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_title AFTER UPDATE OF title, text ON notes
+    WHEN NEW.text IS OLD.text AND NEW.title IS NOT OLD.title BEGIN
+    UPDATE notes_fts SET title = NEW.title WHERE rowid = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF text ON notes
+    WHEN NEW.text IS NOT OLD.text BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id;
+    INSERT INTO notes_fts(rowid, title, text)
+        SELECT NEW.id, NEW.title, NEW.text WHERE NOT NEW.compressed;
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id;
+END;
+CREATE TRIGGER IF NOT EXISTS notes_version_insert AFTER INSERT ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+    INSERT INTO note_changes(version, uuid)
+        SELECT value, NEW.uuid FROM meta WHERE key = 'notes_version';
+    DELETE FROM note_changes WHERE version <= (
+        SELECT value - 1000 FROM meta WHERE key = 'notes_version'
+    );
+END;
+CREATE TRIGGER IF NOT EXISTS notes_version_update AFTER UPDATE ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+    INSERT INTO note_changes(version, uuid)
+        SELECT value, NEW.uuid FROM meta WHERE key = 'notes_version';
+    DELETE FROM note_changes WHERE version <= (
+        SELECT value - 1000 FROM meta WHERE key = 'notes_version'
+    );
+END;
+CREATE TRIGGER IF NOT EXISTS notes_version_delete AFTER DELETE ON notes BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'notes_version';
+    INSERT INTO note_changes(version, uuid)
+        SELECT value, OLD.uuid FROM meta WHERE key = 'notes_version';
+    DELETE FROM note_changes WHERE version <= (
+        SELECT value - 1000 FROM meta WHERE key = 'notes_version'
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS note_revisions_insert AFTER INSERT ON notes BEGIN
+    INSERT OR REPLACE INTO note_revisions
+        (note_uuid, revision, title, last_changed, snapshot, data)
+        VALUES(NEW.uuid, NEW.revision, NEW.title, NEW.last_changed, 2, NEW.text);
+END;
+CREATE TRIGGER IF NOT EXISTS note_revisions_update AFTER UPDATE OF revision ON notes BEGIN
+    INSERT OR REPLACE INTO note_revisions
+        (note_uuid, revision, title, last_changed, snapshot, data)
+        VALUES(
+            NEW.uuid, NEW.revision, NEW.title, NEW.last_changed,
+            iif(NEW.text IS OLD.text, 0, 2),
+            iif(NEW.text IS OLD.text, X'', NEW.text)
+        );
+END;
@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 import logging
 import os
@@ -7,14 +8,30 @@ from pathlib import Path
 
 from starlette.applications import Starlette
 from starlette.requests import Request
-from starlette.responses import FileResponse
+from starlette.responses import FileResponse, PlainTextResponse
 from starlette.routing import Mount, Route
 from starlette.staticfiles import StaticFiles
 
-from .db import migrate_db
+from .auth import authenticate
+from .backup import BackupManager, backup_dir, backup_interval, backup_keep
+from .broadcast import note_events
+from .db import (
+    db_path,
+    db_pool_size,
+    db_profile,
+    db_url,
+    encode_note_history,
+    history_encode_interval,
+    migrate_db,
+    open_pool,
+    write_transaction,
+)
 from .debug import debug
-from .exc import DBMigrationError
+from .exc import AuthorizationError, DBMigrationError
 from .gql import create_app as gql_app
+from .metrics import collect_metrics, register_collector, unregister_collector
+from .notecache import note_cache_size
+from .querycache import QueryCache, query_cache_size
 
 LOGGER = logging.getLogger(__name__)
 
@@ -35,6 +52,17 @@ def file_app(
     return file_app
 
 
+async def metrics_app(request: Request) -> PlainTextResponse:
+    try:
+        await authenticate(request)
+    except AuthorizationError as exc:
+        return PlainTextResponse(str(exc), status_code=401)
+    metrics = collect_metrics()
+    return PlainTextResponse(
+        "".join(f"{name} {value}\n" for name, value in metrics.items())
+    )
+
+
 @contextlib.asynccontextmanager
 async def lifespan(app: Starlette) -> AsyncGenerator[None]:
     logging.basicConfig(level=logging.INFO)
@@ -43,13 +71,84 @@ async def lifespan(app: Starlette) -> AsyncGenerator[None]:
         migrate_db()
     except DBMigrationError:
         sys.exit(1)
-    yield
+    async with open_pool(
+        db_url(),
+        readers=db_pool_size(),
+        note_cache_size=note_cache_size(),
+        profile=db_profile(),
+    ):
+        async with (
+            _gql_metrics(app.state.query_cache),
+            _periodic_backups(),
+            _periodic_history_encoding(),
+        ):
+            yield
+
+
+@contextlib.asynccontextmanager
+async def _gql_metrics(query_cache: QueryCache) -> AsyncGenerator[None]:
+    collectors = [note_events.metrics, query_cache.metrics]
+    for collector in collectors:
+        register_collector(collector)
+    try:
+        yield
+    finally:
+        for collector in collectors:
+            unregister_collector(collector)
+
+
+@contextlib.asynccontextmanager
+async def _periodic_backups() -> AsyncGenerator[None]:
+    interval = backup_interval()
+    if interval == 0:
+        yield
+        return
+    path = db_path()
+    manager = BackupManager(path, backup_dir(path), keep=backup_keep())
+    task = asyncio.create_task(manager.run_periodically(interval))
+    register_collector(manager.metrics)
+    try:
+        yield
+    finally:
+        unregister_collector(manager.metrics)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+@contextlib.asynccontextmanager
+async def _periodic_history_encoding() -> AsyncGenerator[None]:
+    interval = history_encode_interval()
+    if interval == 0:
+        yield
+        return
+    task = asyncio.create_task(_encode_history_periodically(interval))
+    try:
+        yield
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+async def _encode_history_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # Small batches keep the write lock short.
+            encoded = 1
+            while encoded > 0:
+                async with write_transaction() as t:
+                    encoded = await encode_note_history(t, limit=100)
+        except Exception:
+            LOGGER.exception("Encoding note history failed")
 
 
 def create_app() -> Starlette:
+    query_cache = QueryCache(query_cache_size())
     app = Starlette(
         routes=[
-            Mount("/graphql", gql_app()),
+            Mount("/graphql", gql_app(query_cache)),
             Mount(
                 "/assets",
                 StaticFiles(directory=static_path() / "assets"),
@@ -59,6 +158,7 @@ def create_app() -> Starlette:
                 "/images",
                 StaticFiles(directory=static_path() / "images"),
             ),
+            Route("/metrics", metrics_app),
             Route("/manifest.json", file_app("manifest.json")),
             Route("/robots.txt", file_app("robots.txt")),
             Route("/{p:path}", file_app("index.html")),
@@ -66,6 +166,8 @@ def create_app() -> Starlette:
         lifespan=lifespan,
         debug=debug(),
     )
+    # Used by the lifespan to register the cache's metrics.
+    app.state.query_cache = query_cache
     return app
 
 
@@ -1,7 +1,7 @@
 import hmac
 import os
 
-from starlette.requests import Request
+from starlette.requests import HTTPConnection
 
 from hej.exc import AuthenticationError, CookieUnsetError
 
@@ -15,7 +15,7 @@ def session_key() -> str:
         raise RuntimeError("environment variable 'HEJ_SESSION_KEY' unset")
 
 
-async def authenticate(request: Request) -> None:
+async def authenticate(request: HTTPConnection) -> None:
     key = request.cookies.get(_COOKIE_NAME)
     if key is None:
         raise CookieUnsetError(_COOKIE_NAME)
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import fcntl
+import logging
+import os
+import time
+from collections.abc import Generator, Mapping
+from contextlib import contextmanager
+from pathlib import Path
+
+from .db import backup_db
+from .env import int_env
+
+LOGGER = logging.getLogger(__name__)
+
+
+def backup_dir(db_path: Path) -> Path:
+    path = os.getenv("HEJ_BACKUP_DIR")
+    if path is not None:
+        return Path(path)
+    return db_path.parent / "backups"
+
+
+def backup_interval() -> int:
+    """Return the interval of periodic backups in seconds.
+
+    0 disables periodic backups.
+    """
+    return int_env("HEJ_BACKUP_INTERVAL", 0, minimum=0)
+
+
+def backup_keep() -> int:
+    """Return the number of backups to keep."""
+    return int_env("HEJ_BACKUP_KEEP", 7, minimum=1)
+
+
+class BackupManager:
+    """Online backups of a database into a directory.
+
+    Backups are named after the database and the time of the backup.
+    Only the newest `keep` backups are kept. Periodic backups are
+    coordinated between processes with an flock() on a file next to the
+    database.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        directory: Path,
+        *,
+        keep: int = 7,
+        pages: int = 1024,
+        sleep: float = 0.005,
+    ) -> None:
+        self.db_path = db_path
+        self.directory = directory
+        self.keep = keep
+        self.pages = pages
+        self.sleep = sleep
+        self.backups = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.last_size = 0
+        self.last_time = 0.0
+
+    @property
+    def lock_path(self) -> Path:
+        return self.db_path.parent / f"{self.db_path.name}.backup.lock"
+
+    def backup_paths(self) -> list[Path]:
+        """Return the existing backups, oldest first."""
+        return sorted(self.directory.glob(f"{self.db_path.stem}-*.sqlite"))
+
+    async def backup(self) -> Path:
+        """Back up the database and prune old backups.
+
+        The backup runs in a worker thread, so the event loop is not
+        blocked. The path of the new backup is returned.
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        name = f"{self.db_path.stem}-{now:%Y%m%dT%H%M%SZ}.sqlite"
+        target = self.directory / name
+        partial = target.with_name(f".{name}.{os.getpid()}.partial")
+        start = time.monotonic()
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            await asyncio.to_thread(
+                backup_db,
+                self.db_path,
+                partial,
+                pages=self.pages,
+                sleep=self.sleep,
+            )
+            partial.replace(target)
+        except Exception:
+            self.failures += 1
+            partial.unlink(missing_ok=True)
+            raise
+        self.backups += 1
+        self.last_duration = time.monotonic() - start
+        self.last_size = target.stat().st_size
+        self.last_time = time.time()
+        LOGGER.info(
+            f"Database backed up to {target} in {self.last_duration:.1f}s"
+        )
+        self.prune()
+        return target
+
+    def prune(self) -> list[Path]:
+        """Remove all but the newest backups and return the removed ones."""
+        paths = self.backup_paths()
+        removed = paths[: max(len(paths) - self.keep, 0)]
+        for path in removed:
+            # Another process may have removed it in the meantime.
+            path.unlink(missing_ok=True)
+            LOGGER.info(f"Removed old backup {path}")
+        return removed
+
+    async def backup_if_due(self, interval: float) -> Path | None:
+        """Back up the database, unless another process does.
+
+        The backup is skipped if another process holds the backup lock or
+        made a backup within the last half `interval`, which happens if
+        several app processes back up periodically. Return the path of
+        the new backup or None.
+        """
+        with self._try_lock() as locked:
+            if not locked or self._last_backup_age() < interval / 2:
+                return None
+            return await self.backup()
+
+    @contextmanager
+    def _try_lock(self) -> Generator[bool]:
+        with self.lock_path.open("a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                locked = False
+            else:
+                locked = True
+            try:
+                yield locked
+            finally:
+                if locked:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _last_backup_age(self) -> float:
+        paths = self.backup_paths()
+        if not paths:
+            return float("inf")
+        return time.time() - paths[-1].stat().st_mtime
+
+    async def run_periodically(self, interval: float) -> None:
+        """Back up the database every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.backup_if_due(interval)
+            except Exception:
+                LOGGER.exception("Database backup failed")
+
+    def metrics(self) -> Mapping[str, float]:
+        return {
+            "hej_backups": self.backups,
+            "hej_backup_failures": self.failures,
+            "hej_backup_last_duration_seconds": self.last_duration,
+            "hej_backup_last_size_bytes": self.last_size,
+            "hej_backup_last_timestamp_seconds": self.last_time,
+            "hej_backup_retained": len(self.backup_paths()),
+            "hej_backup_keep": self.keep,
+        }
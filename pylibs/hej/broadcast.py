@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import enum
+import logging
+from collections.abc import AsyncIterator, Mapping
+from dataclasses import dataclass
+from types import TracebackType
+from uuid import UUID
+
+from .exc import SubscriptionOverflowError
+from .note import Note
+
+LOGGER = logging.getLogger(__name__)
+
+
+class NoteEventType(enum.StrEnum):
+    CREATED = "CREATED"
+    UPDATED = "UPDATED"
+    DELETED = "DELETED"
+
+
+@dataclass(frozen=True)
+class NoteEvent:
+    type: NoteEventType
+    uuid: UUID
+    note: Note | None = None
+
+
+class Subscription:
+    """Events received by a single subscriber.
+
+    Iterating over the subscription returns events as they are published.
+    Each subscriber has a bounded queue. Publishers never wait for slow
+    subscribers; instead, a subscriber whose queue overflows is dropped and
+    iterating raises SubscriptionOverflowError.
+    """
+
+    def __init__(self, broadcaster: Broadcaster, queue_size: int) -> None:
+        self._broadcaster = broadcaster
+        self.queue_size = queue_size
+        # Leave room for the overflow marker.
+        self._queue: asyncio.Queue[NoteEvent | None] = asyncio.Queue(
+            queue_size + 1
+        )
+        self.overflowed = False
+
+    async def __aenter__(self) -> Subscription:
+        return self
+
+    async def __aexit__(
+        self,
+        type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self._broadcaster.unsubscribe(self)
+
+    def __aiter__(self) -> AsyncIterator[NoteEvent]:
+        return self
+
+    async def __anext__(self) -> NoteEvent:
+        event = await self._queue.get()
+        if event is None:
+            raise SubscriptionOverflowError()
+        return event
+
+    def put(self, event: NoteEvent) -> bool:
+        """Queue an event. Return False if the queue overflowed."""
+        if self.overflowed:
+            return False
+        if self._queue.qsize() >= self.queue_size:
+            self.overflowed = True
+            self._queue.put_nowait(None)
+            return False
+        self._queue.put_nowait(event)
+        return True
+
+
+class Broadcaster:
+    """In-process hub that distributes note events to all subscribers."""
+
+    def __init__(self, queue_size: int = 100) -> None:
+        self.queue_size = queue_size
+        self._subscriptions: set[Subscription] = set()
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self, self.queue_size)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    def publish(self, event: NoteEvent) -> None:
+        self.published += 1
+        for subscription in list(self._subscriptions):
+            if not subscription.put(event):
+                LOGGER.warning("Dropping subscriber with full event queue")
+                self.unsubscribe(subscription)
+                self.dropped_subscribers += 1
+
+    def metrics(self) -> Mapping[str, float]:
+        return {
+            "hej_subscribers": len(self._subscriptions),
+            "hej_subscription_events_published": self.published,
+            "hej_subscribers_dropped": self.dropped_subscribers,
+        }
+
+
+note_events = Broadcaster()
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import contextlib
+import datetime
+import enum
+import io
+import itertools
+import json
+from collections.abc import Iterable, Iterator, Mapping
+from dataclasses import dataclass
+from pathlib import PurePath
+from typing import IO, Any
+from uuid import UUID, uuid4
+
+from .db import Database, insert_notes, iter_notes
+from .exc import NoteFormatError
+from .note import Note, NoteMeta
+
+
+class NoteFormat(enum.StrEnum):
+    JSONL = "jsonl"
+    TAR = "tar"
+    ZIP = "zip"
+
+
+def guess_format(path: PurePath) -> tuple[NoteFormat, bool]:
+    """Return the format of a file and whether it is gzip compressed."""
+    name = path.name.lower()
+    compress = name.endswith((".gz", ".tgz"))
+    name = name.removesuffix(".gz")
+    if name.endswith((".tar", ".tgz")):
+        return NoteFormat.TAR, compress
+    elif name.endswith(".zip"):
+        return NoteFormat.ZIP, compress
+    else:
+        return NoteFormat.JSONL, compress
+
+
+def note_to_dict(note: Note) -> dict[str, Any]:
+    return {
+        "uuid": str(note.uuid),
+        "title": note.title,
+        "text": note.text,
+        "favorite": note.favorite,
+        "creation_date": note.creation_date.isoformat(),
+        "last_changed": note.last_changed.isoformat(),
+    }
+
+
+def note_meta_to_dict(note: NoteMeta) -> dict[str, Any]:
+    return {
+        "uuid": str(note.uuid),
+        "title": note.title,
+        "favorite": note.favorite,
+        "creation_date": note.creation_date.isoformat(),
+        "last_changed": note.last_changed.isoformat(),
+        "revision": note.revision,
+    }
+
+
+def note_from_dict(data: Mapping[str, Any]) -> Note:
+    """Create a note from an exported note.
+
+    Only the title is required. Notes without a UUID get a new one.
+    """
+    now = datetime.datetime.now(datetime.UTC).replace(microsecond=0)
+    try:
+        uuid = data.get("uuid")
+        title = data["title"]
+        text = data.get("text", "")
+        favorite = data.get("favorite", False)
+        if not isinstance(title, str) or not isinstance(text, str):
+            raise NoteFormatError("title and text must be strings")
+        if not isinstance(favorite, bool):
+            raise NoteFormatError("favorite must be a boolean")
+        return Note(
+            UUID(uuid) if uuid is not None else uuid4(),
+            title,
+            text,
+            favorite,
+            _parse_datetime(data.get("creation_date"), now),
+            _parse_datetime(data.get("last_changed"), now),
+        )
+    except KeyError as exc:
+        raise NoteFormatError(f"missing field {exc}") from None
+    except (TypeError, ValueError) as exc:
+        raise NoteFormatError(str(exc)) from None
+
+
+def _parse_datetime(
+    value: Any, default: datetime.datetime
+) -> datetime.datetime:
+    if value is None:
+        return default
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.UTC)
+    return dt.astimezone(datetime.UTC)
+
+
+def note_to_markdown(note: Note) -> str:
+    """Return a note as Markdown text with a front matter header.
+
+    Header values are JSON encoded, which is also valid YAML.
+    """
+    data = note_to_dict(note)
+    text = data.pop("text")
+    header = "".join(
+        f"{key}: {json.dumps(value, ensure_ascii=False)}\n"
+        for key, value in data.items()
+    )
+    return f"---\n{header}---\n{text}"
+
+
+def note_from_markdown(markdown: str) -> Note:
+    lines = iter(markdown.splitlines(keepends=True))
+    if next(lines, "").rstrip("\r\n") != "---":
+        raise NoteFormatError("missing front matter")
+    data: dict[str, Any] = {}
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line == "---":
+            break
+        key, sep, value = line.partition(":")
+        if not sep:
+            raise NoteFormatError(f"invalid front matter line '{line}'")
+        try:
+            data[key.strip()] = json.loads(value)
+        except ValueError:
+            raise NoteFormatError(f"invalid value for '{key}'") from None
+    else:
+        raise NoteFormatError("unterminated front matter")
+    data["text"] = "".join(lines)
+    return note_from_dict(data)
+
+
+async def export_notes(
+    db: Database,
+    stream: IO[bytes],
+    format: NoteFormat,
+    *,
+    compress: bool = False,
+) -> int:
+    """Write all notes to a stream and return their number.
+
+    Notes are streamed from the database one at a time. `compress`
+    enables gzip compression of JSONL files and tar archives.
+    """
+    if compress and format == NoteFormat.ZIP:
+        raise ValueError("zip archives can't be gzip compressed")
+    notes = iter_notes(db)
+    count = 0
+    if format == NoteFormat.JSONL:
+        # Archive modules are imported on demand to speed up CLI startup.
+        import gzip
+
+        with (
+            gzip.GzipFile(fileobj=stream, mode="wb")
+            if compress
+            else contextlib.nullcontext(stream)
+        ) as f:
+            async for note in notes:
+                line = json.dumps(note_to_dict(note), ensure_ascii=False)
+                f.write(line.encode() + b"\n")
+                count += 1
+    elif format == NoteFormat.TAR:
+        import tarfile
+
+        tar = (
+            tarfile.open(fileobj=stream, mode="w|gz")
+            if compress
+            else tarfile.open(fileobj=stream, mode="w|")
+        )
+        with tar:
+            async for note in notes:
+                data = note_to_markdown(note).encode()
+                info = tarfile.TarInfo(f"{note.uuid}.md")
+                info.size = len(data)
+                info.mtime = int(note.last_changed.timestamp())
+                tar.addfile(info, io.BytesIO(data))
+                count += 1
+    else:
+        import zipfile
+
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as zf:
+            async for note in notes:
+                zf.writestr(f"{note.uuid}.md", note_to_markdown(note))
+                count += 1
+    return count
+
+
+def read_notes(
+    stream: IO[bytes], format: NoteFormat, *, compress: bool = False
+) -> Iterator[Note]:
+    """Read exported notes from a stream one at a time.
+
+    `compress` reads gzip compressed JSONL files. Compression of tar
+    archives is detected automatically. Zip archives require a seekable
+    stream.
+    """
+    if format == NoteFormat.JSONL:
+        lines: Iterable[bytes] = stream
+        if compress:
+            import gzip
+
+            lines = gzip.GzipFile(fileobj=stream, mode="rb")
+        for lineno, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise NoteFormatError("note must be an object")
+                yield note_from_dict(data)
+            except (NoteFormatError, ValueError) as exc:
+                raise NoteFormatError(f"line {lineno}: {exc}") from None
+    elif format == NoteFormat.TAR:
+        import tarfile
+
+        with tarfile.open(fileobj=stream, mode="r|*") as tar:
+            for member in tar:
+                f = tar.extractfile(member) if member.isfile() else None
+                if f is not None and member.name.endswith(".md"):
+                    yield _read_markdown(member.name, f.read())
+    else:
+        import zipfile
+
+        with zipfile.ZipFile(stream) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and info.filename.endswith(".md"):
+                    yield _read_markdown(info.filename, zf.read(info))
+
+
+def _read_markdown(name: str, data: bytes) -> Note:
+    try:
+        return note_from_markdown(data.decode())
+    except (NoteFormatError, ValueError) as exc:
+        raise NoteFormatError(f"{name}: {exc}") from None
+
+
+@dataclass
+class ImportResult:
+    read: int = 0
+    imported: int = 0
+
+    @property
+    def skipped(self) -> int:
+        return self.read - self.imported
+
+
+async def import_notes(
+    db: Database,
+    notes: Iterable[Note],
+    *,
+    replace: bool = False,
+    batch_size: int = 1000,
+) -> ImportResult:
+    """Import notes in transactions of `batch_size` notes.
+
+    Notes with existing UUIDs are replaced if `replace` is true and
+    skipped otherwise.
+    """
+    result = ImportResult()
+    for batch in itertools.batched(notes, batch_size):
+        async with db.begin() as t:
+            result.imported += await insert_notes(t, batch, replace=replace)
+        result.read += len(batch)
+    return result
@@ -1,37 +1,129 @@
 from __future__ import annotations
 
 import asyncio
+import datetime
+import json
+import shlex
 import sys
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Coroutine
 from contextlib import asynccontextmanager
 from pathlib import Path
+from types import TracebackType
+from typing import Any, BinaryIO, TextIO
 from uuid import UUID
 
 import click
 from click.core import Context
 from click.exceptions import BadParameter
 
-from hej.exc import UnknownItemError
+from hej.exc import NoteFormatError, UnknownItemError
 
+from .backup import BackupManager, backup_dir, backup_keep
+from .bulk import (
+    ImportResult,
+    NoteFormat,
+    export_notes,
+    guess_format,
+    import_notes,
+    note_meta_to_dict,
+    read_notes,
+)
 from .db import (
+    Database,
+    NoteSort,
+    SearchResult,
     Transaction,
+    compact_note_history,
     db_path,
     delete_note,
-    initialize_db,
     insert_note,
+    iter_notes_meta,
+    open_db,
     open_transaction,
-    select_all_notes,
+    search_notes,
     select_note,
     update_note,
+    upgrade_db,
 )
 from .note import Note
 
 list_ = list
 
 
+class Session:
+    """Database session shared by the commands run by "hej shell".
+
+    All commands run on one event loop and connection. Each command
+    runs in a savepoint of a transaction that is committed every
+    `batch_size` commands.
+    """
+
+    def __init__(self, db_path: Path, batch_size: int) -> None:
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.runner = asyncio.Runner()
+        self._db: Database | None = None
+        self._transaction: Transaction | None = None
+        self._commands = 0
+
+    def __enter__(self) -> Session:
+        upgrade_db(self.db_path)
+        self._db = Database(f"file:{self.db_path}")
+        self.runner.run(self._db.connect())
+        return self
+
+    def __exit__(
+        self,
+        type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        try:
+            # Failed commands are rolled back by their savepoints, so the
+            # commands before an interruption are kept.
+            if type is None or issubclass(
+                type, (KeyboardInterrupt, click.Abort)
+            ):
+                self.runner.run(self.commit())
+        finally:
+            assert self._db is not None
+            self.runner.run(self._db.close())
+            self.runner.close()
+
+    @asynccontextmanager
+    async def command(self) -> AsyncGenerator[Transaction]:
+        assert self._db is not None
+        if self._transaction is None:
+            await self._db.execute("BEGIN")
+            self._transaction = self._db.begin()
+        async with self._transaction.savepoint("command") as t:
+            yield t
+        self._commands += 1
+        if self._commands % self.batch_size == 0:
+            await self.commit()
+
+    async def commit(self) -> None:
+        if self._transaction is not None:
+            await self._transaction.commit()
+            self._transaction = None
+
+
+def run[T](ctx: Context, coro: Coroutine[Any, Any, T]) -> T:
+    session: Session | None = ctx.obj.get("session")
+    if session is None:
+        return asyncio.run(coro)
+    return session.runner.run(coro)
+
+
 @asynccontextmanager
-async def transaction(db_path: Path) -> AsyncGenerator[Transaction]:
-    initialize_db(db_path)
+async def transaction(ctx: Context) -> AsyncGenerator[Transaction]:
+    session: Session | None = ctx.obj.get("session")
+    if session is not None:
+        async with session.command() as t:
+            yield t
+        return
+    db_path = ctx.obj["db_path"]
+    upgrade_db(db_path)
     db_url = f"file:{db_path}"
     async with open_transaction(db_url) as t:
         yield t
@@ -50,11 +142,11 @@ def cli(ctx: Context, *, database: str | None = None) -> None:
 @click.pass_context
 def create(ctx: Context, *, title: str, text: str | None = None) -> None:
     async def create_note() -> Note:
-        async with transaction(ctx.obj["db_path"]) as db:
+        async with transaction(ctx) as db:
             return await insert_note(db, title, full_text)
 
-    full_text = _read_text(text)
-    note = asyncio.run(create_note())
+    full_text = _read_text(ctx, text)
+    note = run(ctx, create_note())
     click.echo(f"Note created with UUID {note.uuid}")
 
 
@@ -63,38 +155,83 @@ def create(ctx: Context, *, title: str, text: str | None = None) -> None:
 @click.argument("title")
 @click.argument("text", required=False)
 @click.pass_context
-def update(ctx: Context, *, uuid: UUID, title: str, text: str) -> None:
+def update(
+    ctx: Context, *, uuid: UUID, title: str, text: str | None = None
+) -> None:
     async def change_note() -> Note:
-        async with transaction(ctx.obj["db_path"]) as db:
+        async with transaction(ctx) as db:
             return await update_note(db, uuid, title, full_text)
 
-    full_text = _read_text(text)
+    full_text = _read_text(ctx, text)
     try:
-        asyncio.run(change_note())
+        run(ctx, change_note())
     except UnknownItemError:
         raise BadParameter(f"unknown note '{uuid}'", param_hint="uuid")
 
 
-def _read_text(text: str | None) -> str:
+def _read_text(ctx: Context, text: str | None) -> str:
+    """Return the given text or read it from stdin.
+
+    In "hej shell", stdin contains the commands, so the text is required.
+    """
     if text is not None:
         return text
+    elif "session" in ctx.obj:
+        raise click.UsageError(
+            "Missing argument 'TEXT', which is required in \"hej shell\".",
+            ctx=ctx,
+        )
     else:
         return sys.stdin.read()
 
 
 @cli.command()
+@click.option(
+    "--limit", type=click.IntRange(min=1), help="list at most LIMIT notes"
+)
+@click.option(
+    "--sort",
+    type=click.Choice(list_(NoteSort), case_sensitive=False),
+    default=NoteSort.CHANGED,
+    show_default=True,
+)
+@click.option("--favorites", is_flag=True, help="only list favorite notes")
+@click.option(
+    "--format",
+    "format_",
+    type=click.Choice(["text", "jsonl"], case_sensitive=False),
+    default="text",
+    show_default=True,
+)
 @click.pass_context
-def list(ctx: Context) -> None:
-    async def list_notes() -> list_[Note]:
-        async with transaction(ctx.obj["db_path"]) as db:
-            return await select_all_notes(db)
-
-    notes = asyncio.run(list_notes())
-    for note in notes:
-        click.echo(f"{note.uuid} {note.title}")
-    if notes:
-        click.echo()
-    click.echo(f"Total {len(notes)} notes")
+def list(
+    ctx: Context,
+    *,
+    limit: int | None = None,
+    sort: NoteSort,
+    favorites: bool,
+    format_: str,
+) -> None:
+    async def list_notes() -> int:
+        count = 0
+        async with transaction(ctx) as db:
+            notes = iter_notes_meta(
+                db, sort=sort, favorites_only=favorites, limit=limit
+            )
+            async for note in notes:
+                if format_ == "jsonl":
+                    data = note_meta_to_dict(note)
+                    click.echo(json.dumps(data, ensure_ascii=False))
+                else:
+                    click.echo(f"{note.uuid} {note.title}")
+                count += 1
+        return count
+
+    count = run(ctx, list_notes())
+    if format_ == "text":
+        if count:
+            click.echo()
+        click.echo(f"Total {count} notes")
 
 
 @cli.command()
@@ -102,11 +239,11 @@ def list(ctx: Context) -> None:
 @click.argument("uuid", type=click.UUID)
 def view(ctx: Context, *, uuid: UUID) -> None:
     async def read_note() -> Note:
-        async with transaction(ctx.obj["db_path"]) as db:
+        async with transaction(ctx) as db:
             return await select_note(db, uuid)
 
     try:
-        note = asyncio.run(read_note())
+        note = run(ctx, read_note())
     except UnknownItemError:
         raise BadParameter(f"unknown note '{uuid}'", param_hint="uuid")
 
@@ -117,19 +254,252 @@ def view(ctx: Context, *, uuid: UUID) -> None:
     click.echo(f"Last changed: {note.last_changed}")
 
 
+@cli.command()
+@click.argument("query")
+@click.option(
+    "--limit", type=click.IntRange(min=1), default=20, show_default=True
+)
+@click.pass_context
+def search(ctx: Context, *, query: str, limit: int) -> None:
+    async def find_notes() -> list_[SearchResult]:
+        async with transaction(ctx) as db:
+            return await search_notes(db, query, first=limit, with_text=False)
+
+    results = run(ctx, find_notes())
+    for result in results:
+        click.echo(f"{result.note.uuid} {result.note.title}")
+        click.echo(f"    {' '.join(result.snippet.split())}")
+    if results:
+        click.echo()
+    click.echo(f"Found {len(results)} notes")
+
+
 @cli.command()
 @click.argument("uuid", type=click.UUID)
 @click.pass_context
 def delete(ctx: Context, *, uuid: UUID) -> None:
     async def remove_note() -> None:
-        async with transaction(ctx.obj["db_path"]) as db:
+        async with transaction(ctx) as db:
             await delete_note(db, uuid)
 
     try:
-        asyncio.run(remove_note())
+        run(ctx, remove_note())
     except UnknownItemError:
         raise BadParameter(f"unknown note '{uuid}'", param_hint="uuid")
 
 
+@cli.command("compact-history")
+@click.option(
+    "--days",
+    type=click.IntRange(min=0),
+    default=30,
+    show_default=True,
+    help="keep all revisions of the last DAYS days",
+)
+@click.pass_context
+def compact_history(ctx: Context, *, days: int) -> None:
+    async def compact() -> int:
+        async with transaction(ctx) as db:
+            return await compact_note_history(db, before)
+
+    before = datetime.datetime.now(datetime.UTC) - datetime.timedelta(days)
+    removed = run(ctx, compact())
+    click.echo(f"Removed {removed} revisions")
+
+
+@asynccontextmanager
+async def database(db_path: Path) -> AsyncGenerator[Database]:
+    upgrade_db(db_path)
+    async with open_db(f"file:{db_path}") as db:
+        yield db
+
+
+_FORMAT_OPTION = click.option(
+    "--format",
+    "format_",
+    type=click.Choice(list_(NoteFormat), case_sensitive=False),
+    help="file format  [default: guessed from FILE, or jsonl]",
+)
+
+
+@cli.command()
+@click.argument("file", type=click.File("wb"), default="-")
+@_FORMAT_OPTION
+@click.pass_context
+def export(
+    ctx: Context, *, file: BinaryIO, format_: NoteFormat | None = None
+) -> None:
+    async def export_all() -> int:
+        async with database(ctx.obj["db_path"]) as db:
+            return await export_notes(db, file, note_format, compress=compress)
+
+    note_format, compress = _file_format(file, format_)
+    count = asyncio.run(export_all())
+    click.echo(f"Exported {count} notes", err=True)
+
+
+def _file_format(
+    file: BinaryIO, format_: NoteFormat | None
+) -> tuple[NoteFormat, bool]:
+    note_format, compress = guess_format(Path(file.name))
+    note_format = format_ or note_format
+    if compress and note_format == NoteFormat.ZIP:
+        raise BadParameter(
+            "zip archives can't be gzip compressed", param_hint="file"
+        )
+    return note_format, compress
+
+
+@cli.command("import")
+@click.argument("file", type=click.File("rb"), default="-")
+@_FORMAT_OPTION
+@click.option(
+    "--replace",
+    is_flag=True,
+    help="replace existing notes with the same UUID instead of skipping",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    show_default=True,
+    help="number of notes per transaction",
+)
+@click.pass_context
+def import_(
+    ctx: Context,
+    *,
+    file: BinaryIO,
+    format_: NoteFormat | None = None,
+    replace: bool,
+    batch_size: int,
+) -> None:
+    async def import_all() -> ImportResult:
+        async with database(ctx.obj["db_path"]) as db:
+            notes = read_notes(file, note_format, compress=compress)
+            return await import_notes(
+                db, notes, replace=replace, batch_size=batch_size
+            )
+
+    note_format, compress = _file_format(file, format_)
+    if note_format == NoteFormat.ZIP and not file.seekable():
+        raise BadParameter("zip archives must be files", param_hint="file")
+    try:
+        result = asyncio.run(import_all())
+    except NoteFormatError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(
+        f"Imported {result.imported} notes, skipped {result.skipped} notes"
+    )
+
+
+@cli.command()
+@click.argument(
+    "directory",
+    type=click.Path(file_okay=False, path_type=Path),
+    required=False,
+)
+@click.option(
+    "--keep",
+    type=click.IntRange(min=1),
+    help="number of backups to keep",
+)
+@click.pass_context
+def backup(
+    ctx: Context, *, directory: Path | None = None, keep: int | None = None
+) -> None:
+    path = ctx.obj["db_path"]
+    if not path.exists():
+        raise click.ClickException(f"database {path} does not exist")
+    manager = BackupManager(
+        path,
+        directory or backup_dir(path),
+        keep=keep or backup_keep(),
+        sleep=0,
+    )
+    target = asyncio.run(manager.backup())
+    click.echo(
+        f"Database backed up to {target} ({manager.last_size} bytes) "
+        f"in {manager.last_duration:.1f}s"
+    )
+
+
+# Commands that can be run by "hej shell".
+_SHELL_COMMANDS = {
+    "create",
+    "update",
+    "list",
+    "view",
+    "search",
+    "delete",
+    "compact-history",
+}
+
+
+@cli.command()
+@click.argument("file", type=click.File("r"), default="-")
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="number of commands per transaction",
+)
+@click.pass_context
+def shell(ctx: Context, *, file: TextIO, batch_size: int) -> None:
+    """Run commands read from FILE, one per line.
+
+    The database is opened and checked only once. Lines use shell
+    quoting rules, and empty lines and lines starting with # are
+    ignored. A failed command is rolled back and reported, and the
+    remaining commands are still run. Note texts can't be read from stdin
+    and must be passed as arguments.
+    """
+    failures = 0
+    with Session(ctx.obj["db_path"], batch_size) as session:
+        ctx.obj["session"] = session
+        try:
+            for lineno, line in enumerate(file, 1):
+                if not _run_shell_line(ctx, line):
+                    click.echo(f"Command in line {lineno} failed", err=True)
+                    failures += 1
+        finally:
+            del ctx.obj["session"]
+    if failures:
+        raise click.ClickException(f"{failures} commands failed")
+
+
+def _run_shell_line(ctx: Context, line: str) -> bool:
+    # Run commands as if invoked as "hej <command>".
+    ctx = ctx.parent or ctx
+    try:
+        args = shlex.split(line, comments=True)
+    except ValueError as exc:
+        click.echo(f"Error: {exc}", err=True)
+        return False
+    if not args:
+        return True
+    name, *args = args
+    command = cli.get_command(ctx, name)
+    if command is None or name not in _SHELL_COMMANDS:
+        click.echo(f"Error: unknown command '{name}'", err=True)
+        return False
+    try:
+        with command.make_context(name, args, parent=ctx) as sub_ctx:
+            command.invoke(sub_ctx)
+    except click.ClickException as exc:
+        exc.show()
+        return False
+    except click.exceptions.Exit:
+        pass
+    except click.Abort:
+        raise
+    except Exception as exc:
+        # The command's savepoint was already rolled back.
+        click.echo(f"Error: {exc}", err=True)
+        return False
+    return True
+
+
 def main() -> None:
     cli(obj={})
@@ -1,25 +1,54 @@
 from __future__ import annotations
 
+import asyncio
 import datetime
+import enum
+import fcntl
 import logging
 import os
-import shutil
+import re
+import sqlite3
 import time
-from collections.abc import AsyncGenerator, AsyncIterable, Generator, Iterable
+import zlib
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Collection,
+    Generator,
+    Iterable,
+    Mapping,
+    Sequence,
+)
 from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 from sqlite3.dbapi2 import Row
 from types import TracebackType
-from typing import Any
+from typing import TYPE_CHECKING, Any
 from uuid import UUID, uuid4
 
 import aiosqlite
 from aiosqlite import Connection
-from dbupgrade import MAX_API_LEVEL, MAX_VERSION, VersionInfo, db_upgrade
-from dbupgrade.result import UpgradeResult
 
-from .exc import DBMigrationError, UnknownItemError
-from .note import Note
+from .env import int_env
+from .exc import DBMigrationError, RevisionConflictError, UnknownItemError
+from .history import (
+    SNAPSHOT_INTERVAL,
+    NoteRevision,
+    RevisionFormat,
+    apply_delta,
+    decode_snapshot,
+    encode_delta,
+    encode_snapshot,
+)
+from .metrics import register_collector, unregister_collector
+from .note import DeletedNote, Note, NoteMeta
+from .notecache import NoteCache
+from .patch import TextEdit, apply_edits
+
+if TYPE_CHECKING:
+    from dbupgrade.result import UpgradeResult
 
 LOGGER = logging.getLogger(__name__)
 
@@ -48,18 +77,120 @@ def db_url(database: str | None = None) -> str:
     return f"file:{db_path(database)}"
 
 
-def db_datetime(dt: datetime.datetime) -> str:
-    return dt.isoformat()[:19].replace("T", " ")
+def db_pool_size() -> int:
+    return int_env("HEJ_DB_POOL_SIZE", 4, minimum=1)
+
+
+def db_compress_min_size() -> int:
+    """Return the size in bytes from which note texts are compressed.
+
+    0 disables compression.
+    """
+    return int_env("HEJ_DB_COMPRESS_MIN_SIZE", 4096, minimum=0)
+
+
+def history_encode_interval() -> int:
+    """Return the interval in seconds to encode recorded note revisions.
+
+    0 disables encoding by the app.
+    """
+    return int_env("HEJ_HISTORY_ENCODE_INTERVAL", 60, minimum=0)
+
+
+@dataclass(frozen=True)
+class ConnectionProfile:
+    """SQLite settings applied to long-lived connections."""
+
+    journal_mode: str = "wal"
+    synchronous: str = "normal"
+    busy_timeout: int = 5000  # milliseconds
+    cache_size: int = -16000  # pages, or KiB if negative
+    mmap_size: int = 256 * 1024 * 1024  # bytes
+
+    def pragmas(self) -> list[str]:
+        """Return the per-connection pragmas.
+
+        The journal mode is stored in the database file and is not
+        included.
+        """
+        return [
+            f"synchronous = {self.synchronous}",
+            f"busy_timeout = {self.busy_timeout}",
+            f"cache_size = {self.cache_size}",
+            f"mmap_size = {self.mmap_size}",
+        ]
+
+
+_JOURNAL_MODES = {"delete", "truncate", "persist", "memory", "wal", "off"}
+_SYNCHRONOUS_MODES = {"off", "normal", "full", "extra"}
+
+
+def db_profile() -> ConnectionProfile:
+    """Return the connection profile configured by the environment."""
+    default = ConnectionProfile()
+    journal_mode = os.getenv("HEJ_DB_JOURNAL_MODE", default.journal_mode)
+    if journal_mode.lower() not in _JOURNAL_MODES:
+        raise RuntimeError(f"invalid HEJ_DB_JOURNAL_MODE '{journal_mode}'")
+    synchronous = os.getenv("HEJ_DB_SYNCHRONOUS", default.synchronous)
+    if synchronous.lower() not in _SYNCHRONOUS_MODES:
+        raise RuntimeError(f"invalid HEJ_DB_SYNCHRONOUS '{synchronous}'")
+    return ConnectionProfile(
+        journal_mode=journal_mode.lower(),
+        synchronous=synchronous.lower(),
+        busy_timeout=int_env("HEJ_DB_BUSY_TIMEOUT", default.busy_timeout),
+        cache_size=int_env("HEJ_DB_CACHE_SIZE", default.cache_size),
+        mmap_size=int_env("HEJ_DB_MMAP_SIZE", default.mmap_size),
+    )
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+_MILLISECOND = datetime.timedelta(milliseconds=1)
+_MILLISECONDS_PER_DAY = 24 * 60 * 60 * 1000
 
 
-def db_datetime_old(dt: datetime.datetime) -> str:
-    return dt.isoformat()[:19] + "Z"
+def db_datetime(dt: datetime.datetime) -> int:
+    """Return a date as stored in the database.
 
+    Dates are stored as milliseconds since the epoch.
+    """
+    return (dt - _EPOCH) // _MILLISECOND
 
-def datetime_from_db(s: str) -> datetime.datetime:
-    if not s.endswith("Z"):
-        s += "Z"
-    return datetime.datetime.fromisoformat(s[:-1]).replace(tzinfo=datetime.UTC)
+
+def datetime_from_db(ms: int) -> datetime.datetime:
+    # The float division is exact to the microsecond up to the year 2242.
+    return datetime.datetime.fromtimestamp(ms / 1000, datetime.UTC)
+
+
+def _db_now() -> datetime.datetime:
+    """Return the current date with the precision of stored dates."""
+    now = datetime.datetime.now(datetime.UTC)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def encode_note_text(text: str) -> tuple[str | bytes, bool]:
+    """Return the value stored in the text column and the compressed flag.
+
+    Texts are only compressed if they are large enough and compression
+    actually saves space.
+    """
+    min_size = db_compress_min_size()
+    if min_size == 0:
+        return text, False
+    data = text.encode()
+    if len(data) < min_size:
+        return text, False
+    compressed = zlib.compress(data)
+    if len(compressed) >= len(data):
+        return text, False
+    return compressed, True
+
+
+def decode_note_text(value: str | bytes, compressed: bool) -> str:
+    if compressed:
+        assert isinstance(value, bytes)
+        return zlib.decompress(value).decode()
+    assert isinstance(value, str)
+    return value
 
 
 class _ConnectionBase:
@@ -67,12 +198,26 @@ class _ConnectionBase:
     def db(self) -> Connection:
         raise NotImplementedError()
 
+    @property
+    def note_cache(self) -> NoteCache | None:
+        """Cache that notes can be read from."""
+        return None
+
+    def note_changed(self, uuid: UUID, note: Note | None) -> None:
+        """Record that a note was written or (if None) deleted."""
+
     async def execute(
         self, sql: str, parameters: Iterable[Any] | None = None
     ) -> int:
         async with await self.db.execute(sql, parameters) as c:
             return c.rowcount  # type: ignore
 
+    async def execute_many(
+        self, sql: str, parameters: Iterable[Iterable[Any]]
+    ) -> int:
+        async with await self.db.executemany(sql, parameters) as c:
+            return c.rowcount  # type: ignore
+
     async def execute_fetchall(
         self, sql: str, parameters: Iterable[Any] | None = None
     ) -> AsyncIterable[Row]:
@@ -88,8 +233,11 @@ class _ConnectionBase:
 
 
 class Database(_ConnectionBase):
-    def __init__(self, db_name: str) -> None:
+    def __init__(
+        self, db_name: str, profile: ConnectionProfile | None = None
+    ) -> None:
         self.db_name = db_name
+        self.profile = profile
         self._db: Connection | None = None
 
     @property
@@ -99,8 +247,7 @@ class Database(_ConnectionBase):
         return self._db
 
     async def __aenter__(self) -> Database:
-        self._db = await aiosqlite.connect(self.db_name, uri=True)
-        self._db.row_factory = aiosqlite.Row
+        await self.connect()
         return self
 
     async def __aexit__(
@@ -109,11 +256,22 @@ class Database(_ConnectionBase):
         exc: BaseException | None,
         tb: TracebackType | None,
     ) -> None:
+        await self.close()
+
+    async def connect(self) -> None:
+        self._db = await aiosqlite.connect(self.db_name, uri=True)
+        self._db.row_factory = aiosqlite.Row
+        if self.profile is not None:
+            for pragma in self.profile.pragmas():
+                await self.execute(f"PRAGMA {pragma}")
+
+    async def close(self) -> None:
         if self._db:
             await self._db.close()
+            self._db = None
 
-    def begin(self) -> Transaction:
-        return Transaction(self.db)
+    def begin(self, note_cache: NoteCache | None = None) -> Transaction:
+        return Transaction(self.db, note_cache)
 
     async def execute_commit(
         self, sql: str, parameters: Iterable[Any] | None = None
@@ -127,13 +285,28 @@ class Database(_ConnectionBase):
 
 
 class Transaction(_ConnectionBase):
-    def __init__(self, db: Connection) -> None:
+    def __init__(
+        self, db: Connection, note_cache: NoteCache | None = None
+    ) -> None:
         self._db = db
+        self._note_cache = note_cache
+        self._note_changes: list[tuple[UUID, Note | None]] = []
 
     @property
     def db(self) -> Connection:
         return self._db
 
+    @property
+    def note_cache(self) -> NoteCache | None:
+        # After a write, reads see uncommitted data that must not be cached.
+        return self._note_cache if not self._note_changes else None
+
+    def note_changed(self, uuid: UUID, note: Note | None) -> None:
+        self._note_changes.append((uuid, note))
+
+    def savepoint(self, name: str) -> Savepoint:
+        return Savepoint(self, name)
+
     async def __aenter__(self) -> Transaction:
         return self
 
@@ -141,12 +314,69 @@ class Transaction(_ConnectionBase):
         self,
         type: type[BaseException] | None,
         exc: BaseException | None,
-        tb: TracebackType,
+        tb: TracebackType | None,
     ) -> None:
         if type is None:
-            await self.db.commit()
+            await self.commit()
         else:
-            await self.db.rollback()
+            await self.rollback()
+
+    async def commit(self) -> None:
+        if self._note_cache is None or not self._note_changes:
+            await self.db.commit()
+            return
+        version = await select_notes_version(self)
+        changed = await _select_changed_uuids(
+            self, self._note_cache.version, version
+        )
+        notes = None
+        if changed is not None and len(changed) != len(self._note_changes):
+            notes = await _select_changed_notes(
+                self, self._note_cache, changed
+            )
+        await self.db.commit()
+        self._note_cache.apply_changes(
+            dict(self._note_changes),
+            len(self._note_changes),
+            version,
+            changed,
+            notes,
+        )
+
+    async def rollback(self) -> None:
+        await self.db.rollback()
+
+
+class Savepoint(Transaction):
+    """Nested transaction that can be rolled back on its own.
+
+    Committing a savepoint releases it into the parent transaction.
+    """
+
+    def __init__(self, parent: Transaction, name: str) -> None:
+        super().__init__(parent.db, parent._note_cache)
+        self.parent = parent
+        self.name = name
+
+    @property
+    def note_cache(self) -> NoteCache | None:
+        return self.parent.note_cache if not self._note_changes else None
+
+    async def __aenter__(self) -> Savepoint:
+        await self.begin()
+        return self
+
+    async def begin(self) -> None:
+        await self.execute(f"SAVEPOINT {self.name}")
+
+    async def commit(self) -> None:
+        await self.execute(f"RELEASE {self.name}")
+        for uuid, note in self._note_changes:
+            self.parent.note_changed(uuid, note)
+
+    async def rollback(self) -> None:
+        await self.execute(f"ROLLBACK TO {self.name}")
+        await self.execute(f"RELEASE {self.name}")
 
 
 @asynccontextmanager
@@ -162,77 +392,851 @@ async def open_transaction(db_name: str) -> AsyncGenerator[Transaction]:
             yield t
 
 
-MIGRATE_LOCK = Path("/tmp/hej.migrate.lock")
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    wait_time_total: float = 0.0
+    wait_time_max: float = 0.0
+
+    def record_checkout(self, wait_time: float) -> None:
+        self.checkouts += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+
+class _WriteJob:
+    def __init__(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.enqueued = time.perf_counter()
+        self.started: asyncio.Future[Savepoint] = loop.create_future()
+        self.finished: asyncio.Future[bool] = loop.create_future()
+        self.committed: asyncio.Future[None] = loop.create_future()
+
+
+def _set_exception(future: asyncio.Future[Any], exc: BaseException) -> None:
+    if not future.done():
+        future.set_exception(exc)
+
+
+class ConnectionPool:
+    """Long-lived database connections shared by all requests.
+
+    Up to `readers` read-only connections are opened on demand. All writes
+    are queued and executed by a single writer connection. Writes that
+    are queued at the same time are batched into one transaction of at
+    most `write_batch_size` writes. Each write runs in its own savepoint,
+    so a failing write does not affect the other writes of a batch, but
+    writes are only reported as done after the batch was committed.
+    If `note_cache_size` is not 0, notes read through the pool are cached.
+    """
+
+    def __init__(
+        self,
+        db_name: str,
+        *,
+        readers: int = 4,
+        note_cache_size: int = 0,
+        profile: ConnectionProfile | None = None,
+        write_batch_size: int = 100,
+    ) -> None:
+        self.db_name = db_name
+        self.max_readers = readers
+        self.profile = profile
+        self.write_batch_size = write_batch_size
+        self.note_cache = (
+            NoteCache(note_cache_size) if note_cache_size > 0 else None
+        )
+        self.reader_stats = PoolStats()
+        self.writer_stats = PoolStats()
+        self.write_batches = 0
+        self.write_batch_size_max = 0
+        self._reader_slots = asyncio.Semaphore(readers)
+        self._idle_readers: list[Database] = []
+        self._open_readers: list[Database] = []
+        self._writer: Database | None = None
+        self._write_queue: asyncio.Queue[_WriteJob] = asyncio.Queue()
+        self._writer_task: asyncio.Task[None] | None = None
+
+    async def open(self) -> None:
+        self._writer = Database(self.db_name, self.profile)
+        await self._writer.connect()
+        if self.profile is not None:
+            await self._writer.execute(
+                f"PRAGMA journal_mode = {self.profile.journal_mode}"
+            )
+        self._writer_task = asyncio.create_task(self._run_writer())
+
+    async def close(self) -> None:
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        while not self._write_queue.empty():
+            job = self._write_queue.get_nowait()
+            _set_exception(
+                job.started, RuntimeError("connection pool was closed")
+            )
+        for db in self._open_readers:
+            await db.close()
+        self._open_readers.clear()
+        self._idle_readers.clear()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def read(self) -> AsyncGenerator[Transaction]:
+        start = time.perf_counter()
+        async with self._reader_slots:
+            self.reader_stats.record_checkout(time.perf_counter() - start)
+            db = await self._checkout_reader()
+            try:
+                async with db.begin(self.note_cache) as t:
+                    yield t
+            finally:
+                self._idle_readers.append(db)
+
+    async def _checkout_reader(self) -> Database:
+        if self._idle_readers:
+            return self._idle_readers.pop()
+        db = Database(self.db_name, self.profile)
+        await db.connect()
+        await db.execute("PRAGMA query_only = ON")
+        self._open_readers.append(db)
+        return db
+
+    @asynccontextmanager
+    async def write(self) -> AsyncGenerator[Transaction]:
+        """Queue a write and wait until it was committed."""
+        if self._writer_task is None:
+            raise RuntimeError("connection pool is not open")
+        job = _WriteJob()
+        self._write_queue.put_nowait(job)
+        try:
+            t = await job.started
+            self.writer_stats.record_checkout(
+                time.perf_counter() - job.enqueued
+            )
+            yield t
+        except BaseException:
+            # The writer waits for the write if it was started, even if
+            # the caller was cancelled before noticing.
+            if (
+                job.started.done()
+                and not job.started.cancelled()
+                and job.started.exception() is None
+            ):
+                job.finished.set_result(False)
+            raise
+        job.finished.set_result(True)
+        await job.committed
+
+    async def _run_writer(self) -> None:
+        assert self._writer is not None
+        while True:
+            job = await self._write_queue.get()
+            jobs: list[_WriteJob] = []
+            batch = self._writer.begin(self.note_cache)
+            try:
+                await batch.execute("BEGIN IMMEDIATE")
+                while True:
+                    if await self._run_write_job(batch, job):
+                        jobs.append(job)
+                    if len(jobs) >= self.write_batch_size:
+                        break
+                    try:
+                        job = self._write_queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                await batch.commit()
+            except Exception as exc:
+                LOGGER.exception("Write batch failed")
+                _set_exception(job.started, exc)
+                for j in {job, *jobs}:
+                    # Only successful writes wait for the commit.
+                    if j.finished.done() and j.finished.result():
+                        _set_exception(j.committed, exc)
+                if self._writer.db.in_transaction:
+                    await batch.rollback()
+                continue
+            self.write_batches += 1
+            self.write_batch_size_max = max(
+                self.write_batch_size_max, len(jobs)
+            )
+            for j in jobs:
+                if not j.committed.done():
+                    j.committed.set_result(None)
+
+    async def _run_write_job(self, batch: Transaction, job: _WriteJob) -> bool:
+        """Run a write in a savepoint. Return False if it was cancelled."""
+        if job.started.done():
+            return False
+        savepoint = batch.savepoint("write_job")
+        await savepoint.begin()
+        job.started.set_result(savepoint)
+        if await job.finished:
+            await savepoint.commit()
+        else:
+            await savepoint.rollback()
+        return True
+
+    def metrics(self) -> Mapping[str, float]:
+        return {
+            "hej_db_pool_readers_max": self.max_readers,
+            "hej_db_pool_readers_open": len(self._open_readers),
+            "hej_db_pool_reader_checkouts": self.reader_stats.checkouts,
+            "hej_db_pool_reader_wait_seconds_total": (
+                self.reader_stats.wait_time_total
+            ),
+            "hej_db_pool_reader_wait_seconds_max": (
+                self.reader_stats.wait_time_max
+            ),
+            "hej_db_pool_writer_checkouts": self.writer_stats.checkouts,
+            "hej_db_pool_writer_wait_seconds_total": (
+                self.writer_stats.wait_time_total
+            ),
+            "hej_db_pool_writer_wait_seconds_max": (
+                self.writer_stats.wait_time_max
+            ),
+            "hej_db_pool_write_queue_length": self._write_queue.qsize(),
+            "hej_db_pool_write_batches": self.write_batches,
+            "hej_db_pool_write_batch_size_max": self.write_batch_size_max,
+        }
+
+
+_pool: ConnectionPool | None = None
+
+
+@asynccontextmanager
+async def open_pool(
+    db_name: str,
+    *,
+    readers: int = 4,
+    note_cache_size: int = 0,
+    profile: ConnectionProfile | None = None,
+) -> AsyncGenerator[ConnectionPool]:
+    """Open the pool used by read_transaction() and write_transaction()."""
+    global _pool
+    pool = ConnectionPool(
+        db_name,
+        readers=readers,
+        note_cache_size=note_cache_size,
+        profile=profile,
+    )
+    await pool.open()
+    _pool = pool
+    register_collector(pool.metrics)
+    if pool.note_cache is not None:
+        register_collector(pool.note_cache.metrics)
+    try:
+        yield pool
+    finally:
+        if pool.note_cache is not None:
+            unregister_collector(pool.note_cache.metrics)
+        unregister_collector(pool.metrics)
+        _pool = None
+        await pool.close()
+
+
+@asynccontextmanager
+async def read_transaction() -> AsyncGenerator[Transaction]:
+    """Start a read-only transaction, using the pool if it is open."""
+    if _pool is None:
+        async with open_transaction(db_url()) as t:
+            yield t
+    else:
+        async with _pool.read() as t:
+            yield t
+
+
+@asynccontextmanager
+async def write_transaction() -> AsyncGenerator[Transaction]:
+    """Start a writing transaction, using the pool if it is open."""
+    if _pool is None:
+        async with open_transaction(db_url()) as t:
+            yield t
+    else:
+        async with _pool.write() as t:
+            yield t
+
+
+def db_migrate_timeout() -> float | None:
+    """Return how long to wait for another process's migration in seconds.
+
+    None means waiting indefinitely.
+    """
+    timeout = int_env("HEJ_DB_MIGRATE_TIMEOUT", 600)
+    return timeout if timeout > 0 else None
 
 
 @contextmanager
-def migrate_lock() -> Generator[None]:
+def migrate_lock(path: Path, timeout: float | None = None) -> Generator[None]:
+    """Hold the migration lock of the database at the given path.
+
+    The lock is an flock() on a file next to the database, which the
+    kernel releases when the owning process dies. The file contains the
+    owner's PID for diagnostics. Raise DBMigrationError if the lock could
+    not be acquired within `timeout` seconds.
+    """
+    lock_path = path.parent / f"{path.name}.migrate.lock"
+    with lock_path.open("a+") as f:
+        if timeout is None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            _acquire_flock(f, timeout)
+        f.truncate(0)
+        f.write(str(os.getpid()))
+        f.flush()
+        try:
+            yield
+        finally:
+            f.truncate(0)
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _acquire_flock(f: Any, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    waiting = False
     while True:
         try:
-            with MIGRATE_LOCK.open("x"):
-                pass
-            break
-        except FileExistsError:
-            time.sleep(0.1)
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            pass
+        owner = _lock_owner(f)
+        if not waiting:
+            LOGGER.info(f"Waiting for database migration by PID {owner}")
+            waiting = True
+        if time.monotonic() >= deadline:
+            if owner is not None and not _pid_alive(owner):
+                # The lock file descriptor was inherited by another process.
+                message = (
+                    f"migration lock is held, but its owner PID {owner} "
+                    "is no longer running"
+                )
+            else:
+                message = f"timed out waiting for migration by PID {owner}"
+            LOGGER.error(message.capitalize())
+            raise DBMigrationError(message)
+        time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        delay = min(delay * 2, 1)
+
+
+def _lock_owner(f: Any) -> int | None:
+    f.seek(0)
     try:
-        yield
-    finally:
-        MIGRATE_LOCK.unlink()
+        return int(f.read())
+    except ValueError:
+        return None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
 
 
 def migrate_db() -> None:
-    with migrate_lock():
-        path = db_path()
-        path.touch()
-        new_path = path.parent / f"{path.name}.{os.getpid()}"
-        shutil.copy(path, new_path)
+    path = db_path()
+    if not db_migration_pending(path):
+        LOGGER.info("Database is up to date")
+        return
+    with migrate_lock(path, db_migrate_timeout()):
+        if not db_migration_pending(path):
+            LOGGER.info("Database was migrated by another process")
+            return
+        backup_path: Path | None = None
+        if path.exists() and path.stat().st_size > 0:
+            backup_path = path.parent / f"{path.name}.{os.getpid()}"
+            backup_db(path, backup_path)
         result = initialize_db(path)
         if not result.success:
-            LOGGER.error(
-                f"Database migration failed, old database kept as {new_path}"
-            )
+            if backup_path is not None:
+                LOGGER.error(
+                    "Database migration failed, "
+                    f"old database kept as {backup_path}"
+                )
             raise DBMigrationError("database migration failed")
         if result.old_version.version != result.new_version.version:
             LOGGER.info(
                 f"Migrated database from #{result.old_version.version} to "
                 f"#{result.new_version.version}"
             )
-            LOGGER.info(f"Database backup kept as {new_path}")
+            if backup_path is not None:
+                LOGGER.info(f"Database backup kept as {backup_path}")
         else:
             LOGGER.info("Database is up to date")
-            os.remove(new_path)
+            if backup_path is not None:
+                os.remove(backup_path)
+
+
+_VERSION_HEADER = re.compile(r"--\s*Version:\s*(\d+)\s*$", re.IGNORECASE)
+
+
+def latest_schema_version() -> int:
+    """Return the highest version of the migration scripts."""
+    latest = -1
+    for path in db_schema_path().glob("*.sql"):
+        with path.open() as f:
+            for line in f:
+                if not line.startswith("--"):
+                    break
+                m = _VERSION_HEADER.match(line)
+                if m:
+                    latest = max(latest, int(m.group(1)))
+                    break
+    return latest
+
+
+def db_migration_pending(path: Path) -> bool:
+    version = db_schema_version(path)
+    return version is None or version < latest_schema_version()
+
+
+def upgrade_db(path: Path) -> None:
+    """Migrate a database to the latest schema, if necessary.
+
+    Unlike migrate_db, no backup is made and no lock is taken.
+    """
+    if db_migration_pending(path):
+        result = initialize_db(path)
+        if not result.success:
+            raise DBMigrationError("database migration failed")
+
+
+def db_schema_version(path: Path) -> int | None:
+    """Return the schema version of a database.
+
+    Return None if the database does not exist or was never migrated.
+    """
+    if not path.exists():
+        return None
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = db.execute(
+            "SELECT version FROM db_config WHERE schema = 'hej'"
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    finally:
+        db.close()
+    return row[0] if row is not None else None
+
+
+def backup_db(
+    source: Path, target: Path, *, pages: int = 1024, sleep: float = 0
+) -> None:
+    """Copy a database using SQLite's online backup API.
+
+    The database is copied in steps of `pages` pages, pausing `sleep`
+    seconds in between, so that it stays usable by other connections
+    while it is copied.
+    """
+    LOGGER.info(f"Backing up database to {target}")
+    logged = -1
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal logged
+        percent = (total - remaining) * 100 // total if total else 100
+        if percent // 10 > logged // 10:
+            LOGGER.info(f"Database backup {percent}% done")
+            logged = percent
+
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        with dst:
+            src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+    finally:
+        dst.close()
+        src.close()
 
 
 def initialize_db(db_path: Path) -> UpgradeResult:
+    # dbupgrade pulls in SQLAlchemy, which is slow to import.
+    from dbupgrade import MAX_API_LEVEL, MAX_VERSION, VersionInfo, db_upgrade
+
     db_url = f"sqlite:///{db_path}"
     version = VersionInfo(MAX_VERSION, MAX_API_LEVEL)
     return db_upgrade("hej", db_url, str(db_schema_path()), version)
 
 
-async def select_all_notes(db: _ConnectionBase) -> list[Note]:
-    rows = db.execute_fetchall("SELECT * FROM notes")
+async def select_notes_version(db: _ConnectionBase) -> int:
+    """Return a counter that changes whenever a note is changed."""
+    row = await db.execute_fetchone(
+        "SELECT value FROM meta WHERE key = 'notes_version'"
+    )
+    assert row is not None
+    return int(row["value"])
+
+
+async def select_history_version(db: _ConnectionBase) -> int:
+    """Return a counter that changes whenever revisions are removed."""
+    row = await db.execute_fetchone(
+        "SELECT value FROM meta WHERE key = 'history_version'"
+    )
+    assert row is not None
+    return int(row["value"])
+
+
+async def _sync_note_cache(db: _ConnectionBase, cache: NoteCache) -> int:
+    """Make the note cache valid for the current notes version.
+
+    The version is returned.
+    """
+    version = await select_notes_version(db)
+    if version != cache.version:
+        changed = await _select_changed_uuids(db, cache.version, version)
+        notes = await _select_changed_notes(db, cache, changed)
+        cache.sync(version, changed, notes)
+    return version
+
+
+async def _select_changed_uuids(
+    db: _ConnectionBase, since: int | None, until: int
+) -> list[UUID] | None:
+    """Return the UUIDs of the notes changed between two notes versions.
+
+    Return None if the changes are no longer in the log.
+    """
+    if since is None or since > until:
+        return None
+    rows = db.execute_fetchall(
+        "SELECT uuid FROM note_changes WHERE version > ? AND version <= ?",
+        [since, until],
+    )
+    uuids = [UUID(row["uuid"]) async for row in rows]
+    return uuids if len(uuids) == until - since else None
+
+
+async def _select_changed_notes(
+    db: _ConnectionBase, cache: NoteCache, changed: Collection[UUID] | None
+) -> list[Note] | None:
+    """Return the changed notes that still exist.
+
+    The notes are only selected if the cache contains all notes, so that
+    it stays complete without reading the whole notes table. Otherwise,
+    None is returned.
+    """
+    if changed is None or not cache.complete:
+        return None
+    uuids = [str(uuid) for uuid in set(changed)]
+    placeholders = ", ".join("?" * len(uuids))
+    rows = db.execute_fetchall(
+        f"SELECT {_NOTE_COLUMNS} FROM notes WHERE uuid IN ({placeholders})",
+        uuids,
+    )
     return [_note_from_db(row) async for row in rows]
 
 
+# Columns decoded by _note_from_db and _note_meta_from_db, in order.
+_NOTE_COLUMNS = (
+    "notes.uuid, notes.title, notes.text, notes.compressed, notes.favorite, "
+    "notes.creation_date, notes.last_changed, notes.revision"
+)
+_NOTE_META_COLUMNS = (
+    "notes.uuid, notes.title, notes.favorite, notes.creation_date, "
+    "notes.last_changed, notes.revision"
+)
+
+
+async def select_all_notes(db: _ConnectionBase) -> list[Note]:
+    cache = db.note_cache
+    if cache is None:
+        rows = db.execute_fetchall(f"SELECT {_NOTE_COLUMNS} FROM notes")
+        return [_note_from_db(row) async for row in rows]
+    version = await _sync_note_cache(db, cache)
+    notes = cache.get_all()
+    if notes is None:
+        rows = db.execute_fetchall(f"SELECT {_NOTE_COLUMNS} FROM notes")
+        notes = [_note_from_db(row) async for row in rows]
+        cache.put_all(notes, version)
+    return notes
+
+
+async def iter_notes(db: _ConnectionBase) -> AsyncIterator[Note]:
+    """Iterate over all notes without caching them."""
+    rows = db.execute_fetchall(
+        f"SELECT {_NOTE_COLUMNS} FROM notes ORDER BY id"
+    )
+    async for row in rows:
+        yield _note_from_db(row)
+
+
+class NoteSort(enum.StrEnum):
+    CHANGED = "changed"  # most recently changed first
+    CREATED = "created"  # most recently created first
+    TITLE = "title"
+
+
+# Date orders match the indexes on the notes table when read backwards.
+_NOTE_SORT_ORDERS = {
+    NoteSort.CHANGED: "notes.last_changed DESC, notes.uuid DESC",
+    NoteSort.CREATED: "notes.creation_date DESC, notes.uuid DESC",
+    NoteSort.TITLE: "notes.title COLLATE NOCASE, notes.uuid",
+}
+
+
+async def iter_notes_meta(
+    db: _ConnectionBase,
+    *,
+    sort: NoteSort = NoteSort.CHANGED,
+    favorites_only: bool = False,
+    limit: int | None = None,
+) -> AsyncIterator[NoteMeta]:
+    """Iterate over the notes without their text."""
+    # A plain "WHERE notes.favorite" doesn't use the favorites index.
+    where = "WHERE notes.favorite = TRUE" if favorites_only else ""
+    rows = db.execute_fetchall(
+        f"SELECT {_NOTE_META_COLUMNS} FROM notes {where} "
+        f"ORDER BY {_NOTE_SORT_ORDERS[sort]} LIMIT ?",
+        [limit if limit is not None else -1],
+    )
+    async for row in rows:
+        yield _note_meta_from_db(row)
+
+
+async def select_all_notes_meta(db: _ConnectionBase) -> list[NoteMeta]:
+    rows = db.execute_fetchall(f"SELECT {_NOTE_META_COLUMNS} FROM notes")
+    return [_note_meta_from_db(row) async for row in rows]
+
+
+@dataclass
+class NotePage:
+    notes: list[Note | NoteMeta]
+    has_next_page: bool
+
+
+async def select_notes_page(
+    db: _ConnectionBase,
+    *,
+    first: int,
+    after: tuple[datetime.datetime, UUID] | None = None,
+    with_text: bool = True,
+) -> NotePage:
+    """Select a page of notes, ordered by last change date and UUID.
+
+    `after` is the (last_changed, uuid) key of the last note on the
+    previous page.
+    """
+    columns = _NOTE_COLUMNS if with_text else _NOTE_META_COLUMNS
+    from_note = _note_from_db if with_text else _note_meta_from_db
+    if after is None:
+        where = ""
+        parameters: list[Any] = [first + 1]
+    else:
+        where = "WHERE (last_changed, uuid) > (?, ?)"
+        parameters = [db_datetime(after[0]), str(after[1]), first + 1]
+    rows = db.execute_fetchall(
+        f"SELECT {columns} FROM notes {where} "
+        "ORDER BY last_changed, uuid LIMIT ?",
+        parameters,
+    )
+    notes: list[Note | NoteMeta] = []
+    has_next_page = False
+    async for row in rows:
+        if len(notes) < first:
+            notes.append(from_note(row))
+        else:
+            has_next_page = True
+    return NotePage(notes, has_next_page)
+
+
 async def select_note(db: _ConnectionBase, uuid: UUID) -> Note:
+    cache = db.note_cache
+    if cache is not None:
+        # Sync first, so that the note read is at least as new.
+        version = await _sync_note_cache(db, cache)
+        note = cache.get(uuid)
+        if note is not None:
+            return note
     row = await db.execute_fetchone(
-        "SELECT * FROM notes WHERE uuid = ?",
+        f"SELECT {_NOTE_COLUMNS} FROM notes WHERE uuid = ?",
         [str(uuid)],
     )
     if row is None:
         raise UnknownItemError("notes", uuid)
-    return _note_from_db(row)
+    note = _note_from_db(row)
+    if cache is not None:
+        cache.put(note, version)
+    return note
+
+
+async def select_note_meta(db: _ConnectionBase, uuid: UUID) -> NoteMeta:
+    row = await db.execute_fetchone(
+        f"SELECT {_NOTE_META_COLUMNS} FROM notes WHERE uuid = ?",
+        [str(uuid)],
+    )
+    if row is None:
+        raise UnknownItemError("notes", uuid)
+    return _note_meta_from_db(row)
+
+
+async def select_notes_changed_since(
+    db: _ConnectionBase, since: datetime.datetime, *, with_text: bool = True
+) -> list[Note] | list[NoteMeta]:
+    """Select all notes changed at or after `since`."""
+    columns = _NOTE_COLUMNS if with_text else _NOTE_META_COLUMNS
+    rows = db.execute_fetchall(
+        f"SELECT {columns} FROM notes WHERE last_changed >= ? "
+        "ORDER BY last_changed, uuid",
+        [db_datetime(since)],
+    )
+    if with_text:
+        return [_note_from_db(row) async for row in rows]
+    else:
+        return [_note_meta_from_db(row) async for row in rows]
+
+
+async def select_deleted_notes_since(
+    db: _ConnectionBase, since: datetime.datetime
+) -> list[DeletedNote]:
+    """Select all notes deleted at or after `since`."""
+    rows = db.execute_fetchall(
+        "SELECT * FROM deleted_notes WHERE deletion_date >= ? "
+        "ORDER BY deletion_date",
+        [db_datetime(since)],
+    )
+    return [
+        DeletedNote(UUID(row["uuid"]), datetime_from_db(row["deletion_date"]))
+        async for row in rows
+    ]
+
+
+@dataclass
+class SearchResult:
+    note: Note | NoteMeta
+    snippet: str
+    score: float
+
+
+def fts_query(query: str) -> str:
+    """Convert a search string into an FTS5 query.
+
+    All words must match. FTS5 operators and special characters are not
+    interpreted.
+    """
+    words = query.split()
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+async def search_notes(
+    db: _ConnectionBase,
+    query: str,
+    *,
+    first: int,
+    offset: int = 0,
+    with_text: bool = True,
+    highlight: tuple[str, str] = ("**", "**"),
+) -> list[SearchResult]:
+    """Search the title and text of notes, best matches first.
+
+    Matches in the title count more than matches in the text.
+    """
+    match = fts_query(query)
+    if not match:
+        return []
+    columns = _NOTE_COLUMNS if with_text else _NOTE_META_COLUMNS
+    from_note = _note_from_db if with_text else _note_meta_from_db
+    rows = db.execute_fetchall(
+        f"SELECT {columns}, "
+        "snippet(notes_fts, -1, ?, ?, '…', 16) AS snippet, "
+        "bm25(notes_fts, 5.0, 1.0) AS rank "
+        "FROM notes_fts JOIN notes ON notes.id = notes_fts.rowid "
+        "WHERE notes_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+        [*highlight, match, first, offset],
+    )
+    return [
+        SearchResult(from_note(row), row["snippet"], -row["rank"])
+        async for row in rows
+    ]
 
 
 async def insert_note(db: _ConnectionBase, title: str, text: str) -> Note:
     uuid = uuid4()
-    dt = datetime.datetime.now(datetime.UTC)
+    dt = _db_now()
+    value, compressed = encode_note_text(text)
     await db.execute(
-        "INSERT INTO notes(uuid, title, text, creation_date, last_changed) "
-        "VALUES(?, ?, ?, ?, ?)",
-        [str(uuid), title, text, db_datetime(dt), db_datetime_old(dt)],
+        "INSERT INTO notes"
+        "(uuid, title, text, compressed, creation_date, last_changed) "
+        "VALUES(?, ?, ?, ?, ?, ?)",
+        [
+            str(uuid),
+            title,
+            value,
+            compressed,
+            db_datetime(dt),
+            db_datetime(dt),
+        ],
+    )
+    if compressed:
+        await _index_text(db, uuid, text)
+    note = Note(uuid, title, text, False, dt, dt)
+    db.note_changed(uuid, note)
+    return note
+
+
+async def insert_notes(
+    db: _ConnectionBase, notes: Sequence[Note], *, replace: bool = False
+) -> int:
+    """Insert notes with their UUIDs and creation dates.
+
+    Notes whose UUID already exists are replaced if `replace` is true and
+    skipped otherwise. Return the number of inserted or replaced notes.
+    Inserted and replaced notes are marked as changed at the time of the
+    import, so that they are reported by select_notes_changed_since().
+    """
+    now = db_datetime(_db_now())
+    rows = [_note_to_db(note, now) for note in notes]
+    if replace:
+        conflict = (
+            "DO UPDATE SET title = excluded.title, text = excluded.text, "
+            "compressed = excluded.compressed, "
+            "favorite = excluded.favorite, "
+            "creation_date = excluded.creation_date, "
+            "last_changed = excluded.last_changed, "
+            "revision = revision + 1"
+        )
+    else:
+        conflict = "DO NOTHING"
+    count = await db.execute_many(
+        "INSERT INTO notes(uuid, title, text, compressed, favorite, "
+        "creation_date, last_changed) VALUES(?, ?, ?, ?, ?, ?, ?) "
+        f"ON CONFLICT(uuid) {conflict}",
+        rows,
     )
-    return Note(uuid, title, text, False, dt, dt)
+    for note, row in zip(notes, rows):
+        if row[3]:
+            # Skipped notes are only indexed if they have the same text.
+            await _index_text(db, note.uuid, note.text, row[2])
+    await db.execute_many(
+        "DELETE FROM deleted_notes WHERE uuid = ?",
+        ([str(note.uuid)] for note in notes),
+    )
+    for note in notes:
+        db.note_changed(note.uuid, None)
+    return count
+
+
+def _note_to_db(note: Note, last_changed: int) -> list[Any]:
+    text, compressed = encode_note_text(note.text)
+    return [
+        str(note.uuid),
+        note.title,
+        text,
+        compressed,
+        note.favorite,
+        db_datetime(note.creation_date),
+        last_changed,
+    ]
 
 
 async def update_note(
@@ -242,26 +1246,121 @@ async def update_note(
     text: str | None = None,
     *,
     favorite: bool | None = None,
+    expected_revision: int | None = None,
 ) -> Note:
-    old_note = await select_note(db, uuid)
+    """Update a note.
+
+    If `expected_revision` is given, raise RevisionConflictError if the
+    note is at another revision.
+    """
     if title is None and text is None and favorite is None:
-        return old_note
+        note = await select_note(db, uuid)
+        if expected_revision not in [None, note.revision]:
+            raise RevisionConflictError(uuid, note.revision)
+        return note
 
-    if title is None:
-        title = old_note.title
+    value, compressed = (
+        encode_note_text(text) if text is not None else (None, None)
+    )
+    now = datetime.datetime.now(datetime.UTC)
+    where = "uuid = ?"
+    parameters: list[Any] = [
+        title,
+        value,
+        compressed,
+        favorite,
+        db_datetime(now),
+        str(uuid),
+    ]
+    if expected_revision is not None:
+        where += " AND revision = ?"
+        parameters.append(expected_revision)
+    # A new text is not read back.
+    columns = _NOTE_COLUMNS if text is None else _NOTE_META_COLUMNS
+    row = await db.execute_fetchone(
+        "UPDATE notes SET title = coalesce(?, title), "
+        "text = coalesce(?, text), compressed = coalesce(?, compressed), "
+        "favorite = coalesce(?, favorite), "
+        f"last_changed = ?, revision = revision + 1 WHERE {where} "
+        f"RETURNING {columns}",
+        parameters,
+    )
+    if row is None:
+        raise await _revision_conflict(db, uuid)
     if text is None:
-        text = old_note.text
-    if favorite is None:
-        favorite = old_note.favorite
+        note = _note_from_db(row)
+    else:
+        note = _note_with_text_from_db(row, text)
+        if compressed:
+            await _index_text(db, uuid, text)
+    db.note_changed(uuid, note)
+    return note
+
+
+async def patch_note(
+    db: _ConnectionBase,
+    uuid: UUID,
+    base_revision: int,
+    edits: Sequence[TextEdit],
+) -> Note:
+    """Apply text edits to a note.
 
+    Raise RevisionConflictError if the note is not at `base_revision`.
+    """
+    old_note = await select_note(db, uuid)
+    if old_note.revision != base_revision:
+        raise RevisionConflictError(uuid, old_note.revision)
+    text = apply_edits(old_note.text, edits)
+    value, compressed = encode_note_text(text)
     now = datetime.datetime.now(datetime.UTC)
+    row = await db.execute_fetchone(
+        "UPDATE notes SET text = ?, compressed = ?, last_changed = ?, "
+        "revision = revision + 1 WHERE uuid = ? AND revision = ? "
+        f"RETURNING {_NOTE_META_COLUMNS}",
+        [value, compressed, db_datetime(now), str(uuid), base_revision],
+    )
+    if row is None:
+        # The note was changed by another process in the meantime.
+        raise await _revision_conflict(db, uuid)
+    if compressed:
+        await _index_text(db, uuid, text)
+    note = _note_with_text_from_db(row, text)
+    db.note_changed(uuid, note)
+    return note
+
 
+async def _index_text(
+    db: _ConnectionBase,
+    uuid: UUID,
+    text: str,
+    value: str | bytes | None = None,
+) -> None:
+    """Add a compressed text to the full-text index.
+
+    The triggers on the notes table only index uncompressed texts. If
+    `value` is given, the text is only indexed if it is stored as `value`.
+    """
+    where = "uuid = ?"
+    parameters: list[Any] = [text, str(uuid)]
+    if value is not None:
+        where += " AND text = ?"
+        parameters.append(value)
     await db.execute(
-        "UPDATE notes SET title = ?, text = ?, favorite = ?, last_changed = ? "
-        "WHERE uuid = ?",
-        [title, text, favorite, db_datetime_old(now), str(uuid)],
+        "INSERT OR REPLACE INTO notes_fts(rowid, title, text) "
+        f"SELECT id, title, ? FROM notes WHERE {where}",
+        parameters,
     )
-    return await select_note(db, uuid)
+
+
+async def _revision_conflict(
+    db: _ConnectionBase, uuid: UUID
+) -> RevisionConflictError | UnknownItemError:
+    row = await db.execute_fetchone(
+        "SELECT revision FROM notes WHERE uuid = ?", [str(uuid)]
+    )
+    if row is None:
+        return UnknownItemError("notes", uuid)
+    return RevisionConflictError(uuid, row["revision"])
 
 
 async def delete_note(db: _ConnectionBase, uuid: UUID) -> None:
@@ -270,14 +1369,279 @@ async def delete_note(db: _ConnectionBase, uuid: UUID) -> None:
     )
     if rowcount == 0:
         raise UnknownItemError("notes", uuid)
+    db.note_changed(uuid, None)
+    await db.execute(
+        "DELETE FROM note_revisions WHERE note_uuid = ?", [str(uuid)]
+    )
+    now = datetime.datetime.now(datetime.UTC)
+    await db.execute(
+        "INSERT OR REPLACE INTO deleted_notes(uuid, deletion_date) "
+        "VALUES(?, ?)",
+        [str(uuid), db_datetime(now)],
+    )
 
 
-def _note_from_db(row: Row) -> Note:
+async def select_note_history(
+    db: _ConnectionBase, uuid: UUID
+) -> list[NoteRevision]:
+    """Return the recorded revisions of a note, newest first."""
+    rows = db.execute_fetchall(
+        "SELECT revision, title, last_changed FROM note_revisions "
+        "WHERE note_uuid = ? ORDER BY revision DESC",
+        [str(uuid)],
+    )
+    return [
+        NoteRevision(
+            uuid,
+            row["revision"],
+            row["title"],
+            datetime_from_db(row["last_changed"]),
+        )
+        async for row in rows
+    ]
+
+
+async def select_note_at_revision(
+    db: _ConnectionBase, uuid: UUID, revision: int
+) -> Note:
+    """Return a note as it was at the given revision."""
+    note = await select_note(db, uuid)
+    if revision == note.revision:
+        return note
+    rows = [
+        row
+        async for row in db.execute_fetchall(
+            "SELECT * FROM note_revisions "
+            "WHERE note_uuid = ? AND revision <= ? AND revision >= ("
+            "    SELECT max(revision) FROM note_revisions "
+            "    WHERE note_uuid = ? AND revision <= ? AND snapshot"
+            ") ORDER BY revision",
+            [str(uuid), revision, str(uuid), revision],
+        )
+    ]
+    if not rows or rows[-1]["revision"] != revision:
+        raise UnknownItemError("note_revisions", f"{uuid}@{revision}")
+    text = decode_snapshot(rows[0]["data"])
+    for row in rows[1:]:
+        text = apply_delta(text, row["data"])
     return Note(
-        UUID(row["uuid"]),
-        row["title"],
-        row["text"],
-        bool(row["favorite"]),
-        datetime_from_db(row["creation_date"]),
-        datetime_from_db(row["last_changed"]),
+        uuid,
+        rows[-1]["title"],
+        text,
+        note.favorite,
+        note.creation_date,
+        datetime_from_db(rows[-1]["last_changed"]),
+        revision,
+    )
+
+
+async def encode_note_history(
+    db: _ConnectionBase, limit: int | None = None
+) -> int:
+    """Encode revisions recorded as plain text as snapshots or deltas.
+
+    The triggers on the notes table record changed texts as they are.
+    Encode the revisions of at most `limit` notes and return the number of
+    encoded revisions.
+    """
+    rows = db.execute_fetchall(
+        "SELECT DISTINCT note_uuid FROM note_revisions WHERE snapshot = ? "
+        "LIMIT ?",
+        [RevisionFormat.TEXT, -1 if limit is None else limit],
+    )
+    uuids = [row["note_uuid"] async for row in rows]
+    encoded = 0
+    for uuid in uuids:
+        encoded += await _encode_revisions(db, uuid)
+    return encoded
+
+
+async def _encode_revisions(db: _ConnectionBase, uuid: str) -> int:
+    # Start at the last snapshot before the first plain text revision.
+    rows = db.execute_fetchall(
+        "SELECT revision, snapshot, data FROM note_revisions "
+        "WHERE note_uuid = ? AND revision >= coalesce(("
+        "    SELECT max(revision) FROM note_revisions "
+        "    WHERE note_uuid = ? AND snapshot = ? AND revision < ("
+        "        SELECT min(revision) FROM note_revisions "
+        "        WHERE note_uuid = ? AND snapshot = ?"
+        "    )"
+        "), 0) ORDER BY revision",
+        [
+            uuid,
+            uuid,
+            RevisionFormat.SNAPSHOT,
+            uuid,
+            RevisionFormat.TEXT,
+        ],
+    )
+    updates: list[tuple[RevisionFormat, bytes, int]] = []
+    text: str | None = None
+    deltas_since_snapshot = 0
+    async for row in rows:
+        if row["snapshot"] == RevisionFormat.DELTA:
+            assert text is not None
+            text = apply_delta(text, row["data"])
+            deltas_since_snapshot += 1
+            continue
+        new_text = decode_snapshot(row["data"])
+        if row["snapshot"] == RevisionFormat.SNAPSHOT:
+            deltas_since_snapshot = 0
+        elif text is None or deltas_since_snapshot + 1 >= SNAPSHOT_INTERVAL:
+            snapshot = encode_snapshot(new_text)
+            updates.append((RevisionFormat.SNAPSHOT, snapshot, row[0]))
+            deltas_since_snapshot = 0
+        else:
+            delta = encode_delta(text, new_text)
+            updates.append((RevisionFormat.DELTA, delta, row[0]))
+            deltas_since_snapshot += 1
+        text = new_text
+    for revision_format, data, revision in updates:
+        await db.execute(
+            "UPDATE note_revisions SET snapshot = ?, data = ? "
+            "WHERE note_uuid = ? AND revision = ?",
+            [revision_format, data, uuid, revision],
+        )
+    return len(updates)
+
+
+async def compact_note_history(
+    db: _ConnectionBase, before: datetime.datetime
+) -> int:
+    """Thin out revisions last changed before the given date.
+
+    Of those revisions, only the last revision of each day is kept. The
+    deltas of the removed revisions are merged into the following
+    revision. If revisions were removed, the history version is
+    incremented. Return the number of removed revisions.
+    """
+    await encode_note_history(db)
+    cutoff = db_datetime(before)
+    rows = db.execute_fetchall(
+        "SELECT note_uuid FROM note_revisions WHERE last_changed < ? "
+        "GROUP BY note_uuid HAVING count(*) > 1",
+        [cutoff],
+    )
+    uuids = [row["note_uuid"] async for row in rows]
+    removed = 0
+    for uuid in uuids:
+        removed += await _compact_revisions(db, uuid, cutoff)
+    if removed:
+        await db.execute(
+            "UPDATE meta SET value = value + 1 WHERE key = 'history_version'"
+        )
+    return removed
+
+
+async def _compact_revisions(
+    db: _ConnectionBase, uuid: str, cutoff: int
+) -> int:
+    rows = [
+        row
+        async for row in db.execute_fetchall(
+            "SELECT revision, last_changed, snapshot, data "
+            "FROM note_revisions WHERE note_uuid = ? ORDER BY revision",
+            [uuid],
+        )
+    ]
+    last_of_day: dict[int, int] = {}
+    for row in rows:
+        if row["last_changed"] < cutoff:
+            day = row["last_changed"] // _MILLISECONDS_PER_DAY
+            last_of_day[day] = row["revision"]
+    dropped = {
+        row["revision"]
+        for row in rows
+        if row["last_changed"] < cutoff
+        and row["revision"] not in last_of_day.values()
+    }
+    if not dropped:
+        return 0
+
+    text = ""
+    kept_text: str | None = None
+    deltas_since_snapshot = 0
+    base_dropped = False
+    for row in rows:
+        if row["snapshot"]:
+            text = decode_snapshot(row["data"])
+        else:
+            text = apply_delta(text, row["data"])
+        if row["revision"] in dropped:
+            await db.execute(
+                "DELETE FROM note_revisions "
+                "WHERE note_uuid = ? AND revision = ?",
+                [uuid, row["revision"]],
+            )
+            base_dropped = True
+            continue
+        if row["snapshot"]:
+            deltas_since_snapshot = 0
+        elif not base_dropped:
+            deltas_since_snapshot += 1
+        else:
+            if (
+                kept_text is None
+                or deltas_since_snapshot + 1 >= SNAPSHOT_INTERVAL
+            ):
+                snapshot, data = True, encode_snapshot(text)
+                deltas_since_snapshot = 0
+            else:
+                snapshot, data = False, encode_delta(kept_text, text)
+                deltas_since_snapshot += 1
+            await db.execute(
+                "UPDATE note_revisions SET snapshot = ?, data = ? "
+                "WHERE note_uuid = ? AND revision = ?",
+                [snapshot, data, uuid, row["revision"]],
+            )
+        kept_text = text
+        base_dropped = False
+        if row["last_changed"] >= cutoff:
+            break
+    return len(dropped)
+
+
+def _note_from_db(row: Row) -> Note:
+    # Columns are accessed by index, which is faster than by name.
+    return Note.unchecked(
+        _uuid_from_db(row[0]),
+        row[1],
+        decode_note_text(row[2], row[3]),
+        bool(row[4]),
+        datetime_from_db(row[5]),
+        datetime_from_db(row[6]),
+        row[7],
     )
+
+
+def _note_with_text_from_db(row: Row, text: str) -> Note:
+    """Create a note from a row of _NOTE_META_COLUMNS and its text."""
+    return Note.unchecked(
+        _uuid_from_db(row[0]),
+        row[1],
+        text,
+        bool(row[2]),
+        datetime_from_db(row[3]),
+        datetime_from_db(row[4]),
+        row[5],
+    )
+
+
+def _note_meta_from_db(row: Row) -> NoteMeta:
+    return NoteMeta.unchecked(
+        _uuid_from_db(row[0]),
+        row[1],
+        bool(row[2]),
+        datetime_from_db(row[3]),
+        datetime_from_db(row[4]),
+        row[5],
+    )
+
+
+def _uuid_from_db(s: str) -> UUID:
+    """Create a UUID from a string stored in the database.
+
+    Creating the UUID from its integer value is faster than parsing the
+    string in UUID().
+    """
+    return UUID(int=int(s.replace("-", ""), 16))
@@ -0,0 +1,17 @@
+import os
+
+
+def int_env(name: str, default: int, *, minimum: int | None = None) -> int:
+    """Return an integer from the environment.
+
+    Values below `minimum` are raised to it. Raise RuntimeError if the
+    value is not an integer.
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        i = int(value)
+    except ValueError:
+        raise RuntimeError(f"invalid {name} '{value}'")
+    return i if minimum is None else max(i, minimum)
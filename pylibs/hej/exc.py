@@ -28,3 +28,32 @@ class UnknownItemError(HejError):
 
 class DBMigrationError(HejError):
     pass
+
+
+class SubscriptionOverflowError(HejError):
+    def __init__(self) -> None:
+        super().__init__("subscriber too slow, events were dropped")
+
+
+class PersistedQueryError(HejError):
+    def __init__(self, message: str, code: str) -> None:
+        super().__init__(message)
+        self.extensions = {"code": code}
+
+
+class RevisionConflictError(HejError):
+    def __init__(self, uuid: object, revision: int) -> None:
+        super().__init__(
+            f"note '{uuid}' was changed, now at revision {revision}"
+        )
+        self.uuid = uuid
+        self.revision = revision
+        self.extensions = {"code": "CONFLICT", "revision": revision}
+
+
+class InvalidEditError(HejError):
+    extensions: ClassVar = {"code": "BAD_USER_INPUT"}
+
+
+class NoteFormatError(HejError):
+    pass
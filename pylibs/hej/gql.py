@@ -1,34 +1,71 @@
 from __future__ import annotations
 
+import base64
 import datetime
 import functools
+import hashlib
+import json
 import logging
 import os
-from collections.abc import Awaitable, Callable
+from collections.abc import AsyncGenerator, Awaitable, Callable
 from pathlib import Path
 from typing import Any
 from uuid import UUID
 
 from ariadne import QueryType, load_schema_from_path, make_executable_schema
 from ariadne.asgi import GraphQL
+from ariadne.contrib.sse import GraphQLHTTPSSEHandler
+from ariadne.exceptions import HttpBadRequestError
 from ariadne.objects import MutationType, ObjectType
 from ariadne.scalars import ScalarType
-from graphql import GraphQLResolveInfo, GraphQLSchema
+from ariadne.subscriptions import SubscriptionType
+from ariadne.types import GraphQLResult
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLResolveInfo,
+    GraphQLSchema,
+    InlineFragmentNode,
+    SelectionSetNode,
+)
+from starlette.datastructures import QueryParams
+from starlette.requests import Request
+from starlette.responses import Response
 
 from hej.auth import authenticate, check_session_key
-from hej.exc import UnknownItemError
+from hej.exc import (
+    AuthorizationError,
+    PersistedQueryError,
+    UnknownItemError,
+)
 
+from .broadcast import NoteEvent, NoteEventType, note_events
 from .db import (
-    db_url,
     delete_note,
     insert_note,
-    open_transaction,
+    patch_note,
+    read_transaction,
+    search_notes,
     select_all_notes,
+    select_all_notes_meta,
+    select_deleted_notes_since,
+    select_history_version,
     select_note,
+    select_note_at_revision,
+    select_note_history,
+    select_note_meta,
+    select_notes_changed_since,
+    select_notes_page,
+    select_notes_version,
     update_note,
+    write_transaction,
 )
 from .debug import debug
-from .note import Note
+from .history import NoteRevision
+from .note import Note, NoteMeta
+from .patch import TextEdit
+from .querycache import QueryCache, query_hash
 
 LOGGER = logging.getLogger(__name__)
 
@@ -47,15 +84,52 @@ def require_auth[F: Callable[..., Awaitable[Any]]](f: F) -> F:
     async def check_auth(  # type: ignore[misc]
         obj: Any, info: GraphQLResolveInfo, **kwargs: Any
     ) -> Any:
-        assert isinstance(info.context, dict)
-        if not info.context.get("auth", False):
-            await authenticate(info.context["request"])
-            info.context["auth"] = True
+        await ensure_authenticated(info)
         return await f(obj, info, **kwargs)
 
     return check_auth  # type: ignore
 
 
+async def ensure_authenticated(info: GraphQLResolveInfo) -> None:
+    assert isinstance(info.context, dict)
+    if not info.context.get("auth", False):
+        await authenticate(info.context["request"])
+        info.context["auth"] = True
+
+
+def selected_fields(info: GraphQLResolveInfo) -> set[str]:
+    """Return the paths of all fields requested from the resolved field.
+
+    Nested fields are returned as dotted paths, e.g. "edges.node.text".
+    """
+    fields: set[str] = set()
+    for node in info.field_nodes:
+        if node.selection_set is not None:
+            _collect_fields(node.selection_set, info.fragments, "", fields)
+    return fields
+
+
+def _collect_fields(
+    selection_set: SelectionSetNode,
+    fragments: dict[str, FragmentDefinitionNode],
+    prefix: str,
+    fields: set[str],
+) -> None:
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            path = prefix + selection.name.value
+            fields.add(path)
+            if selection.selection_set is not None:
+                _collect_fields(
+                    selection.selection_set, fragments, f"{path}.", fields
+                )
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments[selection.name.value]
+            _collect_fields(fragment.selection_set, fragments, prefix, fields)
+        elif isinstance(selection, InlineFragmentNode):
+            _collect_fields(selection.selection_set, fragments, prefix, fields)
+
+
 type_defs = load_schema_from_path(str(schema_file()))
 
 datetime_scalar = ScalarType("DateTime")
@@ -70,6 +144,14 @@ def serialize_datetime(dt: datetime.datetime) -> str:
     return dt.isoformat()[:19] + "Z"
 
 
+@datetime_scalar.value_parser
+def parse_datetime(value: str) -> datetime.datetime:
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        raise ValueError(f"datetime {value} has no timezone")
+    return dt.astimezone(datetime.UTC)
+
+
 note = ObjectType("Note")
 
 query = QueryType()
@@ -78,23 +160,171 @@ query = QueryType()
 @query.field("notes")
 @require_auth
 async def resolve_notes(
-    _: None, __: GraphQLResolveInfo, *, uuid: str | None = None
-) -> list[Note]:
+    _: None, info: GraphQLResolveInfo, *, uuid: str | None = None
+) -> list[Note] | list[NoteMeta]:
+    with_text = "text" in selected_fields(info)
     if uuid is None:
-        async with open_transaction(db_url()) as db:
-            return await select_all_notes(db)
+        async with read_transaction() as db:
+            if with_text:
+                return await select_all_notes(db)
+            else:
+                return await select_all_notes_meta(db)
     else:
         try:
             uuid_o = UUID(uuid)
         except ValueError:
             return []
-        async with open_transaction(db_url()) as db:
+        async with read_transaction() as db:
             try:
-                note = await select_note(db, uuid_o)
+                if with_text:
+                    return [await select_note(db, uuid_o)]
+                else:
+                    return [await select_note_meta(db, uuid_o)]
             except UnknownItemError:
                 return []
-            else:
-                return [note]
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(note: Note | NoteMeta) -> str:
+    key = f"{note.last_changed.isoformat()}|{note.uuid}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, UUID]:
+    try:
+        key = base64.urlsafe_b64decode(cursor.encode()).decode()
+        last_changed, uuid = key.split("|")
+        return datetime.datetime.fromisoformat(last_changed), UUID(uuid)
+    except ValueError:
+        raise ValueError(f"invalid cursor '{cursor}'")
+
+
+@query.field("notesConnection")
+@require_auth
+async def resolve_notes_connection(
+    _: None,
+    info: GraphQLResolveInfo,
+    *,
+    first: int | None = None,
+    after: str | None = None,
+) -> dict[str, Any]:
+    if first is None:
+        first = DEFAULT_PAGE_SIZE
+    first = min(max(first, 0), MAX_PAGE_SIZE)
+    after_key = decode_cursor(after) if after is not None else None
+    with_text = "edges.node.text" in selected_fields(info)
+    async with read_transaction() as db:
+        page = await select_notes_page(
+            db, first=first, after=after_key, with_text=with_text
+        )
+    edges = [{"cursor": encode_cursor(n), "node": n} for n in page.notes]
+    return {
+        "edges": edges,
+        "page_info": {
+            "has_next_page": page.has_next_page,
+            "end_cursor": edges[-1]["cursor"] if edges else None,
+        },
+    }
+
+
+# Writes are timestamped before they are committed. Return an earlier
+# `until` date so that slow writes are picked up by the next poll.
+SYNC_MARGIN = datetime.timedelta(seconds=5)
+
+
+@query.field("notesChangedSince")
+@require_auth
+async def resolve_notes_changed_since(
+    _: None, info: GraphQLResolveInfo, *, since: datetime.datetime
+) -> dict[str, Any]:
+    now = datetime.datetime.now(datetime.UTC).replace(microsecond=0)
+    until = now - SYNC_MARGIN
+    with_text = "notes.text" in selected_fields(info)
+    async with read_transaction() as db:
+        notes = await select_notes_changed_since(
+            db, since, with_text=with_text
+        )
+        deleted_notes = await select_deleted_notes_since(db, since)
+    return {"notes": notes, "deleted_notes": deleted_notes, "until": until}
+
+
+def encode_offset_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(f"offset|{offset}".encode()).decode()
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    try:
+        key = base64.urlsafe_b64decode(cursor.encode()).decode()
+        prefix, offset = key.split("|")
+        if prefix != "offset":
+            raise ValueError()
+        return int(offset)
+    except ValueError:
+        raise ValueError(f"invalid cursor '{cursor}'")
+
+
+@query.field("searchNotes")
+@require_auth
+async def resolve_search_notes(
+    _: None,
+    info: GraphQLResolveInfo,
+    *,
+    query: str,
+    first: int | None = None,
+    after: str | None = None,
+) -> dict[str, Any]:
+    if first is None:
+        first = DEFAULT_PAGE_SIZE
+    first = min(max(first, 0), MAX_PAGE_SIZE)
+    offset = decode_offset_cursor(after) + 1 if after is not None else 0
+    with_text = "edges.node.note.text" in selected_fields(info)
+    async with read_transaction() as db:
+        results = await search_notes(
+            db, query, first=first + 1, offset=offset, with_text=with_text
+        )
+    edges = [
+        {"cursor": encode_offset_cursor(offset + i), "node": result}
+        for i, result in enumerate(results[:first])
+    ]
+    return {
+        "edges": edges,
+        "page_info": {
+            "has_next_page": len(results) > first,
+            "end_cursor": edges[-1]["cursor"] if edges else None,
+        },
+    }
+
+
+@query.field("noteHistory")
+@require_auth
+async def resolve_note_history(
+    _: None, __: GraphQLResolveInfo, *, uuid: str
+) -> list[NoteRevision]:
+    try:
+        uuid_o = UUID(uuid)
+    except ValueError:
+        return []
+    async with read_transaction() as db:
+        return await select_note_history(db, uuid_o)
+
+
+@query.field("noteAtRevision")
+@require_auth
+async def resolve_note_at_revision(
+    _: None, __: GraphQLResolveInfo, *, uuid: str, revision: int
+) -> Note | None:
+    try:
+        uuid_o = UUID(uuid)
+    except ValueError:
+        return None
+    async with read_transaction() as db:
+        try:
+            return await select_note_at_revision(db, uuid_o, revision)
+        except UnknownItemError:
+            return None
 
 
 mutation = MutationType()
@@ -120,8 +350,10 @@ async def resolve_logout(_: None, __: GraphQLResolveInfo) -> bool:
 async def resolve_create_note(
     _: None, __: GraphQLResolveInfo, *, title: str, text: str | None = None
 ) -> Note:
-    async with open_transaction(db_url()) as db:
-        return await insert_note(db, title, text or "")
+    async with write_transaction() as db:
+        note = await insert_note(db, title, text or "")
+    note_events.publish(NoteEvent(NoteEventType.CREATED, note.uuid, note))
+    return note
 
 
 @mutation.field("updateNote")
@@ -133,34 +365,80 @@ async def resolve_update_note(
     uuid: str,
     title: str | None = None,
     text: str | None = None,
+    expected_revision: int | None = None,
 ) -> Note | None:
     try:
         uuid_o = UUID(uuid)
     except ValueError:
         return None
 
-    async with open_transaction(db_url()) as db:
-        try:
-            return await update_note(db, uuid_o, title, text)
-        except UnknownItemError:
-            return None
+    try:
+        async with write_transaction() as db:
+            note = await update_note(
+                db,
+                uuid_o,
+                title,
+                text,
+                expected_revision=expected_revision,
+            )
+    except UnknownItemError:
+        return None
+    note_events.publish(NoteEvent(NoteEventType.UPDATED, note.uuid, note))
+    return note
+
+
+@mutation.field("patchNote")
+@require_auth
+async def resolve_patch_note(
+    _: None,
+    __: GraphQLResolveInfo,
+    *,
+    uuid: str,
+    base_revision: int,
+    ops: list[dict[str, Any]],
+) -> Note | None:
+    try:
+        uuid_o = UUID(uuid)
+    except ValueError:
+        return None
+
+    edits = [TextEdit(**op) for op in ops]
+    try:
+        async with write_transaction() as db:
+            note = await patch_note(db, uuid_o, base_revision, edits)
+    except UnknownItemError:
+        return None
+    note_events.publish(NoteEvent(NoteEventType.UPDATED, note.uuid, note))
+    return note
 
 
 @mutation.field("markNoteAsFavorite")
 @require_auth
 async def resolve_mark_note_as_favorite(
-    _: None, __: GraphQLResolveInfo, *, uuid: str, favorite: bool
+    _: None,
+    __: GraphQLResolveInfo,
+    *,
+    uuid: str,
+    favorite: bool,
+    expected_revision: int | None = None,
 ) -> Note | None:
     try:
         uuid_o = UUID(uuid)
     except ValueError:
         return None
 
-    async with open_transaction(db_url()) as db:
-        try:
-            return await update_note(db, uuid_o, favorite=favorite)
-        except UnknownItemError:
-            return None
+    try:
+        async with write_transaction() as db:
+            note = await update_note(
+                db,
+                uuid_o,
+                favorite=favorite,
+                expected_revision=expected_revision,
+            )
+    except UnknownItemError:
+        return None
+    note_events.publish(NoteEvent(NoteEventType.UPDATED, note.uuid, note))
+    return note
 
 
 @mutation.field("deleteNote")
@@ -173,13 +451,33 @@ async def resolve_delete_note(
     except ValueError:
         return False
 
-    async with open_transaction(db_url()) as db:
-        try:
+    try:
+        async with write_transaction() as db:
             await delete_note(db, uuid_o)
-        except UnknownItemError:
-            return False
-        else:
-            return True
+    except UnknownItemError:
+        return False
+    note_events.publish(NoteEvent(NoteEventType.DELETED, uuid_o))
+    return True
+
+
+subscription = SubscriptionType()
+
+
+async def note_changed_source(
+    _: None, info: GraphQLResolveInfo
+) -> AsyncGenerator[NoteEvent]:
+    await ensure_authenticated(info)
+    async with note_events.subscribe() as events:
+        async for event in events:
+            yield event
+
+
+subscription.set_source("noteChanged", note_changed_source)
+
+
+@subscription.field("noteChanged")
+def resolve_note_changed(event: NoteEvent, _: GraphQLResolveInfo) -> NoteEvent:
+    return event
 
 
 def bind_schema() -> GraphQLSchema:
@@ -189,9 +487,142 @@ def bind_schema() -> GraphQLSchema:
         note,
         query,
         mutation,
+        subscription,
         convert_names_case=True,
     )
 
 
-def create_app() -> GraphQL:
-    return GraphQL(bind_schema(), debug=debug())
+class HTTPHandler(GraphQLHTTPSSEHandler):
+    """HTTP handler with support for persisted and conditional queries.
+
+    Clients can send the SHA-256 hash of a query instead of the query
+    itself, using the automatic persisted queries protocol. If the hash is
+    unknown, the client must resend the request with the full query.
+
+    Query results only change when notes are changed, which increments the
+    notes version, or when revisions are removed from the history, which
+    increments the history version. The ETag of a GET query response is
+    derived from both versions and the query string. If the client already
+    has the current response, it is sent a "304 Not Modified" response
+    without executing the query.
+    """
+
+    def __init__(self, query_cache: QueryCache, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.query_cache = query_cache
+
+    async def handle_request_override(
+        self, request: Request
+    ) -> Response | None:
+        response = await super().handle_request_override(request)
+        if response is not None:
+            return response
+        if request.method != "GET" or not _is_get_query(request):
+            return None
+        try:
+            await authenticate(request)
+        except AuthorizationError:
+            return None  # let the resolvers handle the error
+        async with read_transaction() as db:
+            version = await select_notes_version(db)
+            history_version = await select_history_version(db)
+        url_hash = hashlib.sha256(request.url.query.encode()).hexdigest()
+        etag = f'"{version}.{history_version}-{url_hash[:16]}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Cookie"}
+        if etag in _parse_etags(request.headers.get("If-None-Match", "")):
+            return Response(status_code=304, headers=headers)
+        response = await self.graphql_http_server(request)
+        if response.status_code == 200:
+            response.headers.update(headers)
+        return response
+
+    async def extract_data_from_request(self, request: Request) -> Any:
+        if request.method == "GET" and _is_get_query(request):
+            return self.extract_data_from_get_request(request)
+        return await super().extract_data_from_request(request)
+
+    def extract_data_from_get_request(
+        self, request: Request
+    ) -> dict[str, Any]:
+        params = request.query_params
+        data = {
+            "query": params.get("query", "").strip(),
+            "operationName": params.get("operationName", "").strip() or None,
+            "variables": _json_param(params, "variables"),
+        }
+        extensions = _json_param(params, "extensions")
+        if extensions is not None:
+            data["extensions"] = extensions
+        return data
+
+    async def execute_graphql_query(
+        self, request: Any, data: Any, **kwargs: Any
+    ) -> GraphQLResult:
+        if isinstance(data, dict):
+            try:
+                self._resolve_persisted_query(data)
+            except PersistedQueryError as exc:
+                error = {"message": str(exc), "extensions": exc.extensions}
+                return False, {"errors": [error]}
+        return await super().execute_graphql_query(request, data, **kwargs)
+
+    def _resolve_persisted_query(self, data: dict[str, Any]) -> None:
+        extensions = data.get("extensions")
+        if not isinstance(extensions, dict):
+            return
+        persisted_query = extensions.get("persistedQuery")
+        if not isinstance(persisted_query, dict):
+            return
+        hash = persisted_query.get("sha256Hash")
+        if not isinstance(hash, str):
+            return
+        if data.get("query"):
+            if query_hash(data["query"]) != hash:
+                raise PersistedQueryError(
+                    "provided sha does not match query",
+                    "PERSISTED_QUERY_HASH_MISMATCH",
+                )
+            self.query_cache.parse(data["query"])
+        else:
+            query = self.query_cache.lookup(hash)
+            if query is None:
+                raise PersistedQueryError(
+                    "PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND"
+                )
+            data["query"] = query
+
+
+def _is_get_query(request: Request) -> bool:
+    params = request.query_params
+    return bool(params.get("query")) or "extensions" in params
+
+
+def _json_param(params: QueryParams, name: str) -> Any:
+    value = params.get(name, "").strip()
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError as exc:
+        raise HttpBadRequestError(
+            f"{name.capitalize()} query arg is not a valid JSON"
+        ) from exc
+
+
+def _parse_etags(header: str) -> list[str]:
+    return [etag.strip().removeprefix("W/") for etag in header.split(",")]
+
+
+# Interval in seconds between keep-alive messages on idle subscriptions.
+SSE_PING_INTERVAL = 15
+
+
+def create_app(query_cache: QueryCache) -> GraphQL:
+    return GraphQL(
+        bind_schema(),
+        debug=debug(),
+        execute_get_queries=True,
+        query_parser=query_cache.parse_query,
+        query_validator=query_cache.validate,
+        http_handler=HTTPHandler(query_cache, ping_interval=SSE_PING_INTERVAL),
+    )
@@ -0,0 +1,87 @@
+import datetime
+import enum
+import struct
+import zlib
+from dataclasses import dataclass
+from uuid import UUID
+
+# Maximum number of deltas between two full snapshots of a note's text.
+SNAPSHOT_INTERVAL = 16
+
+_DELTA_HEADER = struct.Struct("<QQ")
+
+
+class RevisionFormat(enum.IntEnum):
+    """Format of a revision's data, stored in note_revisions.snapshot."""
+
+    DELTA = 0  # compressed delta to the previous revision
+    SNAPSHOT = 1  # compressed text
+    # Text as stored in notes.text, recorded by a trigger. It is replaced
+    # by a snapshot or delta later.
+    TEXT = 2
+
+
+@dataclass
+class NoteRevision:
+    uuid: UUID
+    revision: int
+    title: str
+    last_changed: datetime.datetime
+
+
+def encode_snapshot(text: str) -> bytes:
+    return zlib.compress(text.encode())
+
+
+def decode_snapshot(data: str | bytes) -> str:
+    """Return the text of a snapshot or of a TEXT revision."""
+    if isinstance(data, str):
+        return data
+    return zlib.decompress(data).decode()
+
+
+def encode_delta(old: str, new: str) -> bytes:
+    """Encode the changes from one text to another.
+
+    The delta replaces the range of the old text that differs from the new
+    text. That keeps deltas small for typical edits that change a single
+    place of a text.
+    """
+    start = _common_prefix_length(old, new)
+    suffix = _common_suffix_length(old[start:], new[start:])
+    middle = new[start : len(new) - suffix]
+    header = _DELTA_HEADER.pack(start, len(old) - suffix)
+    return zlib.compress(header + middle.encode())
+
+
+def apply_delta(text: str, data: bytes) -> str:
+    if not data:
+        # Recorded by a trigger for revisions that kept the text.
+        return text
+    raw = zlib.decompress(data)
+    start, end = _DELTA_HEADER.unpack_from(raw)
+    middle = raw[_DELTA_HEADER.size :].decode()
+    return text[:start] + middle + text[end:]
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    # Binary search, so that the comparisons run in C.
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _common_suffix_length(a: str, b: str) -> int:
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len(a) - mid :] == b[len(b) - mid :]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
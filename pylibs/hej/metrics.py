@@ -0,0 +1,20 @@
+from collections.abc import Callable, Mapping
+
+type MetricsCollector = Callable[[], Mapping[str, float]]
+
+_collectors: list[MetricsCollector] = []
+
+
+def register_collector(collector: MetricsCollector) -> None:
+    _collectors.append(collector)
+
+
+def unregister_collector(collector: MetricsCollector) -> None:
+    _collectors.remove(collector)
+
+
+def collect_metrics() -> dict[str, float]:
+    metrics: dict[str, float] = {}
+    for collector in _collectors:
+        metrics.update(collector())
+    return metrics
@@ -1,9 +1,48 @@
 import datetime
 from dataclasses import dataclass
+from typing import Self
 from uuid import UUID
 
+_new_object = object.__new__
 
-@dataclass
+
+@dataclass(slots=True)
+class NoteMeta:
+    """Note without its text."""
+
+    uuid: UUID
+    title: str
+    favorite: bool
+    creation_date: datetime.datetime
+    last_changed: datetime.datetime
+    revision: int = 1
+
+    def __post_init__(self) -> None:
+        _check_utc("creation_date", self.creation_date)
+        _check_utc("last_changed", self.last_changed)
+
+    @classmethod
+    def unchecked(
+        cls,
+        uuid: UUID,
+        title: str,
+        favorite: bool,
+        creation_date: datetime.datetime,
+        last_changed: datetime.datetime,
+        revision: int,
+    ) -> Self:
+        """Create a note from trusted values, skipping validation."""
+        note = _new_object(cls)
+        note.uuid = uuid
+        note.title = title
+        note.favorite = favorite
+        note.creation_date = creation_date
+        note.last_changed = last_changed
+        note.revision = revision
+        return note
+
+
+@dataclass(slots=True)
 class Note:
     uuid: UUID
     title: str
@@ -11,22 +50,46 @@ class Note:
     favorite: bool
     creation_date: datetime.datetime
     last_changed: datetime.datetime
+    revision: int = 1
+
+    def __post_init__(self) -> None:
+        _check_utc("creation_date", self.creation_date)
+        _check_utc("last_changed", self.last_changed)
+
+    @classmethod
+    def unchecked(
+        cls,
+        uuid: UUID,
+        title: str,
+        text: str,
+        favorite: bool,
+        creation_date: datetime.datetime,
+        last_changed: datetime.datetime,
+        revision: int,
+    ) -> Self:
+        """Create a note from trusted values, skipping validation."""
+        note = _new_object(cls)
+        note.uuid = uuid
+        note.title = title
+        note.text = text
+        note.favorite = favorite
+        note.creation_date = creation_date
+        note.last_changed = last_changed
+        note.revision = revision
+        return note
+
+
+@dataclass(slots=True)
+class DeletedNote:
+    uuid: UUID
+    deletion_date: datetime.datetime
 
     def __post_init__(self) -> None:
-        if self.creation_date.tzinfo is None:
-            raise ValueError(
-                f"creation_date {self.creation_date} has no timezone"
-            )
-        elif self.creation_date.tzinfo != datetime.UTC:
-            raise ValueError(
-                f"creation_date {self.creation_date} has non-UTC timezone"
-            )
-
-        if self.last_changed.tzinfo is None:
-            raise ValueError(
-                f"last_changed {self.last_changed} has no timezone"
-            )
-        elif self.last_changed.tzinfo != datetime.UTC:
-            raise ValueError(
-                f"last_changed {self.last_changed} has non-UTC timezone"
-            )
+        _check_utc("deletion_date", self.deletion_date)
+
+
+def _check_utc(field: str, dt: datetime.datetime) -> None:
+    if dt.tzinfo is None:
+        raise ValueError(f"{field} {dt} has no timezone")
+    elif dt.tzinfo != datetime.UTC:
+        raise ValueError(f"{field} {dt} has non-UTC timezone")
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import sys
+from collections import OrderedDict
+from collections.abc import Collection, Iterable, Mapping
+from uuid import UUID
+
+from .env import int_env
+from .note import Note
+
+
+def note_cache_size() -> int:
+    """Return the note cache budget in bytes. 0 disables the cache."""
+    return int_env("HEJ_NOTE_CACHE_SIZE", 16 * 1024 * 1024, minimum=0)
+
+
+# Rough size of a Note object without its strings.
+_NOTE_OVERHEAD = 500
+
+
+def note_size(note: Note) -> int:
+    """Estimate the memory used by a note in bytes."""
+    return (
+        _NOTE_OVERHEAD + sys.getsizeof(note.title) + sys.getsizeof(note.text)
+    )
+
+
+class NoteCache:
+    """LRU cache of notes, limited by their estimated size in bytes.
+
+    Entries are valid for a single version of the notes table, as reported
+    by the notes_version counter. Readers sync the cache with the current
+    version before using it. Notes changed by other connections or
+    processes in the meantime are looked up in the note_changes log and
+    replaced by their current values, if the cache holds all notes, or
+    dropped otherwise. Changes committed through the cache's own
+    connection pool are applied precisely instead.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.version: int | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.invalidated_notes = 0
+        self._notes: OrderedDict[UUID, Note] = OrderedDict()
+        self._bytes = 0
+        # True if the cache contains all notes of the current version.
+        self._complete = False
+
+    def __len__(self) -> int:
+        return len(self._notes)
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def complete(self) -> bool:
+        """True if the cache contains all notes of its version."""
+        return self._complete
+
+    def sync(
+        self,
+        version: int,
+        changed: Collection[UUID] | None = None,
+        notes: Iterable[Note] | None = None,
+    ) -> None:
+        """Make the cache valid for the given version.
+
+        `changed` contains the UUIDs of all notes changed since the cache's
+        version. If it is None, all entries are dropped. `notes` contains
+        the changed notes that still exist at the given version. If it is
+        None, the cache no longer contains all notes.
+        """
+        if version == self.version:
+            return
+        if self.version is not None:
+            self.invalidations += 1
+        if changed is None:
+            self.clear()
+        else:
+            for uuid in changed:
+                self._remove(uuid)
+            self.invalidated_notes += len(changed)
+            if notes is None:
+                # Notes may have been added.
+                self._complete = False
+            else:
+                for note in notes:
+                    self._put(note)
+        self.version = version
+
+    def clear(self) -> None:
+        self._notes.clear()
+        self._bytes = 0
+        self._complete = False
+
+    def get(self, uuid: UUID) -> Note | None:
+        note = self._notes.get(uuid)
+        if note is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._notes.move_to_end(uuid)
+        return note
+
+    def get_all(self) -> list[Note] | None:
+        """Return all notes, if all of them are cached."""
+        if not self._complete:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(self._notes.values())
+
+    def put(self, note: Note, version: int) -> None:
+        """Add a note read at the given version of the notes table.
+
+        Notes read at another version than the cache's are ignored.
+        """
+        if version == self.version:
+            self._put(note)
+
+    def put_all(self, notes: Iterable[Note], version: int) -> None:
+        """Add all notes of the given version of the notes table."""
+        if version != self.version:
+            return
+        self.clear()
+        self._complete = True
+        for note in notes:
+            self._put(note)
+
+    def _put(self, note: Note) -> None:
+        self._remove(note.uuid)
+        size = note_size(note)
+        if size > self.max_bytes:
+            self._complete = False
+            return
+        self._notes[note.uuid] = note
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._notes.popitem(last=False)
+            self._bytes -= note_size(evicted)
+            self._complete = False
+            self.evictions += 1
+
+    def _remove(self, uuid: UUID) -> None:
+        note = self._notes.pop(uuid, None)
+        if note is not None:
+            self._bytes -= note_size(note)
+
+    def apply_changes(
+        self,
+        changes: Mapping[UUID, Note | None],
+        count: int,
+        version: int,
+        changed: Collection[UUID] | None,
+        notes: Iterable[Note] | None = None,
+    ) -> None:
+        """Apply committed changes to the cache.
+
+        `changes` maps the UUIDs of the notes changed by a transaction to
+        their new value or to None if the note was deleted. `count` is the
+        number of changes to the notes table and `version` is the notes
+        version after the transaction. `changed` contains the UUIDs of
+        all notes changed since the cache's version, including the ones
+        changed by the transaction, or None if they are unknown. `notes`
+        is passed on to sync().
+        """
+        if changed is None or len(changed) != count:
+            # Other processes changed notes in the meantime.
+            self.sync(version, changed, notes)
+        self.version = version
+        for uuid, note in changes.items():
+            if note is None:
+                self._remove(uuid)
+            else:
+                self._put(note)
+
+    def metrics(self) -> Mapping[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hej_note_cache_entries": len(self._notes),
+            "hej_note_cache_bytes": self._bytes,
+            "hej_note_cache_hits": self.hits,
+            "hej_note_cache_misses": self.misses,
+            "hej_note_cache_hit_ratio": self.hits / lookups if lookups else 0,
+            "hej_note_cache_evictions": self.evictions,
+            "hej_note_cache_invalidations": self.invalidations,
+            "hej_note_cache_invalidated_notes": self.invalidated_notes,
+        }
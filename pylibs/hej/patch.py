@@ -0,0 +1,37 @@
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from .exc import InvalidEditError
+
+
+@dataclass(frozen=True)
+class TextEdit:
+    """Replace `delete` characters at `position` with `insert`."""
+
+    position: int
+    delete: int = 0
+    insert: str = ""
+
+
+def apply_edits(text: str, edits: Iterable[TextEdit]) -> str:
+    """Apply edits to a text in order.
+
+    Positions and lengths are counted in UTF-16 code units, like string
+    indices in JavaScript. Each edit refers to the text as changed by the
+    previous edits.
+    """
+    # Two bytes per code unit.
+    buffer = bytearray(text.encode("utf-16-le", "surrogatepass"))
+    for edit in edits:
+        start = edit.position * 2
+        end = start + edit.delete * 2
+        if edit.position < 0 or edit.delete < 0 or end > len(buffer):
+            raise InvalidEditError(
+                f"edit at {edit.position} of length {edit.delete} "
+                f"is out of range"
+            )
+        buffer[start:end] = edit.insert.encode("utf-16-le", "surrogatepass")
+    try:
+        return buffer.decode("utf-16-le")
+    except UnicodeDecodeError:
+        raise InvalidEditError("edits split a surrogate pair")
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from collections.abc import Collection, Mapping
+from dataclasses import dataclass
+from typing import Any
+
+from graphql import (
+    ASTValidationRule,
+    DocumentNode,
+    GraphQLError,
+    GraphQLSchema,
+    TypeInfo,
+    parse,
+    validate,
+)
+
+from .env import int_env
+
+
+def query_cache_size() -> int:
+    return int_env("HEJ_QUERY_CACHE_SIZE", 100, minimum=1)
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+@dataclass
+class _Entry:
+    query: str
+    document: DocumentNode
+    errors: list[GraphQLError] | None = None
+
+
+class QueryCache:
+    """LRU cache of parsed and validated GraphQL queries.
+
+    Queries are keyed by the SHA-256 hash of the query string, which also
+    makes the cache usable as store for automatic persisted queries.
+    """
+
+    def __init__(self, size: int = 100) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._hashes_by_document: dict[int, str] = {}
+
+    def lookup(self, key: str) -> str | None:
+        """Return the query string with the given hash, if it is cached."""
+        entry = self._entries.get(key)
+        return entry.query if entry is not None else None
+
+    def parse(self, query: str) -> DocumentNode:
+        key = query_hash(query)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry.document
+        self.misses += 1
+        document = parse(query)
+        self._entries[key] = _Entry(query, document)
+        self._hashes_by_document[id(document)] = key
+        if len(self._entries) > self.size:
+            _, evicted = self._entries.popitem(last=False)
+            del self._hashes_by_document[id(evicted.document)]
+        return document
+
+    def parse_query(
+        self, context_value: Any, data: dict[str, Any]
+    ) -> DocumentNode:
+        """Query parser for ariadne."""
+        return self.parse(data["query"])
+
+    def validate(
+        self,
+        schema: GraphQLSchema,
+        document_ast: DocumentNode,
+        rules: Collection[type[ASTValidationRule]] | None = None,
+        max_errors: int | None = None,
+        type_info: TypeInfo | None = None,
+    ) -> list[GraphQLError]:
+        """Query validator for ariadne.
+
+        The validation result of cached documents is cached as well.
+        """
+        key = self._hashes_by_document.get(id(document_ast))
+        entry = self._entries.get(key) if key is not None else None
+        if entry is not None and entry.errors is not None:
+            return entry.errors
+        errors = validate(schema, document_ast, rules, max_errors, type_info)
+        if entry is not None:
+            entry.errors = errors
+        return errors
+
+    def metrics(self) -> Mapping[str, float]:
+        return {
+            "hej_query_cache_size": len(self._entries),
+            "hej_query_cache_hits": self.hits,
+            "hej_query_cache_misses": self.misses,
+        }
@@ -0,0 +1,111 @@
+import asyncio
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from .backup import BackupManager, backup_dir, backup_interval, backup_keep
+
+
+@pytest.fixture
+def db_path(tmp_path: Path) -> Path:
+    path = tmp_path / "hej.sqlite"
+    with sqlite3.connect(path) as db:
+        db.execute("CREATE TABLE foo(bar)")
+        db.executemany("INSERT INTO foo(bar) VALUES(?)", [("x" * 100,)] * 50)
+    db.close()
+    return path
+
+
+def test_backup_settings(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    assert backup_dir(tmp_path / "hej.sqlite") == tmp_path / "backups"
+    assert backup_interval() == 0
+    assert backup_keep() == 7
+    monkeypatch.setenv("HEJ_BACKUP_DIR", "/backups")
+    monkeypatch.setenv("HEJ_BACKUP_INTERVAL", "3600")
+    monkeypatch.setenv("HEJ_BACKUP_KEEP", "0")
+    assert backup_dir(tmp_path / "hej.sqlite") == Path("/backups")
+    assert backup_interval() == 3600
+    assert backup_keep() == 1
+    monkeypatch.setenv("HEJ_BACKUP_INTERVAL", "hourly")
+    with pytest.raises(RuntimeError):
+        backup_interval()
+
+
+async def test_backup(tmp_path: Path, db_path: Path) -> None:
+    manager = BackupManager(db_path, tmp_path / "backups", pages=1)
+    path = await manager.backup()
+    assert path.parent == tmp_path / "backups"
+    assert path.name.startswith("hej-")
+    assert manager.backup_paths() == [path]
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT count(*) FROM foo").fetchone() == (50,)
+    db.close()
+    metrics = manager.metrics()
+    assert metrics["hej_backups"] == 1
+    assert metrics["hej_backup_failures"] == 0
+    assert metrics["hej_backup_last_size_bytes"] == path.stat().st_size
+    assert metrics["hej_backup_last_duration_seconds"] > 0
+    assert metrics["hej_backup_retained"] == 1
+
+
+async def test_backup__failure(tmp_path: Path) -> None:
+    manager = BackupManager(tmp_path / "missing" / "hej.sqlite", tmp_path)
+    with pytest.raises(sqlite3.Error):
+        await manager.backup()
+    assert manager.failures == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+async def test_backup__prune(tmp_path: Path, db_path: Path) -> None:
+    directory = tmp_path / "backups"
+    directory.mkdir()
+    for day in range(1, 5):
+        (directory / f"hej-2000010{day}T000000Z.sqlite").touch()
+    (directory / "other-20000101T000000Z.sqlite").touch()
+    manager = BackupManager(db_path, directory, keep=2)
+    path = await manager.backup()
+    assert manager.backup_paths() == [
+        directory / "hej-20000104T000000Z.sqlite",
+        path,
+    ]
+    assert (directory / "other-20000101T000000Z.sqlite").exists()
+
+
+async def test_backup__prune_removed(
+    tmp_path: Path, db_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    directory = tmp_path / "backups"
+    manager = BackupManager(db_path, directory, keep=1)
+    removed = directory / "hej-20000101T000000Z.sqlite"
+    paths = manager.backup_paths
+    monkeypatch.setattr(manager, "backup_paths", lambda: [removed, *paths()])
+    await manager.backup()
+    assert manager.failures == 0
+
+
+async def test_backup_if_due(tmp_path: Path, db_path: Path) -> None:
+    directory = tmp_path / "backups"
+    manager = BackupManager(db_path, directory)
+    other = BackupManager(db_path, directory)
+    path = await manager.backup_if_due(3600)
+    assert path is not None
+    assert await other.backup_if_due(3600) is None
+    assert manager.backup_paths() == [path]
+    with manager._try_lock() as locked:
+        assert locked
+        assert await other.backup_if_due(0) is None
+    assert await other.backup_if_due(0) is not None
+
+
+async def test_run_periodically(tmp_path: Path, db_path: Path) -> None:
+    manager = BackupManager(db_path, tmp_path / "backups")
+    task = asyncio.create_task(manager.run_periodically(0.01))
+    while manager.backups == 0:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert len(manager.backup_paths()) == 1
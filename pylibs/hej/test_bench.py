@@ -0,0 +1,351 @@
+"""Micro-benchmarks.
+
+Benchmarks are skipped unless the HEJ_BENCHMARK environment variable is
+set. Run them with:
+
+    HEJ_BENCHMARK=1 pytest -s pylibs/hej/test_bench.py
+"""
+
+import datetime
+import os
+import random
+import time
+import tracemalloc
+from collections.abc import Awaitable, Callable, Sequence
+from dataclasses import dataclass
+from sqlite3 import Row
+from typing import Any
+from uuid import UUID
+
+import pytest
+
+from .db import (
+    _NOTE_COLUMNS,
+    _NOTE_META_COLUMNS,
+    _NOTE_SORT_ORDERS,
+    NoteSort,
+    _ConnectionBase,
+    _note_from_db,
+    _note_meta_from_db,
+    db_datetime,
+    decode_note_text,
+    select_note,
+    update_note,
+)
+from .note import Note, _check_utc
+from .testutil_db import DatabaseFixture, db
+
+pytestmark = pytest.mark.skipif(
+    not os.getenv("HEJ_BENCHMARK"), reason="HEJ_BENCHMARK is not set"
+)
+
+_UUID = UUID("7bb570bf-2e21-4baf-b963-23c454e052ab")
+
+
+async def _timeit(func: Callable[[int], Awaitable[object]], n: int) -> float:
+    """Return the average time of a call in microseconds."""
+    start = time.perf_counter()
+    for i in range(n):
+        await func(i)
+    return (time.perf_counter() - start) / n * 1_000_000
+
+
+async def _update_note_select_first(
+    db: _ConnectionBase, uuid: UUID, text: str
+) -> Note:
+    """The former implementation of update_note().
+
+    The revision is incremented as in the current implementation, so that
+    history is recorded for both.
+    """
+    old_note = await select_note(db, uuid)
+    now = datetime.datetime.now(datetime.UTC)
+    await db.execute(
+        "UPDATE notes SET title = ?, text = ?, favorite = ?, "
+        "last_changed = ?, revision = revision + 1 WHERE uuid = ?",
+        [
+            old_note.title,
+            text,
+            old_note.favorite,
+            db_datetime(now),
+            str(uuid),
+        ],
+    )
+    row = await db.execute_fetchone(
+        f"SELECT {_NOTE_COLUMNS} FROM notes WHERE uuid = ?", [str(uuid)]
+    )
+    assert row is not None
+    return _note_from_db(row)
+
+
+async def test_update_note(
+    db: DatabaseFixture, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # The former implementation stored texts uncompressed.
+    monkeypatch.setenv("HEJ_DB_COMPRESS_MIN_SIZE", "0")
+    text = "Lorem ipsum dolor sit amet. " * 2000
+    await db.insert_note(uuid=_UUID, title="Title", text=text)
+
+    async with db.begin() as t:
+
+        async def returning(i: int) -> Note:
+            return await update_note(t, _UUID, text=f"{text}{i}")
+
+        async def select_first(i: int) -> Note:
+            return await _update_note_select_first(t, _UUID, f"{text}{i}")
+
+        await _timeit(returning, 10)
+        # Alternate, since edits get slower as the history grows.
+        current = baseline = float("inf")
+        for _ in range(5):
+            baseline = min(baseline, await _timeit(select_first, 100))
+            current = min(current, await _timeit(returning, 100))
+
+    print(
+        f"\nupdate_note: {current:.0f} µs/edit, "
+        f"select + update + select: {baseline:.0f} µs/edit"
+    )
+    assert current < baseline
+
+
+@dataclass
+class _OldNote:
+    """The former Note class."""
+
+    uuid: UUID
+    title: str
+    text: str
+    favorite: bool
+    creation_date: datetime.datetime
+    last_changed: datetime.datetime
+    revision: int = 1
+
+    def __post_init__(self) -> None:
+        _check_utc("creation_date", self.creation_date)
+        _check_utc("last_changed", self.last_changed)
+
+
+def _old_datetime_from_db(s: str) -> datetime.datetime:
+    if not s.endswith("Z"):
+        s += "Z"
+    return datetime.datetime.fromisoformat(s[:-1]).replace(tzinfo=datetime.UTC)
+
+
+def _old_note_from_db(row: Row) -> _OldNote:
+    """The former implementation of _note_from_db()."""
+    return _OldNote(
+        UUID(row["uuid"]),
+        row["title"],
+        decode_note_text(row["text"], row["compressed"]),
+        bool(row["favorite"]),
+        _old_datetime_from_db(row["creation_date"]),
+        _old_datetime_from_db(row["last_changed"]),
+        row["revision"],
+    )
+
+
+def _time_decode(
+    rows: Sequence[Row], decode: Callable[[Row], object]
+) -> float:
+    """Return the decode time in µs per row."""
+    start = time.perf_counter()
+    notes = [decode(row) for row in rows]
+    elapsed = time.perf_counter() - start
+    del notes
+    return elapsed / len(rows) * 1_000_000
+
+
+def _measure_decode_memory(
+    rows: Sequence[Row], decode: Callable[[Row], object]
+) -> float:
+    """Return the memory of decoded rows in bytes per row."""
+    tracemalloc.start()
+    notes = [decode(row) for row in rows]
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del notes
+    return memory / len(rows)
+
+
+async def test_decode_notes(db: DatabaseFixture) -> None:
+    dt = db_datetime(datetime.datetime(2000, 1, 1, 12, tzinfo=datetime.UTC))
+    async with db.begin() as t:
+        await t.execute_many(
+            "INSERT INTO notes(uuid, title, text, creation_date, "
+            "last_changed) VALUES(?, ?, ?, ?, ?)",
+            (
+                [str(UUID(int=i)), f"Note {i}", "Text", dt, dt]
+                for i in range(100_000)
+            ),
+        )
+    rows = [
+        row
+        async for row in db.db.execute_fetchall(
+            f"SELECT {_NOTE_COLUMNS} FROM notes"
+        )
+    ]
+    # Dates in the formats used before they were stored as integers.
+    old_rows = [
+        row
+        async for row in db.db.execute_fetchall(
+            "SELECT uuid, title, text, compressed, favorite, "
+            "strftime('%Y-%m-%d %H:%M:%S', creation_date / 1000, 'unixepoch') "
+            "AS creation_date, "
+            "strftime('%Y-%m-%dT%H:%M:%SZ', last_changed / 1000, 'unixepoch') "
+            "AS last_changed, revision FROM notes"
+        )
+    ]
+
+    # Runs alternate, so that changes in machine load affect both. The
+    # best run counts.
+    old_time = time_ = float("inf")
+    for _ in range(5):
+        old_time = min(old_time, _time_decode(old_rows, _old_note_from_db))
+        time_ = min(time_, _time_decode(rows, _note_from_db))
+    old_memory = _measure_decode_memory(old_rows, _old_note_from_db)
+    memory = _measure_decode_memory(rows, _note_from_db)
+
+    print(
+        f"\ndecode 100k notes: {time_:.2f} µs/row, {memory:.0f} B/note; "
+        f"before: {old_time:.2f} µs/row, {old_memory:.0f} B/note"
+    )
+    assert time_ < old_time
+    assert memory < old_memory
+
+
+# The notes table before dates were stored as integers.
+_OLD_NOTES_SCHEMA = """
+CREATE TABLE old_notes(
+    id INTEGER PRIMARY KEY,
+    uuid BLOB NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    text TEXT NOT NULL,
+    creation_date TEXT NOT NULL,
+    last_changed TEXT NOT NULL,
+    favorite INTEGER NOT NULL DEFAULT FALSE,
+    revision INTEGER NOT NULL DEFAULT 1,
+    compressed INTEGER NOT NULL DEFAULT FALSE
+);
+CREATE INDEX old_notes_last_changed_uuid ON old_notes(last_changed, uuid);
+"""
+
+_OLD_META_COLUMNS = _NOTE_META_COLUMNS.replace("notes.", "old_notes.")
+
+
+def _old_db_datetime(dt: datetime.datetime) -> str:
+    return dt.isoformat()[:19].replace("T", " ")
+
+
+def _old_db_datetime_z(dt: datetime.datetime) -> str:
+    return dt.isoformat()[:19] + "Z"
+
+
+async def _insert_scan_notes(db: DatabaseFixture, n: int) -> None:
+    """Insert the same notes into the notes and old_notes tables."""
+    start = datetime.datetime(2015, 1, 1, tzinfo=datetime.UTC)
+    rnd = random.Random(0)
+    notes = []
+    for i in range(n):
+        created = start + datetime.timedelta(seconds=rnd.randrange(3 * 10**8))
+        changed = created + datetime.timedelta(seconds=rnd.randrange(10**7))
+        notes.append((str(UUID(int=i)), f"Note {i}", created, changed))
+    text = "Lorem ipsum dolor sit amet. " * 10
+    await db.db.execute_script(_OLD_NOTES_SCHEMA)
+    async with db.begin() as t:
+        await t.execute_many(
+            "INSERT INTO old_notes(uuid, title, text, creation_date, "
+            "last_changed, favorite) VALUES(?, ?, ?, ?, ?, ?)",
+            (
+                [
+                    uuid,
+                    title,
+                    text,
+                    _old_db_datetime(created),
+                    _old_db_datetime_z(changed),
+                    i % 10 == 0,
+                ]
+                for i, (uuid, title, created, changed) in enumerate(notes)
+            ),
+        )
+        await t.execute_many(
+            "INSERT INTO notes(uuid, title, text, creation_date, "
+            "last_changed, favorite) VALUES(?, ?, ?, ?, ?, ?)",
+            (
+                [
+                    uuid,
+                    title,
+                    text,
+                    db_datetime(created),
+                    db_datetime(changed),
+                    i % 10 == 0,
+                ]
+                for i, (uuid, title, created, changed) in enumerate(notes)
+            ),
+        )
+
+
+async def test_sorted_range_scans(db: DatabaseFixture) -> None:
+    await _insert_scan_notes(db, 100_000)
+    since = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    # (name, old query, old parameters, new query, new parameters)
+    queries: list[tuple[str, str, list[Any], str, list[Any]]] = [
+        (
+            "changed since",
+            f"SELECT {_OLD_META_COLUMNS} FROM old_notes "
+            "WHERE last_changed >= ? ORDER BY last_changed, uuid",
+            [_old_db_datetime_z(since)],
+            f"SELECT {_NOTE_META_COLUMNS} FROM notes "
+            "WHERE last_changed >= ? ORDER BY last_changed, uuid",
+            [db_datetime(since)],
+        ),
+        (
+            "latest created",
+            f"SELECT {_OLD_META_COLUMNS} FROM old_notes "
+            "ORDER BY creation_date DESC, uuid LIMIT 100",
+            [],
+            f"SELECT {_NOTE_META_COLUMNS} FROM notes "
+            f"ORDER BY {_NOTE_SORT_ORDERS[NoteSort.CREATED]} LIMIT 100",
+            [],
+        ),
+        (
+            "latest favorites",
+            f"SELECT {_OLD_META_COLUMNS} FROM old_notes "
+            "WHERE favorite ORDER BY last_changed DESC, uuid LIMIT 100",
+            [],
+            f"SELECT {_NOTE_META_COLUMNS} FROM notes "
+            f"WHERE notes.favorite = TRUE "
+            f"ORDER BY {_NOTE_SORT_ORDERS[NoteSort.CHANGED]} LIMIT 100",
+            [],
+        ),
+    ]
+
+    def scan(
+        query: str, parameters: list[Any], decode: Callable[[Row], object]
+    ) -> Callable[[int], Awaitable[object]]:
+        async def run(_: int) -> object:
+            rows = db.db.execute_fetchall(query, parameters)
+            return [decode(row) async for row in rows]
+
+        return run
+
+    for name, old_query, old_parameters, query, parameters in queries:
+        old_scan = scan(old_query, old_parameters, _old_meta)
+        new_scan = scan(query, parameters, _note_meta_from_db)
+        old = new = float("inf")
+        for _ in range(5):
+            old = min(old, await _timeit(old_scan, 4))
+            new = min(new, await _timeit(new_scan, 4))
+        print(f"\n{name}: {new:.0f} µs; before: {old:.0f} µs", end="")
+        assert new < old
+    print()
+
+
+def _old_meta(row: Row) -> tuple[object, ...]:
+    return (
+        UUID(row["uuid"]),
+        row["title"],
+        bool(row["favorite"]),
+        _old_datetime_from_db(row["creation_date"]),
+        _old_datetime_from_db(row["last_changed"]),
+        row["revision"],
+    )
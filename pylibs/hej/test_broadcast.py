@@ -0,0 +1,59 @@
+import asyncio
+from uuid import UUID
+
+import pytest
+
+from .broadcast import Broadcaster, NoteEvent, NoteEventType
+from .exc import SubscriptionOverflowError
+
+_EVENT1 = NoteEvent(NoteEventType.DELETED, UUID(int=1))
+_EVENT2 = NoteEvent(NoteEventType.DELETED, UUID(int=2))
+
+
+async def test_publish() -> None:
+    broadcaster = Broadcaster()
+    async with (
+        broadcaster.subscribe() as sub1,
+        broadcaster.subscribe() as sub2,
+    ):
+        broadcaster.publish(_EVENT1)
+        broadcaster.publish(_EVENT2)
+        assert await anext(sub1) == _EVENT1
+        assert await anext(sub1) == _EVENT2
+        assert await anext(sub2) == _EVENT1
+        assert await anext(sub2) == _EVENT2
+
+
+async def test_unsubscribe() -> None:
+    broadcaster = Broadcaster()
+    async with broadcaster.subscribe():
+        assert broadcaster.metrics()["hej_subscribers"] == 1
+    assert broadcaster.metrics()["hej_subscribers"] == 0
+    broadcaster.publish(_EVENT1)
+
+
+async def test_waits_for_events() -> None:
+    broadcaster = Broadcaster()
+    async with broadcaster.subscribe() as sub:
+        task = asyncio.create_task(anext(sub))
+        await asyncio.sleep(0)
+        assert not task.done()
+        broadcaster.publish(_EVENT1)
+        assert await task == _EVENT1
+
+
+async def test_overflow() -> None:
+    broadcaster = Broadcaster(queue_size=2)
+    async with (
+        broadcaster.subscribe() as slow,
+        broadcaster.subscribe() as fast,
+    ):
+        for _ in range(3):
+            broadcaster.publish(_EVENT1)
+            assert await anext(fast) == _EVENT1
+        assert await anext(slow) == _EVENT1
+        assert await anext(slow) == _EVENT1
+        with pytest.raises(SubscriptionOverflowError):
+            await anext(slow)
+        assert broadcaster.metrics()["hej_subscribers"] == 1
+        assert broadcaster.metrics()["hej_subscribers_dropped"] == 1
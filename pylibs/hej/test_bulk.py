@@ -0,0 +1,189 @@
+import datetime
+import io
+from dataclasses import replace
+from pathlib import PurePath
+from uuid import UUID
+
+import pytest
+
+from .bulk import (
+    NoteFormat,
+    export_notes,
+    guess_format,
+    import_notes,
+    note_from_dict,
+    note_from_markdown,
+    note_to_markdown,
+    read_notes,
+)
+from .db import select_all_notes, select_notes_changed_since
+from .exc import NoteFormatError
+from .note import Note
+from .testutil_db import DatabaseFixture, db
+
+_UUID = UUID("7bb570bf-2e21-4baf-b963-23c454e052ab")
+_UUID2 = UUID("dd877ebd-a9cf-466d-99f2-1327e2068ff2")
+_DATE = datetime.datetime(2000, 1, 1, 12, 0, 0, tzinfo=datetime.UTC)
+
+
+def _note(uuid: UUID = _UUID, title: str = "Title", text: str = "") -> Note:
+    return Note(uuid, title, text, False, _DATE, _DATE)
+
+
+def test_guess_format() -> None:
+    assert guess_format(PurePath("notes.jsonl")) == (NoteFormat.JSONL, False)
+    assert guess_format(PurePath("notes.JSONL.GZ")) == (NoteFormat.JSONL, True)
+    assert guess_format(PurePath("notes.TAR.GZ")) == (NoteFormat.TAR, True)
+    assert guess_format(PurePath("notes.tgz")) == (NoteFormat.TAR, True)
+    assert guess_format(PurePath("notes.tar")) == (NoteFormat.TAR, False)
+    assert guess_format(PurePath("notes.zip")) == (NoteFormat.ZIP, False)
+    assert guess_format(PurePath("notes.bgz")) == (NoteFormat.JSONL, False)
+    assert guess_format(PurePath("<stdout>")) == (NoteFormat.JSONL, False)
+
+
+def test_note_from_dict() -> None:
+    note = note_from_dict(
+        {
+            "uuid": str(_UUID),
+            "title": "Title",
+            "text": "Text",
+            "favorite": True,
+            "creation_date": "2000-01-01T13:00:00+01:00",
+            "last_changed": "2000-01-01T12:00:00",
+        }
+    )
+    assert note == Note(_UUID, "Title", "Text", True, _DATE, _DATE)
+
+
+def test_note_from_dict__defaults() -> None:
+    note = note_from_dict({"title": "Title"})
+    assert note.text == ""
+    assert not note.favorite
+    assert note.last_changed.tzinfo == datetime.UTC
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {},
+        {"title": 1},
+        {"title": "Title", "uuid": "invalid"},
+        {"title": "Title", "favorite": "yes"},
+        {"title": "Title", "last_changed": "yesterday"},
+    ],
+)
+def test_note_from_dict__invalid(data: dict[str, object]) -> None:
+    with pytest.raises(NoteFormatError):
+        note_from_dict(data)
+
+
+def test_markdown__round_trip() -> None:
+    note = _note(title='A "quoted": title\n', text="---\nText\r\n\n")
+    markdown = note_to_markdown(note)
+    assert markdown.startswith("---\nuuid: ")
+    assert markdown.endswith("---\n---\nText\r\n\n")
+    assert note_from_markdown(markdown) == note
+
+
+@pytest.mark.parametrize(
+    "markdown",
+    ["Text", '---\ntitle: "Title"\n', "---\ntitle\n---\n", "---\ntitle: x\n"],
+)
+def test_note_from_markdown__invalid(markdown: str) -> None:
+    with pytest.raises(NoteFormatError):
+        note_from_markdown(markdown)
+
+
+@pytest.mark.parametrize(
+    "format, compress",
+    [
+        (NoteFormat.JSONL, False),
+        (NoteFormat.JSONL, True),
+        (NoteFormat.TAR, False),
+        (NoteFormat.TAR, True),
+        (NoteFormat.ZIP, False),
+    ],
+)
+async def test_export_import(
+    db: DatabaseFixture, format: NoteFormat, compress: bool
+) -> None:
+    await db.insert_note(uuid=_UUID, title="Title", text="Text")
+    await db.insert_note(uuid=_UUID2, title="Große", text="x" * 10_000)
+    notes = await select_all_notes(db.db)
+    stream = io.BytesIO()
+    assert await export_notes(db.db, stream, format, compress=compress) == 2
+    async with db.begin() as t:
+        await t.execute("DELETE FROM notes")
+    stream.seek(0)
+    notes_read = read_notes(stream, format, compress=compress)
+    result = await import_notes(db.db, notes_read)
+    assert result.imported == 2
+    imported = await select_all_notes(db.db)
+    # Imported notes are marked as changed at the time of the import.
+    assert [replace(n, last_changed=_DATE) for n in imported] == [
+        replace(n, last_changed=_DATE) for n in notes
+    ]
+
+
+def test_read_notes__jsonl_errors() -> None:
+    stream = io.BytesIO(b'{"title": "Title"}\n\n[]\n')
+    notes = read_notes(stream, NoteFormat.JSONL)
+    assert next(notes).title == "Title"
+    with pytest.raises(NoteFormatError, match="line 3"):
+        next(notes)
+
+
+async def test_import_notes__skip_existing(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Old")
+    notes = [_note(_UUID, "New"), _note(_UUID2, "Other")]
+    result = await import_notes(db.db, notes)
+    assert result.read == 2
+    assert result.imported == 1
+    assert result.skipped == 1
+    await db.assert_rows_equal(
+        "notes",
+        [
+            {"uuid": _UUID, "title": "Old", "revision": 1},
+            {"uuid": _UUID2, "title": "Other", "revision": 1},
+        ],
+    )
+
+
+async def test_import_notes__replace(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Old")
+    await db.insert(
+        "deleted_notes",
+        {"uuid": _UUID2, "deletion_date": _DATE},
+    )
+    notes = [_note(_UUID, "New", "x" * 10_000), _note(_UUID2, "Other")]
+    result = await import_notes(db.db, notes, replace=True, batch_size=1)
+    assert result.imported == 2
+    await db.assert_rows_equal(
+        "notes",
+        [
+            {"uuid": _UUID, "title": "New", "revision": 2, "compressed": 1},
+            {"uuid": _UUID2, "title": "Other", "revision": 1},
+        ],
+    )
+    assert await db.select_all_rows("deleted_notes") == []
+
+
+@pytest.mark.parametrize(
+    "replace_existing, titles",
+    [(False, ["Restored"]), (True, ["New", "Restored"])],
+)
+async def test_import_notes__changed_since(
+    db: DatabaseFixture, replace_existing: bool, titles: list[str]
+) -> None:
+    await db.insert_note(uuid=_UUID, title="Old")
+    await db.insert(
+        "deleted_notes",
+        {"uuid": _UUID2, "deletion_date": _DATE},
+    )
+    since = datetime.datetime.now(datetime.UTC) - datetime.timedelta(seconds=1)
+    notes = [_note(_UUID, "New"), _note(_UUID2, "Restored")]
+    await import_notes(db.db, notes, replace=replace_existing)
+    changed = await select_notes_changed_since(db.db, since)
+    assert [n.title for n in changed] == titles
+    assert all(n.creation_date == _DATE for n in changed)
+    assert all(n.last_changed >= since for n in changed)
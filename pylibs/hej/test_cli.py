@@ -0,0 +1,186 @@
+import json
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from .cli import cli
+from .db import Transaction, insert_note
+from .note import Note
+
+
+def _run(db_path: Path, *args: str, input: str | None = None) -> str:
+    result = CliRunner().invoke(
+        cli, ["--database", str(db_path), *args], input=input, obj={}
+    )
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_shell(tmp_path: Path) -> None:
+    db_path = tmp_path / "hej.sqlite"
+    commands = (
+        '# Create notes\ncreate "First note" "Text"\n\ncreate Second ""\n'
+        "list\n"
+    )
+    output = _run(db_path, "shell", "--batch-size", "1", input=commands)
+    assert output.count("Note created") == 2
+    assert "Total 2 notes" in output
+    assert "Total 2 notes" in _run(db_path, "list")
+
+
+def test_shell__failures(tmp_path: Path) -> None:
+    db_path = tmp_path / "hej.sqlite"
+    commands = (
+        "create One ''\n"
+        "delete 7bb570bf-2e21-4baf-b963-23c454e052ab\n"
+        "unknown\n"
+        "backup\n"
+        'create "Two\n'
+        "create Three ''\n"
+        "create Four\n"
+    )
+    result = CliRunner().invoke(
+        cli, ["--database", str(db_path), "shell"], input=commands, obj={}
+    )
+    assert result.exit_code == 1
+    assert "Command in line 2 failed" in result.output
+    assert "unknown command 'unknown'" in result.output
+    assert "unknown command 'backup'" in result.output
+    assert "Command in line 5 failed" in result.output
+    assert "Missing argument 'TEXT'" in result.output
+    assert "5 commands failed" in result.output
+    assert "Total 2 notes" in _run(db_path, "list")
+
+
+def _fail_on_title(
+    monkeypatch: pytest.MonkeyPatch, title: str, exc: BaseException
+) -> None:
+    async def fake_insert_note(db: Transaction, t: str, text: str) -> Note:
+        note = await insert_note(db, t, text)
+        if t == title:
+            raise exc
+        return note
+
+    monkeypatch.setattr("hej.cli.insert_note", fake_insert_note)
+
+
+def test_shell__unexpected_error(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    db_path = tmp_path / "hej.sqlite"
+    _fail_on_title(monkeypatch, "Fail", sqlite3.OperationalError("I/O"))
+    commands = "create One x\ncreate Fail x\ncreate Two x\n"
+    result = CliRunner().invoke(
+        cli, ["--database", str(db_path), "shell"], input=commands, obj={}
+    )
+    assert result.exit_code == 1
+    assert "Error: I/O" in result.output
+    assert "1 commands failed" in result.output
+    assert "Total 2 notes" in _run(db_path, "list")
+
+
+def test_shell__interrupted(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    db_path = tmp_path / "hej.sqlite"
+    _fail_on_title(monkeypatch, "Stop", KeyboardInterrupt())
+    commands = "create One x\ncreate Stop x\ncreate Two x\n"
+    result = CliRunner().invoke(
+        cli, ["--database", str(db_path), "shell"], input=commands, obj={}
+    )
+    assert result.exit_code == 1
+    assert "Aborted" in result.output
+    assert "Total 1 notes" in _run(db_path, "list")
+
+
+def test_shell__file(tmp_path: Path) -> None:
+    db_path = tmp_path / "hej.sqlite"
+    path = tmp_path / "commands.txt"
+    path.write_text("\n".join(f"create 'Note {i}' ''" for i in range(250)))
+    _run(db_path, "shell", str(path))
+    assert "Total 250 notes" in _run(db_path, "list")
+
+
+def test_export_import__gzip(tmp_path: Path) -> None:
+    db_path = tmp_path / "hej.sqlite"
+    _run(db_path, "shell", input="create One x\ncreate Two x\n")
+    path = tmp_path / "notes.JSONL.GZ"
+    _run(db_path, "export", str(path))
+    assert path.read_bytes().startswith(b"\x1f\x8b")
+    other_path = tmp_path / "other.sqlite"
+    assert "Imported 2 notes" in _run(other_path, "import", str(path))
+    result = CliRunner().invoke(
+        cli,
+        ["--database", str(db_path), "export", str(tmp_path / "n.zip.gz")],
+        obj={},
+    )
+    assert result.exit_code == 2
+    assert "zip archives can't be gzip compressed" in result.output
+
+
+def test_list(tmp_path: Path) -> None:
+    db_path = tmp_path / "hej.sqlite"
+    _run(
+        db_path,
+        "shell",
+        input="create Zulu x\ncreate Alpha x\ncreate Mike x\n",
+    )
+    output = _run(db_path, "list", "--sort", "title", "--limit", "2")
+    lines = output.splitlines()
+    assert [line.split(" ", 1)[1] for line in lines[:2]] == ["Alpha", "Mike"]
+    assert lines[-1] == "Total 2 notes"
+    output = _run(db_path, "list", "--format", "jsonl", "--sort", "title")
+    notes = [json.loads(line) for line in output.splitlines()]
+    assert [n["title"] for n in notes] == ["Alpha", "Mike", "Zulu"]
+    assert "text" not in notes[0]
+    output = _run(db_path, "list", "--favorites")
+    assert output == "Total 0 notes\n"
+
+
+def test_import_time() -> None:
+    """Importing the CLI must not load modules that few commands need."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import hej.cli"],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {
+        line.split("|")[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+    assert "hej.cli" in modules
+    for module in [
+        "dbupgrade",
+        "sqlalchemy",
+        "tarfile",
+        "zipfile",
+        "graphql",
+        "starlette",
+    ]:
+        assert module not in modules
+
+
+def test_up_to_date_db_does_not_import_dbupgrade(tmp_path: Path) -> None:
+    db_path = tmp_path / "hej.sqlite"
+    _run(db_path, "list")
+    code = (
+        "import sys\n"
+        "from hej.cli import main\n"
+        "try:\n"
+        "    main()\n"
+        "finally:\n"
+        "    assert 'dbupgrade' not in sys.modules\n"
+    )
+    subprocess.run(
+        [sys.executable, "-c", code, "--database", str(db_path), "list"],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        check=True,
+    )
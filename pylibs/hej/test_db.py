@@ -1,28 +1,261 @@
 from __future__ import annotations
 
+import asyncio
 import datetime
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+from collections.abc import AsyncGenerator
+from pathlib import Path
+from typing import Any
 from uuid import UUID
 
 import pytest
+from dbupgrade import MAX_API_LEVEL, VersionInfo, db_upgrade
 
 from .db import (
+    ConnectionPool,
+    ConnectionProfile,
+    NoteSort,
+    _WriteJob,
+    backup_db,
+    compact_note_history,
+    datetime_from_db,
+    db_compress_min_size,
     db_datetime,
-    db_datetime_old,
+    db_profile,
+    db_schema_path,
+    db_schema_version,
     delete_note,
+    encode_note_history,
+    fts_query,
+    initialize_db,
     insert_note,
+    insert_notes,
+    iter_notes_meta,
+    latest_schema_version,
+    migrate_db,
+    migrate_lock,
+    open_db,
+    open_pool,
     open_transaction,
+    patch_note,
+    read_transaction,
+    search_notes,
     select_all_notes,
+    select_all_notes_meta,
+    select_deleted_notes_since,
+    select_history_version,
     select_note,
+    select_note_at_revision,
+    select_note_history,
+    select_note_meta,
+    select_notes_changed_since,
+    select_notes_page,
+    select_notes_version,
     update_note,
+    write_transaction,
 )
-from .exc import UnknownItemError
-from .note import Note
-from .testutil_db import DatabaseFixture, db
+from .exc import DBMigrationError, RevisionConflictError, UnknownItemError
+from .history import SNAPSHOT_INTERVAL
+from .note import DeletedNote, Note, NoteMeta
+from .patch import TextEdit
+from .testutil_db import SCHEMA_PATH, DatabaseFixture, db
 
 _UUID = UUID("7bb570bf-2e21-4baf-b963-23c454e052ab")
 _UUID2 = UUID("dd877ebd-a9cf-466d-99f2-1327e2068ff2")
 
 
+def _schema_objects(db: sqlite3.Connection) -> set[tuple[str, ...]]:
+    objects: set[tuple[str, ...]] = set()
+    for type_, name in db.execute("SELECT type, name FROM sqlite_master"):
+        if name == "db_config" or name.startswith("sqlite_"):
+            continue
+        objects.add((type_, name))
+        if type_ == "table":
+            for column in db.execute(f"PRAGMA table_info('{name}')"):
+                objects.add((name, *(str(c) for c in column)))
+    return objects
+
+
+def test_initialize_db__matches_schema(tmp_path: Path) -> None:
+    result = initialize_db(tmp_path / "hej.sqlite")
+    assert result.success
+    migrated = sqlite3.connect(tmp_path / "hej.sqlite")
+    fresh = sqlite3.connect(":memory:")
+    fresh.executescript(SCHEMA_PATH.read_text())
+    assert _schema_objects(migrated) == _schema_objects(fresh)
+
+
+def test_latest_schema_version() -> None:
+    assert latest_schema_version() == len(list(db_schema_path().glob("*.sql")))
+
+
+def test_db_schema_version(tmp_path: Path) -> None:
+    path = tmp_path / "hej.sqlite"
+    assert db_schema_version(path) is None
+    sqlite3.connect(path).close()
+    assert db_schema_version(path) is None
+    initialize_db(path)
+    assert db_schema_version(path) == latest_schema_version()
+
+
+def _migrate_to_version(path: Path, version: int) -> None:
+    db_upgrade(
+        "hej",
+        f"sqlite:///{path}",
+        str(db_schema_path()),
+        VersionInfo(version, MAX_API_LEVEL),
+    )
+
+
+async def test_migrate__epoch_dates(tmp_path: Path) -> None:
+    path = tmp_path / "hej.sqlite"
+    _migrate_to_version(path, 11)
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "INSERT INTO notes(uuid, title, text, creation_date, "
+            "last_changed) VALUES(?, 'Title', 'Text', "
+            "'2021-05-14 13:19:04', '2021-09-19T04:34:12Z')",
+            [str(_UUID)],
+        )
+        conn.execute(
+            "INSERT INTO deleted_notes(uuid, deletion_date) "
+            "VALUES(?, '2021-06-02T10:00:00Z')",
+            [str(_UUID2)],
+        )
+    conn.close()
+    assert initialize_db(path).success
+    async with open_db(str(path)) as db:
+        note = await select_note(db, _UUID)
+        assert note.creation_date == datetime.datetime(
+            2021, 5, 14, 13, 19, 4, tzinfo=datetime.UTC
+        )
+        assert note.last_changed == datetime.datetime(
+            2021, 9, 19, 4, 34, 12, tzinfo=datetime.UTC
+        )
+        results = await search_notes(db, "text", first=10)
+        assert [r.note.uuid for r in results] == [_UUID]
+        since = datetime.datetime(2021, 6, 1, tzinfo=datetime.UTC)
+        deleted = await select_deleted_notes_since(db, since)
+        assert [d.deletion_date.hour for d in deleted] == [10]
+
+
+async def test_migrate__note_history(tmp_path: Path) -> None:
+    path = tmp_path / "hej.sqlite"
+    _migrate_to_version(path, 9)
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "INSERT INTO notes(uuid, title, text, creation_date, "
+            "last_changed) VALUES(?, 'Title', 'Old text', "
+            "'2021-05-14 13:19:04', '2021-09-19T04:34:12Z')",
+            [str(_UUID)],
+        )
+    conn.close()
+    assert initialize_db(path).success
+    async with open_db(str(path)) as db:
+        await update_note(db, _UUID, text="New text")
+        assert len(await select_note_history(db, _UUID)) == 2
+        old_note = await select_note_at_revision(db, _UUID, 1)
+        assert old_note.text == "Old text"
+
+
+async def test_initialize_db__plain_sqlite(tmp_path: Path) -> None:
+    path = tmp_path / "hej.sqlite"
+    initialize_db(path)
+    # The schema does not depend on functions registered by the app.
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "INSERT INTO notes(uuid, title, text, creation_date, "
+            "last_changed) VALUES(?, 'Title', 'Old text', 0, 0)",
+            [str(_UUID)],
+        )
+        conn.execute(
+            "UPDATE notes SET text = 'New text', revision = revision + 1"
+        )
+    conn.close()
+    async with open_db(str(path)) as db:
+        results = await search_notes(db, "new", first=10)
+        assert [r.note.uuid for r in results] == [_UUID]
+        assert await search_notes(db, "old", first=10) == []
+        old_note = await select_note_at_revision(db, _UUID, 1)
+        assert old_note.text == "Old text"
+
+
+def test_migrate_db__up_to_date(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = tmp_path / "hej.sqlite"
+    monkeypatch.setenv("HEJ_DB_PATH", str(path))
+    initialize_db(path)
+    migrate_db()
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_migrate_db__pending(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = tmp_path / "hej.sqlite"
+    monkeypatch.setenv("HEJ_DB_PATH", str(path))
+    _migrate_to_version(path, 5)
+    migrate_db()
+    assert db_schema_version(path) == latest_schema_version()
+    backups = list(tmp_path.glob(f"hej.sqlite.{os.getpid()}"))
+    assert len(backups) == 1
+    assert db_schema_version(backups[0]) == 5
+
+
+def test_migrate_lock(tmp_path: Path) -> None:
+    path = tmp_path / "hej.sqlite"
+    with migrate_lock(path, timeout=1):
+        lock_path = tmp_path / "hej.sqlite.migrate.lock"
+        assert lock_path.read_text() == str(os.getpid())
+        with pytest.raises(DBMigrationError, match=str(os.getpid())):
+            with migrate_lock(path, timeout=0.05):
+                pass
+    with migrate_lock(path, timeout=0.05):
+        pass
+
+
+def test_migrate_lock__dead_owner(tmp_path: Path) -> None:
+    path = tmp_path / "hej.sqlite"
+    with migrate_lock(path, timeout=1):
+        (tmp_path / "hej.sqlite.migrate.lock").write_text("999999999")
+        with pytest.raises(DBMigrationError, match="no longer running"):
+            with migrate_lock(path, timeout=0.05):
+                pass
+
+
+def test_migrate_db__migrated_by_other_process(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = tmp_path / "hej.sqlite"
+    monkeypatch.setenv("HEJ_DB_PATH", str(path))
+    _migrate_to_version(path, 5)
+    with migrate_lock(path):
+        thread = threading.Thread(target=migrate_db)
+        thread.start()
+        initialize_db(path)
+    thread.join()
+    assert list(tmp_path.glob(f"hej.sqlite.{os.getpid()}")) == []
+
+
+def test_backup_db(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    source = tmp_path / "source.sqlite"
+    with sqlite3.connect(source) as db:
+        db.execute("CREATE TABLE foo(bar)")
+        db.executemany("INSERT INTO foo(bar) VALUES(?)", [("x" * 1000,)] * 100)
+    db.close()
+    with caplog.at_level(logging.INFO):
+        backup_db(source, tmp_path / "target.sqlite", pages=5)
+    target = sqlite3.connect(tmp_path / "target.sqlite")
+    assert target.execute("SELECT count(*) FROM foo").fetchone() == (100,)
+    target.close()
+    assert "Database backup 100% done" in caplog.messages
+
+
 async def test_open_transaction() -> None:
     async with open_transaction(":memory:") as t:
         async with t.db.execute("CREATE TABLE foo(bar)") as c:
@@ -30,6 +263,295 @@ async def test_open_transaction() -> None:
             assert res is None
 
 
+@pytest.fixture
+async def pool(tmp_path: Path) -> AsyncGenerator[ConnectionPool]:
+    async with open_transaction(f"file:{tmp_path / 'hej.sqlite'}") as t:
+        await t.db.execute("CREATE TABLE foo(bar)")
+    async with open_pool(f"file:{tmp_path / 'hej.sqlite'}", readers=2) as p:
+        yield p
+
+
+async def test_pool__write_and_read(pool: ConnectionPool) -> None:
+    async with write_transaction() as t:
+        await t.execute("INSERT INTO foo(bar) VALUES(42)")
+    async with read_transaction() as t:
+        row = await t.execute_fetchone("SELECT bar FROM foo")
+    assert row is not None
+    assert row["bar"] == 42
+    assert pool.writer_stats.checkouts == 1
+    assert pool.reader_stats.checkouts == 1
+
+
+async def test_pool__readers_are_read_only(pool: ConnectionPool) -> None:
+    with pytest.raises(sqlite3.OperationalError):
+        async with pool.read() as t:
+            await t.execute("INSERT INTO foo(bar) VALUES(42)")
+
+
+async def test_pool__reuses_reader_connections(
+    pool: ConnectionPool,
+) -> None:
+    for _ in range(5):
+        async with pool.read() as t:
+            await t.execute_fetchone("SELECT * FROM foo")
+    assert pool.metrics()["hej_db_pool_readers_open"] == 1
+
+
+async def test_pool__bounded_readers(pool: ConnectionPool) -> None:
+    release = asyncio.Event()
+
+    async def read() -> None:
+        async with pool.read():
+            await release.wait()
+
+    tasks = [asyncio.create_task(read()) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    assert pool.metrics()["hej_db_pool_readers_open"] == 2
+    assert pool.reader_stats.checkouts == 2
+    release.set()
+    await asyncio.gather(*tasks)
+    assert pool.reader_stats.checkouts == 3
+    assert pool.reader_stats.wait_time_max > 0
+
+
+def test_db_profile(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert db_profile() == ConnectionProfile()
+    monkeypatch.setenv("HEJ_DB_SYNCHRONOUS", "FULL")
+    monkeypatch.setenv("HEJ_DB_MMAP_SIZE", "0")
+    profile = db_profile()
+    assert profile.synchronous == "full"
+    assert profile.mmap_size == 0
+    monkeypatch.setenv("HEJ_DB_JOURNAL_MODE", "wall")
+    with pytest.raises(RuntimeError):
+        db_profile()
+
+
+async def test_pool__profile(tmp_path: Path) -> None:
+    profile = ConnectionProfile(synchronous="full", busy_timeout=1234)
+    async with open_pool(f"file:{tmp_path / 'hej.sqlite'}", profile=profile):
+        async with write_transaction() as t:
+            row = await t.execute_fetchone("PRAGMA journal_mode")
+            assert row is not None
+            assert row[0] == "wal"
+        async with read_transaction() as t:
+            row = await t.execute_fetchone("PRAGMA synchronous")
+            assert row is not None
+            assert row[0] == 2
+            row = await t.execute_fetchone("PRAGMA busy_timeout")
+            assert row is not None
+            assert row[0] == 1234
+
+
+async def test_pool__batches_writes(pool: ConnectionPool) -> None:
+    async def write(i: int) -> None:
+        async with write_transaction() as t:
+            await t.execute("INSERT INTO foo(bar) VALUES(?)", [i])
+
+    await asyncio.gather(*(write(i) for i in range(10)))
+    async with read_transaction() as t:
+        rows = [row async for row in t.execute_fetchall("SELECT bar FROM foo")]
+    assert sorted(row["bar"] for row in rows) == list(range(10))
+    assert pool.writer_stats.checkouts == 10
+    assert pool.write_batches < 10
+    assert pool.write_batch_size_max > 1
+
+
+async def test_pool__failed_write_in_batch(pool: ConnectionPool) -> None:
+    async def write(i: int) -> None:
+        async with write_transaction() as t:
+            await t.execute("INSERT INTO foo(bar) VALUES(?)", [i])
+            if i == 1:
+                raise ValueError()
+
+    results = await asyncio.gather(
+        *(write(i) for i in range(3)), return_exceptions=True
+    )
+    assert isinstance(results[1], ValueError)
+    async with read_transaction() as t:
+        rows = [row async for row in t.execute_fetchall("SELECT bar FROM foo")]
+    assert sorted(row["bar"] for row in rows) == [0, 2]
+
+
+async def test_pool__write_cancelled_when_started(
+    pool: ConnectionPool, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    task: asyncio.Task[None] | None = None
+
+    def cancel(_: object) -> None:
+        assert task is not None
+        task.cancel()
+
+    class CancelledWriteJob(_WriteJob):
+        def __init__(self) -> None:
+            super().__init__()
+            # Runs after the writer has started the write, but before the
+            # waiting task resumes.
+            self.started.add_done_callback(cancel)
+
+    async def write(i: int) -> None:
+        async with write_transaction() as t:
+            await t.execute("INSERT INTO foo(bar) VALUES(?)", [i])
+
+    monkeypatch.setattr("hej.db._WriteJob", CancelledWriteJob)
+    task = asyncio.create_task(write(1))
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    monkeypatch.undo()
+    async with asyncio.timeout(5):
+        await write(2)
+    async with read_transaction() as t:
+        rows = [row async for row in t.execute_fetchall("SELECT bar FROM foo")]
+    assert [row["bar"] for row in rows] == [2]
+
+
+async def test_pool__read_during_write(tmp_path: Path) -> None:
+    path = tmp_path / "hej.sqlite"
+    async with open_transaction(f"file:{path}") as t:
+        await t.execute("CREATE TABLE foo(bar)")
+    profile = ConnectionProfile()
+    async with open_pool(f"file:{path}", profile=profile):
+        writing = asyncio.Event()
+        release = asyncio.Event()
+
+        async def write() -> None:
+            async with write_transaction() as t:
+                await t.execute("INSERT INTO foo(bar) VALUES(42)")
+                writing.set()
+                await release.wait()
+
+        task = asyncio.create_task(write())
+        await writing.wait()
+        async with read_transaction() as t:
+            row = await t.execute_fetchone("SELECT count(*) FROM foo")
+            assert row is not None
+            assert row[0] == 0
+        release.set()
+        await task
+        async with read_transaction() as t:
+            row = await t.execute_fetchone("SELECT count(*) FROM foo")
+            assert row is not None
+            assert row[0] == 1
+
+
+@pytest.fixture
+async def cached_pool(tmp_path: Path) -> AsyncGenerator[ConnectionPool]:
+    path = tmp_path / "hej.sqlite"
+    with sqlite3.connect(path) as db:
+        db.executescript(SCHEMA_PATH.read_text())
+    async with open_pool(f"file:{path}", note_cache_size=100_000) as p:
+        yield p
+
+
+async def test_note_cache__select_note(cached_pool: ConnectionPool) -> None:
+    async with write_transaction() as t:
+        note = await insert_note(t, "Title", "Text")
+    async with read_transaction() as t:
+        selected = await select_note(t, note.uuid)
+        assert selected == note
+        assert await select_note(t, note.uuid) is selected
+        assert await select_all_notes(t) == [note]
+        notes = await select_all_notes(t)
+        assert await select_note(t, note.uuid) is notes[0]
+    assert cached_pool.note_cache is not None
+    assert cached_pool.note_cache.hits == 4
+    assert cached_pool.note_cache.misses == 1
+
+
+async def test_note_cache__own_writes(cached_pool: ConnectionPool) -> None:
+    async with write_transaction() as t:
+        note1 = await insert_note(t, "Title 1", "Text")
+        note2 = await insert_note(t, "Title 2", "Text")
+    async with read_transaction() as t:
+        await select_all_notes(t)
+    async with write_transaction() as t:
+        updated = await update_note(t, note1.uuid, text="New text")
+        await delete_note(t, note2.uuid)
+    async with read_transaction() as t:
+        assert await select_all_notes(t) == [updated]
+    assert cached_pool.note_cache is not None
+    assert cached_pool.note_cache.invalidations == 0
+
+
+async def test_note_cache__rollback(cached_pool: ConnectionPool) -> None:
+    async with write_transaction() as t:
+        note = await insert_note(t, "Title", "Text")
+    with pytest.raises(RuntimeError):
+        async with write_transaction() as t:
+            await update_note(t, note.uuid, text="New text")
+            raise RuntimeError()
+    async with read_transaction() as t:
+        assert (await select_note(t, note.uuid)).text == "Text"
+
+
+async def test_note_cache__external_writes(
+    cached_pool: ConnectionPool,
+) -> None:
+    async with write_transaction() as t:
+        note = await insert_note(t, "Title", "Text")
+        other_note = await insert_note(t, "Other", "Text")
+    async with read_transaction() as t:
+        await select_all_notes(t)
+    async with open_transaction(cached_pool.db_name) as t:
+        await update_note(t, note.uuid, text="New text")
+    async with read_transaction() as t:
+        assert (await select_note(t, note.uuid)).text == "New text"
+        cached_note = await select_note(t, other_note.uuid)
+        assert cached_note == other_note
+    assert cached_pool.note_cache is not None
+    assert cached_pool.note_cache.invalidated_notes == 1
+    async with open_transaction(cached_pool.db_name) as t:
+        await delete_note(t, other_note.uuid)
+    async with write_transaction() as t:
+        await update_note(t, note.uuid, text="Newer text")
+    async with read_transaction() as t:
+        assert [n.text for n in await select_all_notes(t)] == ["Newer text"]
+
+
+async def test_note_cache__external_writes_keep_all_notes(
+    cached_pool: ConnectionPool,
+) -> None:
+    async with write_transaction() as t:
+        note = await insert_note(t, "Title", "Text")
+        other_note = await insert_note(t, "Other", "Text")
+    async with read_transaction() as t:
+        await select_all_notes(t)
+    async with open_transaction(cached_pool.db_name) as t:
+        updated = await update_note(t, note.uuid, text="New text")
+        await delete_note(t, other_note.uuid)
+        new_note = await insert_note(t, "New", "Text")
+    cache = cached_pool.note_cache
+    assert cache is not None
+    misses = cache.misses
+    async with read_transaction() as t:
+        notes = await select_all_notes(t)
+    assert sorted(notes, key=lambda n: n.title) == [new_note, updated]
+    assert cache.misses == misses
+    async with open_transaction(cached_pool.db_name) as t:
+        await delete_note(t, new_note.uuid)
+    async with write_transaction() as t:
+        updated = await update_note(t, note.uuid, text="Newer text")
+    async with read_transaction() as t:
+        assert await select_all_notes(t) == [updated]
+    assert cache.misses == misses
+
+
+async def test_note_cache__log_pruned(cached_pool: ConnectionPool) -> None:
+    async with write_transaction() as t:
+        note = await insert_note(t, "Title", "Text")
+    async with read_transaction() as t:
+        await select_note(t, note.uuid)
+    async with open_transaction(cached_pool.db_name) as t:
+        await t.execute("DELETE FROM note_changes")
+        await t.execute(
+            "UPDATE meta SET value = value + 1 WHERE key = 'notes_version'"
+        )
+    async with read_transaction() as t:
+        await select_note(t, note.uuid)
+    assert cached_pool.note_cache is not None
+    assert cached_pool.note_cache.hits == 1
+    assert cached_pool.note_cache.misses == 1
+
+
 async def test_select_all_notes(db: DatabaseFixture) -> None:
     creation_date = datetime.datetime(
         2021, 5, 14, 13, 19, 4, tzinfo=datetime.UTC
@@ -51,6 +573,62 @@ async def test_select_all_notes(db: DatabaseFixture) -> None:
     )
 
 
+async def test_select_all_notes_meta(db: DatabaseFixture) -> None:
+    creation_date = datetime.datetime(
+        2021, 5, 14, 13, 19, 4, tzinfo=datetime.UTC
+    )
+    last_changed = datetime.datetime(
+        2021, 9, 19, 4, 34, 12, tzinfo=datetime.UTC
+    )
+    await db.insert_note(
+        uuid=_UUID,
+        title="Test Note",
+        text="Test text",
+        favorite=True,
+        creation_date=creation_date,
+        last_changed=last_changed,
+    )
+    notes = await select_all_notes_meta(db.db)
+    assert notes == [
+        NoteMeta(_UUID, "Test Note", True, creation_date, last_changed)
+    ]
+
+
+async def test_iter_notes_meta(db: DatabaseFixture) -> None:
+    uuid3 = UUID(int=3)
+    await db.insert_note(
+        uuid=_UUID,
+        title="b",
+        creation_date=datetime.datetime(2000, 1, 3),
+        last_changed=datetime.datetime(2000, 1, 4),
+    )
+    await db.insert_note(
+        uuid=_UUID2,
+        title="C",
+        favorite=True,
+        creation_date=datetime.datetime(2000, 1, 2),
+        last_changed=datetime.datetime(2000, 1, 5),
+    )
+    await db.insert_note(
+        uuid=uuid3,
+        title="a",
+        favorite=True,
+        creation_date=datetime.datetime(2000, 1, 1),
+        last_changed=datetime.datetime(2000, 1, 6),
+    )
+
+    async def uuids(**kwargs: Any) -> list[UUID]:
+        return [n.uuid async for n in iter_notes_meta(db.db, **kwargs)]
+
+    assert await uuids() == [uuid3, _UUID2, _UUID]
+    assert await uuids(sort=NoteSort.CREATED) == [_UUID, _UUID2, uuid3]
+    assert await uuids(sort=NoteSort.TITLE) == [uuid3, _UUID, _UUID2]
+    assert await uuids(favorites_only=True) == [uuid3, _UUID2]
+    assert await uuids(sort=NoteSort.TITLE, limit=2) == [uuid3, _UUID]
+    note = await anext(iter_notes_meta(db.db))
+    assert isinstance(note, NoteMeta)
+
+
 async def test_select_note(db: DatabaseFixture) -> None:
     creation_date = datetime.datetime(
         2021, 5, 14, 13, 19, 4, tzinfo=datetime.UTC
@@ -72,12 +650,199 @@ async def test_select_note(db: DatabaseFixture) -> None:
     )
 
 
+async def test_select_note__uuid(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID)
+    note = await select_note(db.db, _UUID)
+    assert str(note.uuid) == str(_UUID)
+    assert hash(note.uuid) == hash(_UUID)
+    assert pickle.loads(pickle.dumps(note.uuid)) == _UUID
+    assert {note.uuid: 1}[_UUID] == 1
+
+
 async def test_select_note__unknown(db: DatabaseFixture) -> None:
     await db.insert_note(uuid=_UUID2)
     with pytest.raises(UnknownItemError):
         await select_note(db.db, _UUID)
 
 
+async def test_select_note_meta(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Test Note", text="Test text")
+    await db.insert_note(uuid=_UUID2)
+    note = await select_note_meta(db.db, _UUID)
+    assert note.uuid == _UUID
+    assert note.title == "Test Note"
+    assert not hasattr(note, "text")
+
+
+async def test_select_note_meta__unknown(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID2)
+    with pytest.raises(UnknownItemError):
+        await select_note_meta(db.db, _UUID)
+
+
+async def test_select_notes_page(db: DatabaseFixture) -> None:
+    for i in range(5):
+        await db.insert_note(
+            uuid=UUID(int=i),
+            last_changed=datetime.datetime(
+                2021, 1, 5 - i, tzinfo=datetime.UTC
+            ),
+        )
+    page = await select_notes_page(db.db, first=2)
+    assert [n.uuid for n in page.notes] == [UUID(int=4), UUID(int=3)]
+    assert page.has_next_page
+    last = page.notes[-1]
+    page = await select_notes_page(
+        db.db, first=2, after=(last.last_changed, last.uuid), with_text=False
+    )
+    assert [n.uuid for n in page.notes] == [UUID(int=2), UUID(int=1)]
+    assert all(isinstance(n, NoteMeta) for n in page.notes)
+    assert page.has_next_page
+    last = page.notes[-1]
+    page = await select_notes_page(
+        db.db, first=2, after=(last.last_changed, last.uuid)
+    )
+    assert [n.uuid for n in page.notes] == [UUID(int=0)]
+    assert not page.has_next_page
+
+
+async def test_select_notes_page__same_date(db: DatabaseFixture) -> None:
+    for i in range(3):
+        await db.insert_note(uuid=UUID(int=i))
+    page = await select_notes_page(db.db, first=2)
+    assert [n.uuid for n in page.notes] == [UUID(int=0), UUID(int=1)]
+    last = page.notes[-1]
+    page = await select_notes_page(
+        db.db, first=2, after=(last.last_changed, last.uuid)
+    )
+    assert [n.uuid for n in page.notes] == [UUID(int=2)]
+
+
+async def test_select_notes_changed_since(db: DatabaseFixture) -> None:
+    since = datetime.datetime(2021, 5, 1, 12, 0, 0, tzinfo=datetime.UTC)
+    await db.insert_note(
+        uuid=_UUID, last_changed=since - datetime.timedelta(seconds=1)
+    )
+    await db.insert_note(uuid=_UUID2, last_changed=since)
+    await db.insert_note(
+        uuid=UUID(int=1), last_changed=since + datetime.timedelta(days=1)
+    )
+    notes = await select_notes_changed_since(db.db, since)
+    assert [n.uuid for n in notes] == [_UUID2, UUID(int=1)]
+    notes = await select_notes_changed_since(db.db, since, with_text=False)
+    assert all(isinstance(n, NoteMeta) for n in notes)
+
+
+async def test_select_notes_changed_since__replaced(
+    db: DatabaseFixture,
+) -> None:
+    dt = datetime.datetime(2021, 5, 1, 12, 0, 0, tzinfo=datetime.UTC)
+    await db.insert_note(uuid=_UUID, last_changed=dt)
+    since = datetime.datetime.now(datetime.UTC) - datetime.timedelta(seconds=1)
+    note = Note(_UUID, "Title", "Text", False, dt, dt)
+    async with db.begin() as t:
+        assert await insert_notes(t, [note], replace=True) == 1
+    notes = await select_notes_changed_since(db.db, since)
+    assert [n.uuid for n in notes] == [_UUID]
+    assert notes[0].creation_date == dt
+
+
+async def test_select_deleted_notes_since(db: DatabaseFixture) -> None:
+    await db.insert(
+        "deleted_notes",
+        {
+            "uuid": _UUID,
+            "deletion_date": datetime.datetime(2021, 4, 30, 23, 59, 59),
+        },
+    )
+    await db.insert(
+        "deleted_notes",
+        {"uuid": _UUID2, "deletion_date": datetime.datetime(2021, 5, 1)},
+    )
+    since = datetime.datetime(2021, 5, 1, tzinfo=datetime.UTC)
+    deleted = await select_deleted_notes_since(db.db, since)
+    assert deleted == [DeletedNote(_UUID2, since)]
+
+
+async def test_select_notes_version(db: DatabaseFixture) -> None:
+    versions = [await select_notes_version(db.db)]
+    await db.insert_note(uuid=_UUID)
+    versions.append(await select_notes_version(db.db))
+    async with db.begin() as t:
+        await update_note(t, _UUID, title="New Title")
+    versions.append(await select_notes_version(db.db))
+    async with db.begin() as t:
+        await delete_note(t, _UUID)
+    versions.append(await select_notes_version(db.db))
+    assert len(set(versions)) == 4
+
+
+async def test_note_changes_log(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID)
+    await db.insert_note(uuid=_UUID2)
+    async with db.begin() as t:
+        for i in range(1000):
+            await update_note(t, _UUID, title=f"Title {i}")
+    rows = await db.select_all_rows("note_changes")
+    assert len(rows) == 1000
+    assert {row["uuid"] for row in rows} == {str(_UUID)}
+    assert max(row["version"] for row in rows) == await select_notes_version(
+        db.db
+    )
+
+
+def test_fts_query() -> None:
+    assert fts_query("") == ""
+    assert fts_query("  foo  bar ") == '"foo" "bar"'
+    assert fts_query('a"b OR NOT*') == '"a""b" "OR" "NOT*"'
+
+
+async def test_search_notes(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Other", text="Lorem ipsum dolor")
+    await db.insert_note(uuid=_UUID2, title="Ipsum", text="Foo bar")
+    await db.insert_note(uuid=UUID(int=1), title="Nothing", text="Here")
+    results = await search_notes(db.db, "ipsum", first=10)
+    assert [r.note.uuid for r in results] == [_UUID2, _UUID]
+    assert results[0].score > results[1].score
+    assert results[0].snippet == "**Ipsum**"
+    assert results[1].snippet == "Lorem **ipsum** dolor"
+    assert isinstance(results[1].note, Note)
+    assert results[1].note.text == "Lorem ipsum dolor"
+
+
+async def test_search_notes__all_words(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, text="foo bar")
+    await db.insert_note(uuid=_UUID2, text="foo baz")
+    results = await search_notes(db.db, "bar foo", first=10)
+    assert [r.note.uuid for r in results] == [_UUID]
+
+
+async def test_search_notes__page(db: DatabaseFixture) -> None:
+    for i in range(5):
+        await db.insert_note(uuid=UUID(int=i), text="foo " * (i + 1))
+    results = await search_notes(
+        db.db, "foo", first=2, offset=1, with_text=False
+    )
+    assert len(results) == 2
+    assert all(isinstance(r.note, NoteMeta) for r in results)
+
+
+async def test_search_notes__empty_query(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, text="foo")
+    assert await search_notes(db.db, "  ", first=10) == []
+
+
+async def test_search_notes__follows_changes(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, text="foo")
+    await db.insert_note(uuid=_UUID2, text="foo")
+    async with db.begin() as t:
+        await update_note(t, _UUID, text="bar")
+        await delete_note(t, _UUID2)
+    assert await search_notes(db.db, "foo", first=10) == []
+    results = await search_notes(db.db, "bar", first=10)
+    assert [r.note.uuid for r in results] == [_UUID]
+
+
 async def test_insert_note(db: DatabaseFixture) -> None:
     async with db.begin() as t:
         note = await insert_note(t, "New Note", "New text")
@@ -91,12 +856,120 @@ async def test_insert_note(db: DatabaseFixture) -> None:
             "uuid": note.uuid,
             "title": "New Note",
             "text": "New text",
-            "creation_date": db_datetime(note.creation_date),
-            "last_changed": db_datetime_old(note.last_changed),
+            "creation_date": note.creation_date,
+            "last_changed": note.last_changed,
         },
     )
 
 
+def test_db_datetime() -> None:
+    dt = datetime.datetime(2021, 5, 14, 13, 19, 4, 123456, tzinfo=datetime.UTC)
+    assert db_datetime(dt) == 1_620_998_344_123
+    assert datetime_from_db(db_datetime(dt)) == dt.replace(microsecond=123000)
+    assert datetime_from_db(0) == datetime.datetime(
+        1970, 1, 1, tzinfo=datetime.UTC
+    )
+
+
+def test_db_compress_min_size(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert db_compress_min_size() == 4096
+    monkeypatch.setenv("HEJ_DB_COMPRESS_MIN_SIZE", "0")
+    assert db_compress_min_size() == 0
+    monkeypatch.setenv("HEJ_DB_COMPRESS_MIN_SIZE", "large")
+    with pytest.raises(RuntimeError):
+        db_compress_min_size()
+
+
+async def test_insert_note__compressed(db: DatabaseFixture) -> None:
+    text = "Lorem ipsum dolor sit amet. " * 1000
+    async with db.begin() as t:
+        note = await insert_note(t, "Large", text)
+        await insert_note(t, "Small", "Lorem ipsum")
+    small, large = sorted(
+        await db.select_all_rows("notes"), key=lambda r: r["compressed"]
+    )
+    assert not small["compressed"]
+    assert small["text"] == "Lorem ipsum"
+    assert large["compressed"]
+    assert isinstance(large["text"], bytes)
+    assert len(large["text"]) < len(text) // 10
+    assert (await select_note(db.db, note.uuid)).text == text
+
+
+async def test_insert_note__compression_disabled(
+    db: DatabaseFixture, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("HEJ_DB_COMPRESS_MIN_SIZE", "0")
+    text = "Lorem ipsum dolor sit amet. " * 1000
+    async with db.begin() as t:
+        await insert_note(t, "Large", text)
+    await db.assert_only_row_equals("notes", {"text": text, "compressed": 0})
+
+
+async def test_update_note__compression(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, text="Short")
+    text = "Lorem ipsum dolor sit amet. " * 1000
+    async with db.begin() as t:
+        note = await update_note(t, _UUID, text=text)
+    assert note.text == text
+    row = await db.select_only_row("notes")
+    assert row["compressed"]
+    async with db.begin() as t:
+        note = await update_note(t, _UUID, title="Title", favorite=True)
+    assert note.text == text
+    async with db.begin() as t:
+        note = await patch_note(
+            t, _UUID, note.revision, [TextEdit(0, len(text), "Short")]
+        )
+    assert note.text == "Short"
+    await db.assert_only_row_equals(
+        "notes", {"text": "Short", "compressed": 0}
+    )
+
+
+async def test_search_notes__compressed(db: DatabaseFixture) -> None:
+    text = "Lorem ipsum dolor sit amet. " * 1000 + "Needle"
+    async with db.begin() as t:
+        note = await insert_note(t, "Large", text)
+    results = await search_notes(db.db, "needle", first=10)
+    assert [r.note.uuid for r in results] == [note.uuid]
+    assert results[0].snippet.endswith("**Needle**")
+    async with db.begin() as t:
+        await update_note(t, note.uuid, text="Haystack " * 1000)
+    assert await search_notes(db.db, "needle", first=10) == []
+    assert len(await search_notes(db.db, "haystack", first=10)) == 1
+    async with db.begin() as t:
+        await update_note(t, note.uuid, "Stack")
+        await patch_note(t, note.uuid, 3, [TextEdit(0, 8, "Needle")])
+    results = await search_notes(db.db, "stack needle", first=10)
+    assert [r.note.title for r in results] == ["Stack"]
+    assert len(await search_notes(db.db, "haystack", first=10)) == 1
+    async with db.begin() as t:
+        await delete_note(t, note.uuid)
+    assert await search_notes(db.db, "haystack", first=10) == []
+
+
+async def test_search_notes__compressed_import(
+    db: DatabaseFixture,
+) -> None:
+    def note(uuid: UUID, text: str) -> Note:
+        dt = datetime.datetime(2021, 5, 14, tzinfo=datetime.UTC)
+        return Note(
+            uuid, "Title", "Lorem ipsum. " * 1000 + text, False, dt, dt
+        )
+
+    async with db.begin() as t:
+        await insert_notes(t, [note(_UUID, "Needle"), note(_UUID2, "Hay")])
+        await insert_notes(t, [note(_UUID, "Pin"), note(_UUID2, "Hay")])
+    assert len(await search_notes(db.db, "needle", first=10)) == 1
+    assert await search_notes(db.db, "pin", first=10) == []
+    assert len(await search_notes(db.db, "hay", first=10)) == 1
+    async with db.begin() as t:
+        await insert_notes(t, [note(_UUID, "Pin")], replace=True)
+    assert await search_notes(db.db, "needle", first=10) == []
+    assert len(await search_notes(db.db, "pin", first=10)) == 1
+
+
 async def test_update_note(db: DatabaseFixture) -> None:
     await db.insert_note(
         uuid=_UUID,
@@ -116,11 +989,256 @@ async def test_update_note(db: DatabaseFixture) -> None:
             "uuid": _UUID,
             "title": "New Note",
             "text": "New text",
-            "last_changed": db_datetime_old(note.last_changed),
+            "last_changed": note.last_changed,
         },
     )
 
 
+async def test_update_note__partial(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Old Title", text="Old text")
+    async with db.begin() as t:
+        note = await update_note(t, _UUID, favorite=True)
+    assert note.title == "Old Title"
+    assert note.text == "Old text"
+    assert note.favorite
+    async with db.begin() as t:
+        note = await update_note(t, _UUID, text="New text")
+    assert note.title == "Old Title"
+    assert note.text == "New text"
+    assert note.favorite
+
+
+async def test_update_note__single_statement(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Old Title", text="Old text")
+    statements: list[str] = []
+    await db.db.db.set_trace_callback(statements.append)
+    async with db.begin() as t:
+        await update_note(t, _UUID, text="New text")
+    # Statements run by triggers are reported as the triggering statement
+    # or as comments.
+    executed = {s for s in statements if not s.startswith(("BEGIN", "--"))}
+    assert len(executed) == 2
+    assert all(s.startswith(("UPDATE notes", "COMMIT")) for s in executed)
+
+
+async def test_update_note__increments_revision(
+    db: DatabaseFixture,
+) -> None:
+    await db.insert_note(uuid=_UUID)
+    async with db.begin() as t:
+        note = await update_note(t, _UUID, favorite=True)
+    assert note.revision == 2
+    await db.assert_only_row_equals("notes", {"revision": 2})
+
+
+async def test_update_note__expected_revision(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Old Title")
+    async with db.begin() as t:
+        note = await update_note(t, _UUID, "New Title", expected_revision=1)
+    assert note.revision == 2
+    with pytest.raises(RevisionConflictError) as exc_info:
+        async with db.begin() as t:
+            await update_note(t, _UUID, "Newer Title", expected_revision=1)
+    assert exc_info.value.revision == 2
+    with pytest.raises(RevisionConflictError):
+        async with db.begin() as t:
+            await update_note(t, _UUID, expected_revision=1)
+    await db.assert_only_row_equals(
+        "notes", {"title": "New Title", "revision": 2}
+    )
+
+
+async def test_update_note__expected_revision_unknown(
+    db: DatabaseFixture,
+) -> None:
+    with pytest.raises(UnknownItemError):
+        async with db.begin() as t:
+            await update_note(t, _UUID, "New Title", expected_revision=1)
+
+
+async def test_patch_note(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Title", text="Hello world!")
+    async with db.begin() as t:
+        note = await patch_note(t, _UUID, 1, [TextEdit(6, 5, "there")])
+    assert note.title == "Title"
+    assert note.text == "Hello there!"
+    assert note.revision == 2
+    assert note.last_changed.year > 2000
+    await db.assert_only_row_equals(
+        "notes", {"text": "Hello there!", "revision": 2}
+    )
+
+
+async def test_patch_note__conflict(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, text="Hello world!")
+    async with db.begin() as t:
+        await update_note(t, _UUID, text="Hello you!")
+    with pytest.raises(RevisionConflictError) as exc_info:
+        async with db.begin() as t:
+            await patch_note(t, _UUID, 1, [TextEdit(6, 5, "there")])
+    assert exc_info.value.revision == 2
+    await db.assert_only_row_equals("notes", {"text": "Hello you!"})
+
+
+async def test_patch_note__unknown(db: DatabaseFixture) -> None:
+    with pytest.raises(UnknownItemError):
+        async with db.begin() as t:
+            await patch_note(t, _UUID, 1, [])
+
+
+async def test_note_history(db: DatabaseFixture) -> None:
+    async with db.begin() as t:
+        note = await insert_note(t, "Title", "Hello world!")
+        await update_note(t, note.uuid, text="Hello there!")
+        await update_note(t, note.uuid, "New Title")
+        await patch_note(t, note.uuid, 3, [TextEdit(0, 5, "Hi")])
+        history = await select_note_history(t, note.uuid)
+        assert [(r.revision, r.title) for r in history] == [
+            (4, "New Title"),
+            (3, "New Title"),
+            (2, "Title"),
+            (1, "Title"),
+        ]
+        texts = [
+            (await select_note_at_revision(t, note.uuid, r)).text
+            for r in range(1, 5)
+        ]
+        assert texts == [
+            "Hello world!",
+            "Hello there!",
+            "Hello there!",
+            "Hi there!",
+        ]
+        assert await encode_note_history(t) == 3
+    rows = await db.select_all_rows("note_revisions")
+    assert [row["snapshot"] for row in rows] == [1, 0, 0, 0]
+    async with db.begin() as t:
+        old_note = await select_note_at_revision(t, note.uuid, 2)
+    assert old_note.text == "Hello there!"
+
+
+async def test_note_history__snapshots(db: DatabaseFixture) -> None:
+    async with db.begin() as t:
+        note = await insert_note(t, "Title", "")
+        for i in range(SNAPSHOT_INTERVAL * 2):
+            await update_note(t, note.uuid, text=f"Text {i}")
+        await encode_note_history(t)
+        snapshots = [
+            row["revision"]
+            async for row in t.execute_fetchall(
+                "SELECT revision FROM note_revisions WHERE snapshot = 1"
+            )
+        ]
+        assert snapshots == [
+            1,
+            SNAPSHOT_INTERVAL + 1,
+            2 * SNAPSHOT_INTERVAL + 1,
+        ]
+        old_note = await select_note_at_revision(t, note.uuid, 20)
+        assert old_note.text == "Text 18"
+        assert old_note.revision == 20
+
+
+async def test_note_history__existing_note(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Title", text="Old text")
+    async with db.begin() as t:
+        await update_note(t, _UUID, text="New text")
+        assert len(await select_note_history(t, _UUID)) == 2
+        old_note = await select_note_at_revision(t, _UUID, 1)
+    assert old_note.text == "Old text"
+
+
+async def test_encode_note_history__limit(db: DatabaseFixture) -> None:
+    async with db.begin() as t:
+        first = await insert_note(t, "Title", "Text")
+        await update_note(t, first.uuid, text="New text")
+        await insert_note(t, "Title", "Text")
+        encoded = await encode_note_history(t, limit=1)
+        assert encoded < 3
+        assert await encode_note_history(t) == 3 - encoded
+        assert await encode_note_history(t) == 0
+        old_note = await select_note_at_revision(t, first.uuid, 1)
+    assert old_note.text == "Text"
+
+
+async def test_encode_note_history__continues_history(
+    db: DatabaseFixture,
+) -> None:
+    async with db.begin() as t:
+        note = await insert_note(t, "Title", "Text 0")
+        for i in range(1, SNAPSHOT_INTERVAL):
+            await update_note(t, note.uuid, text=f"Text {i}")
+        await encode_note_history(t)
+        for i in range(SNAPSHOT_INTERVAL, SNAPSHOT_INTERVAL + 2):
+            await update_note(t, note.uuid, text=f"Text {i}")
+        assert await encode_note_history(t) == 2
+        snapshots = [
+            row["revision"]
+            async for row in t.execute_fetchall(
+                "SELECT revision FROM note_revisions WHERE snapshot = 1"
+            )
+        ]
+        assert snapshots == [1, SNAPSHOT_INTERVAL + 1]
+        for revision in range(1, SNAPSHOT_INTERVAL + 3):
+            old_note = await select_note_at_revision(t, note.uuid, revision)
+            assert old_note.text == f"Text {revision - 1}"
+
+
+async def test_note_history__unknown_revision(db: DatabaseFixture) -> None:
+    await db.insert_note(uuid=_UUID, title="Title", text="Text")
+    with pytest.raises(UnknownItemError):
+        async with db.begin() as t:
+            await select_note_at_revision(t, _UUID, 0)
+
+
+async def test_note_history__deleted_with_note(db: DatabaseFixture) -> None:
+    async with db.begin() as t:
+        note = await insert_note(t, "Title", "Text")
+        await delete_note(t, note.uuid)
+    assert await db.select_all_rows("note_revisions") == []
+
+
+async def test_compact_note_history(db: DatabaseFixture) -> None:
+    async with db.begin() as t:
+        note = await insert_note(t, "Title", "")
+        for i in range(10):
+            await update_note(t, note.uuid, text=f"Text {i}")
+        # Revisions 1-4 on day 1, 5-8 on day 2, the rest recently.
+        for revision, day in [(1, 1), (2, 1), (3, 1), (4, 1)] + [
+            (r, 2) for r in range(5, 9)
+        ]:
+            await t.execute(
+                "UPDATE note_revisions SET last_changed = ? "
+                "WHERE revision = ?",
+                [
+                    db_datetime(
+                        datetime.datetime(
+                            2020, 1, day, 12, 0, revision, tzinfo=datetime.UTC
+                        )
+                    ),
+                    revision,
+                ],
+            )
+        history_version = await select_history_version(t)
+        removed = await compact_note_history(
+            t, datetime.datetime(2021, 1, 1, tzinfo=datetime.UTC)
+        )
+        assert removed == 6
+        assert await select_history_version(t) == history_version + 1
+        history = await select_note_history(t, note.uuid)
+        assert [r.revision for r in history] == [11, 10, 9, 8, 4]
+        for revision in [4, 8, 9, 10, 11]:
+            old_note = await select_note_at_revision(t, note.uuid, revision)
+            assert old_note.text == f"Text {revision - 2}"
+        assert (
+            await compact_note_history(
+                t, datetime.datetime(2021, 1, 1, tzinfo=datetime.UTC)
+            )
+            == 0
+        )
+        assert await select_history_version(t) == history_version + 1
+
+
 async def test_update_note__unknown(db: DatabaseFixture) -> None:
     with pytest.raises(UnknownItemError):
         async with db.begin() as t:
@@ -133,6 +1251,7 @@ async def test_delete_note(db: DatabaseFixture) -> None:
     async with db.begin() as t:
         await delete_note(t, _UUID)
     await db.assert_only_row_equals("notes", {"uuid": _UUID2})
+    await db.assert_only_row_equals("deleted_notes", {"uuid": _UUID})
 
 
 async def test_delete_note__unknown(db: DatabaseFixture) -> None:
@@ -0,0 +1,40 @@
+import pytest
+
+from .history import (
+    apply_delta,
+    decode_snapshot,
+    encode_delta,
+    encode_snapshot,
+)
+
+
+def test_snapshot() -> None:
+    text = "Hello world! " * 100
+    data = encode_snapshot(text)
+    assert len(data) < len(text)
+    assert decode_snapshot(data) == text
+
+
+@pytest.mark.parametrize(
+    "old,new",
+    [
+        ("", ""),
+        ("", "foo"),
+        ("foo", ""),
+        ("foo", "foo"),
+        ("Hello world!", "Hello there!"),
+        ("aaa", "aaaa"),
+        ("abcabc", "abc"),
+        ("prefix", "prefix and more"),
+        ("suffix", "a suffix"),
+        ("ä🙂ö", "ä🙂🙂ö"),
+    ],
+)
+def test_delta(old: str, new: str) -> None:
+    assert apply_delta(old, encode_delta(old, new)) == new
+
+
+def test_delta__small_for_local_changes() -> None:
+    old = "Lorem ipsum dolor sit amet. " * 10_000
+    new = old[:1000] + "CHANGED" + old[1010:]
+    assert len(encode_delta(old, new)) < 100
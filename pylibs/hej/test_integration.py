@@ -1,14 +1,25 @@
+import asyncio
+import datetime
+import hashlib
+import json
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 from typing import Any
+from urllib.parse import urlencode
 from uuid import UUID
 
 import pytest
+from ariadne.asgi import GraphQL
 from asserts import assert_json_subset
 from graphql import GraphQLSchema
 from pytest_mock import MockerFixture, mocker
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Message
 
 from .db import Database
+from .gql import HTTPHandler
+from .querycache import QueryCache
 from .testutil_db import DatabaseFixture, db_o
 from .testutil_gql import GQLFixture, gql_schema
 
@@ -86,6 +97,45 @@ class TestNotes:
             notes,
         )
 
+    async def test_all_notes__text(self, fix: IntegrationFixture) -> None:
+        await fix.insert_note(uuid=UUID1, title="Note #1", text="Text #1")
+        response = await fix.gql(
+            """
+                query {
+                    notes {
+                        ...NoteFragment
+                    }
+                }
+                fragment NoteFragment on Note {
+                    uuid
+                    text
+                }
+            """
+        )
+        assert response == {"notes": [{"uuid": str(UUID1), "text": "Text #1"}]}
+
+    async def test_all_notes__meta_skips_text(
+        self, fix: IntegrationFixture, mocker: MockerFixture
+    ) -> None:
+        select_all_notes = mocker.patch("hej.gql.select_all_notes")
+        await fix.insert_note(uuid=UUID1, title="Note #1", text="Text #1")
+        response = await fix.gql(
+            """
+                query {
+                    notes {
+                        ... on Note {
+                            uuid
+                            title
+                        }
+                    }
+                }
+            """
+        )
+        assert response == {
+            "notes": [{"uuid": str(UUID1), "title": "Note #1"}]
+        }
+        select_all_notes.assert_not_called()
+
     async def test_single_note(self, fix: IntegrationFixture) -> None:
         await fix.insert_note(
             uuid=UUID("4b6b1145-933d-47bd-ba7e-279751bb8f7b"), title="Note #1"
@@ -138,6 +188,399 @@ class TestNotes:
         assert_json_subset({"notes": []}, response)
 
 
+class TestNotesConnection:
+    async def test_pages(self, fix: IntegrationFixture) -> None:
+        for i in range(3):
+            await fix.insert_note(uuid=UUID(int=i), title=f"Note #{i}")
+        query = """
+            query ($after: String) {
+                notesConnection(first: 2, after: $after) {
+                    edges {
+                        cursor
+                        node {
+                            uuid
+                            title
+                        }
+                    }
+                    pageInfo {
+                        hasNextPage
+                        endCursor
+                    }
+                }
+            }
+        """
+        response = await fix.gql(query)
+        page = response["notesConnection"]
+        assert [e["node"]["title"] for e in page["edges"]] == [
+            "Note #0",
+            "Note #1",
+        ]
+        assert page["pageInfo"]["hasNextPage"] is True
+        assert page["pageInfo"]["endCursor"] == page["edges"][-1]["cursor"]
+        response = await fix.gql(
+            query, {"after": page["pageInfo"]["endCursor"]}
+        )
+        page = response["notesConnection"]
+        assert [e["node"]["title"] for e in page["edges"]] == ["Note #2"]
+        assert page["pageInfo"]["hasNextPage"] is False
+
+    async def test_empty(self, fix: IntegrationFixture) -> None:
+        response = await fix.gql(
+            """
+                query {
+                    notesConnection {
+                        edges {
+                            cursor
+                        }
+                        pageInfo {
+                            hasNextPage
+                            endCursor
+                        }
+                    }
+                }
+            """
+        )
+        assert response == {
+            "notesConnection": {
+                "edges": [],
+                "pageInfo": {"hasNextPage": False, "endCursor": None},
+            }
+        }
+
+
+class TestNotesChangedSince:
+    async def test_changes(self, fix: IntegrationFixture) -> None:
+        await fix.insert_note(
+            uuid=UUID1,
+            title="Old",
+            last_changed=datetime.datetime(2021, 1, 1, tzinfo=datetime.UTC),
+        )
+        await fix.insert_note(
+            uuid=UUID2,
+            title="New",
+            last_changed=datetime.datetime(2021, 6, 1, tzinfo=datetime.UTC),
+        )
+        await fix.insert(
+            "deleted_notes",
+            {
+                "uuid": UUID(int=1),
+                "deletion_date": datetime.datetime(2021, 6, 2, 10, 0, 0),
+            },
+        )
+        response = await fix.gql(
+            """
+                query {
+                    notesChangedSince(since: "2021-05-01T00:00:00Z") {
+                        notes {
+                            uuid
+                            title
+                        }
+                        deletedNotes {
+                            uuid
+                            deletionDate
+                        }
+                        until
+                    }
+                }
+            """
+        )
+        changes = response["notesChangedSince"]
+        assert changes["notes"] == [{"uuid": str(UUID2), "title": "New"}]
+        assert changes["deletedNotes"] == [
+            {"uuid": str(UUID(int=1)), "deletionDate": "2021-06-02T10:00:00Z"}
+        ]
+        assert changes["until"] > "2021-06-02T10:00:00Z"
+
+
+class TestSearchNotes:
+    async def test_search(self, fix: IntegrationFixture) -> None:
+        await fix.insert_note(uuid=UUID1, title="Foo", text="Lorem ipsum")
+        await fix.insert_note(uuid=UUID2, title="Bar", text="Dolor sit")
+        response = await fix.gql(
+            """
+                query {
+                    searchNotes(query: "ipsum") {
+                        edges {
+                            node {
+                                note {
+                                    uuid
+                                    title
+                                }
+                                snippet
+                            }
+                        }
+                        pageInfo {
+                            hasNextPage
+                        }
+                    }
+                }
+            """
+        )
+        assert response == {
+            "searchNotes": {
+                "edges": [
+                    {
+                        "node": {
+                            "note": {"uuid": str(UUID1), "title": "Foo"},
+                            "snippet": "Lorem **ipsum**",
+                        }
+                    }
+                ],
+                "pageInfo": {"hasNextPage": False},
+            }
+        }
+
+    async def test_pages(self, fix: IntegrationFixture) -> None:
+        for i in range(3):
+            await fix.insert_note(uuid=UUID(int=i), text="foo " * (i + 1))
+        query = """
+            query ($after: String) {
+                searchNotes(query: "foo", first: 2, after: $after) {
+                    edges {
+                        node {
+                            note {
+                                uuid
+                            }
+                        }
+                    }
+                    pageInfo {
+                        hasNextPage
+                        endCursor
+                    }
+                }
+            }
+        """
+        response = await fix.gql(query)
+        page = response["searchNotes"]
+        assert len(page["edges"]) == 2
+        assert page["pageInfo"]["hasNextPage"] is True
+        response = await fix.gql(
+            query, {"after": page["pageInfo"]["endCursor"]}
+        )
+        page2 = response["searchNotes"]
+        assert len(page2["edges"]) == 1
+        assert page2["pageInfo"]["hasNextPage"] is False
+        uuids = {e["node"]["note"]["uuid"] for e in page["edges"]}
+        uuids.add(page2["edges"][0]["node"]["note"]["uuid"])
+        assert len(uuids) == 3
+
+
+class TestNoteChanged:
+    async def test_events(self, fix: IntegrationFixture) -> None:
+        events = await fix.subscribe(
+            """
+                subscription {
+                    noteChanged {
+                        type
+                        uuid
+                        note {
+                            title
+                            favorite
+                        }
+                    }
+                }
+            """
+        )
+        # The subscription starts when the first event is requested.
+        first_event = asyncio.create_task(anext(events))
+        await asyncio.sleep(0.01)
+        await fix.insert_note(uuid=UUID1)
+        await fix.gql(
+            f"""
+                mutation {{
+                    markNoteAsFavorite(uuid: "{UUID1}", favorite: true) {{
+                        uuid
+                    }}
+                    deleteNote(uuid: "{UUID1}")
+                }}
+            """
+        )
+        assert await first_event == {
+            "noteChanged": {
+                "type": "UPDATED",
+                "uuid": str(UUID1),
+                "note": {"title": "", "favorite": True},
+            }
+        }
+        assert await anext(events) == {
+            "noteChanged": {
+                "type": "DELETED",
+                "uuid": str(UUID1),
+                "note": None,
+            }
+        }
+        await events.aclose()
+
+
+@pytest.fixture
+def app(fix: IntegrationFixture, monkeypatch: pytest.MonkeyPatch) -> GraphQL:
+    monkeypatch.setenv("HEJ_SESSION_KEY", "sikrit")
+    query_cache = QueryCache()
+    return GraphQL(
+        fix.schema,
+        execute_get_queries=True,
+        query_parser=query_cache.parse_query,
+        query_validator=query_cache.validate,
+        http_handler=HTTPHandler(query_cache),
+    )
+
+
+async def http_get(
+    app: GraphQL, params: dict[str, str], if_none_match: str | None = None
+) -> Response:
+    headers = [(b"cookie", b"HejSessionKey=sikrit")]
+    if if_none_match is not None:
+        headers.append((b"if-none-match", if_none_match.encode()))
+    request = Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/graphql/",
+            "query_string": urlencode(params).encode(),
+            "headers": headers,
+        }
+    )
+    return await app.handle_request(request)
+
+
+async def http_post(app: GraphQL, body: dict[str, Any]) -> Response:
+    async def receive() -> Message:
+        return {
+            "type": "http.request",
+            "body": json.dumps(body).encode(),
+            "more_body": False,
+        }
+
+    request = Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "path": "/graphql/",
+            "query_string": b"",
+            "headers": [
+                (b"cookie", b"HejSessionKey=sikrit"),
+                (b"content-type", b"application/json"),
+            ],
+        },
+        receive,
+    )
+    return await app.handle_request(request)
+
+
+class TestConditionalGet:
+    async def test_etag(self, fix: IntegrationFixture, app: GraphQL) -> None:
+        await fix.insert_note(uuid=UUID1, title="Note #1")
+        query = {"query": "{ notes { title } }"}
+        response = await http_get(app, query)
+        assert response.status_code == 200
+        assert b"Note #1" in response.body
+        etag = response.headers["etag"]
+
+        response = await http_get(app, query, if_none_match=etag)
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.body == b""
+
+        response = await http_get(
+            app, {"query": "{ notes { uuid } }"}, if_none_match=etag
+        )
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+    async def test_etag_changes_with_notes(
+        self, fix: IntegrationFixture, app: GraphQL
+    ) -> None:
+        await fix.insert_note(uuid=UUID1, title="Note #1")
+        query = {"query": "{ notes { title } }"}
+        response = await http_get(app, query)
+        await fix.insert_note(uuid=UUID2, title="Note #2")
+        response = await http_get(
+            app, query, if_none_match=response.headers["etag"]
+        )
+        assert response.status_code == 200
+        assert b"Note #2" in response.body
+
+    async def test_etag_changes_with_history(
+        self, fix: IntegrationFixture, app: GraphQL
+    ) -> None:
+        await fix.insert_note(uuid=UUID1, title="Note #1")
+        query = {"query": f'{{ noteHistory(uuid: "{UUID1}") {{ revision }} }}'}
+        response = await http_get(app, query)
+        async with fix.begin() as t:
+            await t.execute(
+                "UPDATE meta SET value = value + 1 "
+                "WHERE key = 'history_version'"
+            )
+        response = await http_get(
+            app, query, if_none_match=response.headers["etag"]
+        )
+        assert response.status_code == 200
+
+
+class TestPersistedQueries:
+    QUERY = "{ notes { title } }"
+
+    def extensions(self, query: str) -> dict[str, Any]:
+        return {
+            "persistedQuery": {
+                "version": 1,
+                "sha256Hash": hashlib.sha256(query.encode()).hexdigest(),
+            }
+        }
+
+    async def test_unknown_hash(
+        self, fix: IntegrationFixture, app: GraphQL
+    ) -> None:
+        response = await http_post(
+            app, {"extensions": self.extensions(self.QUERY)}
+        )
+        assert json.loads(bytes(response.body)) == {
+            "errors": [
+                {
+                    "message": "PersistedQueryNotFound",
+                    "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"},
+                }
+            ]
+        }
+
+    async def test_register_and_use(
+        self, fix: IntegrationFixture, app: GraphQL
+    ) -> None:
+        await fix.insert_note(uuid=UUID1, title="Note #1")
+        extensions = self.extensions(self.QUERY)
+        response = await http_post(
+            app, {"query": self.QUERY, "extensions": extensions}
+        )
+        assert json.loads(bytes(response.body)) == {
+            "data": {"notes": [{"title": "Note #1"}]}
+        }
+        response = await http_post(app, {"extensions": extensions})
+        assert json.loads(bytes(response.body)) == {
+            "data": {"notes": [{"title": "Note #1"}]}
+        }
+        response = await http_get(app, {"extensions": json.dumps(extensions)})
+        assert response.status_code == 200
+        assert json.loads(bytes(response.body)) == {
+            "data": {"notes": [{"title": "Note #1"}]}
+        }
+        assert "etag" in response.headers
+
+    async def test_hash_mismatch(
+        self, fix: IntegrationFixture, app: GraphQL
+    ) -> None:
+        response = await http_post(
+            app,
+            {
+                "query": "{ notes { uuid } }",
+                "extensions": self.extensions(self.QUERY),
+            },
+        )
+        body = json.loads(bytes(response.body))
+        assert body["errors"][0]["extensions"] == {
+            "code": "PERSISTED_QUERY_HASH_MISMATCH"
+        }
+
+
 class TestMarkNoteAsFavorite:
     async def test_mark(self, fix: IntegrationFixture) -> None:
         await fix.insert_note(uuid=UUID1, favorite=False)
@@ -183,3 +626,159 @@ class TestMarkNoteAsFavorite:
             """
         )
         assert response == {"response": None}
+
+    async def test_expected_revision(self, fix: IntegrationFixture) -> None:
+        await fix.insert_note(uuid=UUID1, favorite=False)
+        query = f"""
+            mutation {{
+                markNoteAsFavorite(
+                    uuid: "{UUID1}",
+                    favorite: true,
+                    expectedRevision: 2
+                ) {{
+                    favorite
+                }}
+            }}
+        """
+        errors = await fix.gql_errors(query)
+        assert errors[0]["extensions"] == {"code": "CONFLICT", "revision": 1}
+        await fix.assert_only_row_equals("notes", {"favorite": False})
+
+
+class TestUpdateNote:
+    QUERY = """
+        mutation($uuid: ID!, $title: String, $expectedRevision: Int) {
+            updateNote(
+                uuid: $uuid,
+                title: $title,
+                expectedRevision: $expectedRevision
+            ) {
+                title
+                revision
+            }
+        }
+    """
+
+    async def test_expected_revision(self, fix: IntegrationFixture) -> None:
+        await fix.insert_note(uuid=UUID1, title="Old Title")
+        variables = {
+            "uuid": str(UUID1),
+            "title": "New Title",
+            "expectedRevision": 1,
+        }
+        response = await fix.gql(self.QUERY, variables)
+        assert response == {
+            "updateNote": {"title": "New Title", "revision": 2}
+        }
+        errors = await fix.gql_errors(
+            self.QUERY, {**variables, "title": "Newer Title"}
+        )
+        assert errors[0]["extensions"] == {"code": "CONFLICT", "revision": 2}
+        await fix.assert_only_row_equals("notes", {"title": "New Title"})
+
+
+class TestPatchNote:
+    QUERY = """
+        mutation($uuid: ID!, $baseRevision: Int!, $ops: [TextEdit!]!) {
+            patchNote(uuid: $uuid, baseRevision: $baseRevision, ops: $ops) {
+                text
+                revision
+            }
+        }
+    """
+
+    async def test_patch(self, fix: IntegrationFixture) -> None:
+        await fix.insert_note(uuid=UUID1, text="Hello world!")
+        response = await fix.gql(
+            self.QUERY,
+            {
+                "uuid": str(UUID1),
+                "baseRevision": 1,
+                "ops": [
+                    {"position": 6, "delete": 5, "insert": "there"},
+                    {"position": 0, "insert": "> "},
+                ],
+            },
+        )
+        assert response == {
+            "patchNote": {"text": "> Hello there!", "revision": 2}
+        }
+        await fix.assert_only_row_equals(
+            "notes", {"text": "> Hello there!", "revision": 2}
+        )
+
+    async def test_conflict(self, fix: IntegrationFixture) -> None:
+        await fix.insert_note(uuid=UUID1, text="Hello world!")
+        variables = {
+            "uuid": str(UUID1),
+            "baseRevision": 1,
+            "ops": [{"position": 0, "insert": "!"}],
+        }
+        await fix.gql(self.QUERY, variables)
+        errors = await fix.gql_errors(self.QUERY, variables)
+        assert errors[0]["extensions"] == {"code": "CONFLICT", "revision": 2}
+        await fix.assert_only_row_equals("notes", {"text": "!Hello world!"})
+
+    async def test_invalid_edit(self, fix: IntegrationFixture) -> None:
+        await fix.insert_note(uuid=UUID1, text="Hello world!")
+        errors = await fix.gql_errors(
+            self.QUERY,
+            {
+                "uuid": str(UUID1),
+                "baseRevision": 1,
+                "ops": [{"position": 10, "delete": 5}],
+            },
+        )
+        assert errors[0]["extensions"] == {"code": "BAD_USER_INPUT"}
+
+    async def test_unknown_note(self, fix: IntegrationFixture) -> None:
+        response = await fix.gql(
+            self.QUERY, {"uuid": str(UUID1), "baseRevision": 1, "ops": []}
+        )
+        assert response == {"patchNote": None}
+
+
+class TestNoteHistory:
+    async def test_history(self, fix: IntegrationFixture) -> None:
+        response = await fix.gql(
+            'mutation { createNote(title: "Title", text: "Old") { uuid } }'
+        )
+        uuid = response["createNote"]["uuid"]
+        await fix.gql(
+            'mutation($uuid: ID!) { updateNote(uuid: $uuid, text: "New") '
+            "{ uuid } }",
+            {"uuid": uuid},
+        )
+        response = await fix.gql(
+            f"""
+                query {{
+                    noteHistory(uuid: "{uuid}") {{ revision title }}
+                    noteAtRevision(uuid: "{uuid}", revision: 1) {{
+                        text
+                        revision
+                    }}
+                    unknown: noteAtRevision(uuid: "{uuid}", revision: 5) {{
+                        text
+                    }}
+                }}
+            """
+        )
+        assert response == {
+            "noteHistory": [
+                {"revision": 2, "title": "Title"},
+                {"revision": 1, "title": "Title"},
+            ],
+            "noteAtRevision": {"text": "Old", "revision": 1},
+            "unknown": None,
+        }
+
+    async def test_unknown_note(self, fix: IntegrationFixture) -> None:
+        response = await fix.gql(
+            f"""
+                query {{
+                    noteHistory(uuid: "{UUID1}") {{ revision }}
+                    noteAtRevision(uuid: "{UUID1}", revision: 1) {{ text }}
+                }}
+            """
+        )
+        assert response == {"noteHistory": [], "noteAtRevision": None}
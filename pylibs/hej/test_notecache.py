@@ -0,0 +1,159 @@
+import datetime
+from uuid import UUID
+
+from .note import Note
+from .notecache import NoteCache, note_size
+
+_UUID1 = UUID("7bb570bf-2e21-4baf-b963-23c454e052ab")
+_UUID2 = UUID("dd877ebd-a9cf-466d-99f2-1327e2068ff2")
+_UUID3 = UUID("2a2b0c25-a2c1-4e6c-9f8b-05b7d1b8f0c4")
+_DATE = datetime.datetime(2021, 5, 14, 13, 19, 4, tzinfo=datetime.UTC)
+
+
+def _note(uuid: UUID, text: str = "") -> Note:
+    return Note(uuid, "Title", text, False, _DATE, _DATE)
+
+
+def test_get_and_put() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    assert cache.get(_UUID1) is None
+    note = _note(_UUID1)
+    cache.put(note, 1)
+    assert cache.get(_UUID1) is note
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.bytes == note_size(note)
+
+
+def test_put__other_version_is_ignored() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    cache.put(_note(_UUID1), 2)
+    assert cache.get(_UUID1) is None
+
+
+def test_sync__new_version_clears() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    cache.put(_note(_UUID1), 1)
+    cache.sync(1)
+    assert len(cache) == 1
+    cache.sync(2)
+    assert len(cache) == 0
+    assert cache.bytes == 0
+    assert cache.invalidations == 1
+
+
+def test_evict_by_size() -> None:
+    note1 = _note(_UUID1, "x" * 1000)
+    cache = NoteCache(2 * note_size(note1) + 10)
+    cache.sync(1)
+    cache.put(note1, 1)
+    cache.put(_note(_UUID2, "y" * 1000), 1)
+    cache.get(_UUID1)
+    cache.put(_note(_UUID3, "z" * 1000), 1)
+    assert cache.get(_UUID1) is note1
+    assert cache.get(_UUID2) is None
+    assert cache.get(_UUID3) is not None
+    assert cache.evictions == 1
+
+
+def test_note_larger_than_budget_is_not_cached() -> None:
+    cache = NoteCache(100)
+    cache.sync(1)
+    cache.put(_note(_UUID1, "x" * 1000), 1)
+    assert len(cache) == 0
+
+
+def test_get_all() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    assert cache.get_all() is None
+    cache.put(_note(_UUID1), 1)
+    assert cache.get_all() is None
+    notes = [_note(_UUID1), _note(_UUID2)]
+    cache.put_all(notes, 1)
+    assert cache.get_all() == notes
+
+
+def test_get_all__incomplete_after_eviction() -> None:
+    note = _note(_UUID1)
+    cache = NoteCache(note_size(note) + 10)
+    cache.sync(1)
+    cache.put_all([note, _note(_UUID2)], 1)
+    assert cache.get_all() is None
+
+
+def test_sync__changed_notes() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    note = _note(_UUID2)
+    cache.put_all([_note(_UUID1), note], 1)
+    cache.sync(3, [_UUID1, _UUID3])
+    assert cache.version == 3
+    assert cache.get(_UUID1) is None
+    assert cache.get(_UUID2) is note
+    assert cache.get_all() is None
+    assert cache.invalidated_notes == 2
+
+
+def test_sync__changed_notes_selected() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    note = _note(_UUID2)
+    cache.put_all([_note(_UUID1), note], 1)
+    assert cache.complete
+    updated_note = _note(_UUID1, "new")
+    new_note = _note(_UUID3)
+    cache.sync(4, [_UUID1, _UUID2, _UUID3], [updated_note, new_note])
+    assert cache.complete
+    assert cache.get_all() == [updated_note, new_note]
+    assert cache.invalidated_notes == 3
+
+
+def test_apply_changes() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    cache.put_all([_note(_UUID1), _note(_UUID2)], 1)
+    new_note = _note(_UUID3)
+    updated_note = _note(_UUID1, "new")
+    cache.apply_changes(
+        {_UUID1: updated_note, _UUID2: None, _UUID3: new_note},
+        3,
+        4,
+        [_UUID1, _UUID2, _UUID3],
+    )
+    assert cache.version == 4
+    assert cache.get_all() == [updated_note, new_note]
+
+
+def test_apply_changes__other_changes() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    note = _note(_UUID3)
+    cache.put_all([_note(_UUID1), _note(_UUID2), note], 1)
+    cache.apply_changes({_UUID1: None}, 1, 3, [_UUID2, _UUID1])
+    assert cache.version == 3
+    assert cache.get(_UUID2) is None
+    assert cache.get(_UUID3) is note
+    assert cache.get_all() is None
+
+
+def test_apply_changes__other_changes_selected() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    cache.put_all([_note(_UUID1), _note(_UUID2)], 1)
+    updated_note = _note(_UUID2, "new")
+    cache.apply_changes({_UUID1: None}, 1, 3, [_UUID2, _UUID1], [updated_note])
+    assert cache.version == 3
+    assert cache.get_all() == [updated_note]
+
+
+def test_apply_changes__unknown_changes() -> None:
+    cache = NoteCache(10_000)
+    cache.sync(1)
+    cache.put_all([_note(_UUID1), _note(_UUID2)], 1)
+    cache.apply_changes({_UUID1: None}, 1, 3, None)
+    assert cache.version == 3
+    assert len(cache) == 0
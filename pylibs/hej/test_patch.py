@@ -0,0 +1,40 @@
+import pytest
+
+from .exc import InvalidEditError
+from .patch import TextEdit, apply_edits
+
+
+def test_apply_edits() -> None:
+    assert apply_edits("Hello world!", []) == "Hello world!"
+    assert apply_edits("Hello world!", [TextEdit(5)]) == "Hello world!"
+    assert (
+        apply_edits("Hello world!", [TextEdit(6, 5, "there")])
+        == "Hello there!"
+    )
+    assert apply_edits("", [TextEdit(0, 0, "foo")]) == "foo"
+    assert apply_edits("foo", [TextEdit(0, 3)]) == ""
+
+
+def test_apply_edits__in_order() -> None:
+    edits = [TextEdit(0, 0, "abc"), TextEdit(1, 1), TextEdit(5, 0, "!")]
+    assert apply_edits("foo", edits) == "acfoo!"
+
+
+def test_apply_edits__utf16_positions() -> None:
+    # "🙂" is two UTF-16 code units long.
+    assert apply_edits("🙂x", [TextEdit(2, 1, "ä")]) == "🙂ä"
+    assert apply_edits("ä🙂", [TextEdit(1, 2)]) == "ä"
+
+
+def test_apply_edits__split_surrogate_pair() -> None:
+    with pytest.raises(InvalidEditError):
+        apply_edits("🙂", [TextEdit(1, 0, "x")])
+
+
+@pytest.mark.parametrize(
+    "edit",
+    [TextEdit(-1), TextEdit(4), TextEdit(2, 2), TextEdit(0, -1)],
+)
+def test_apply_edits__out_of_range(edit: TextEdit) -> None:
+    with pytest.raises(InvalidEditError):
+        apply_edits("foo", [edit])
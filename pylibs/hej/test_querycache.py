@@ -0,0 +1,44 @@
+from graphql import GraphQLSchema
+
+from .querycache import QueryCache, query_hash
+from .testutil_gql import gql_schema
+
+_QUERY1 = "{ notes { uuid } }"
+_QUERY2 = "{ notes { title } }"
+_QUERY3 = "{ notes { text } }"
+
+
+def test_parse() -> None:
+    cache = QueryCache()
+    document = cache.parse(_QUERY1)
+    assert cache.parse(_QUERY1) is document
+    assert cache.parse(_QUERY2) is not document
+    assert cache.hits == 1
+    assert cache.misses == 2
+
+
+def test_lookup() -> None:
+    cache = QueryCache()
+    assert cache.lookup(query_hash(_QUERY1)) is None
+    cache.parse(_QUERY1)
+    assert cache.lookup(query_hash(_QUERY1)) == _QUERY1
+
+
+def test_evict_least_recently_used() -> None:
+    cache = QueryCache(size=2)
+    cache.parse(_QUERY1)
+    cache.parse(_QUERY2)
+    cache.parse(_QUERY1)
+    cache.parse(_QUERY3)
+    assert cache.lookup(query_hash(_QUERY1)) == _QUERY1
+    assert cache.lookup(query_hash(_QUERY2)) is None
+    assert cache.lookup(query_hash(_QUERY3)) == _QUERY3
+
+
+def test_validate(gql_schema: GraphQLSchema) -> None:
+    cache = QueryCache()
+    document = cache.parse("{ notes { unknown } }")
+    errors = cache.validate(gql_schema, document)
+    assert len(errors) == 1
+    assert cache.validate(gql_schema, document) is errors
+    assert cache.validate(gql_schema, cache.parse(_QUERY1)) == []
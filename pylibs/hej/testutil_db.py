@@ -8,7 +8,7 @@ from uuid import UUID
 import aiofiles
 import pytest
 
-from .db import Database, Transaction, db_datetime, db_datetime_old, open_db
+from .db import Database, Transaction, db_datetime, open_db
 
 SCHEMA_PATH = Path(__file__).parent.parent.parent / "db" / "schema.sql"
 
@@ -51,8 +51,8 @@ class DatabaseFixture:
                 "title": title,
                 "text": text,
                 "favorite": favorite,
-                "creation_date": db_datetime(creation_date),
-                "last_changed": db_datetime_old(last_changed),
+                "creation_date": creation_date,
+                "last_changed": last_changed,
             },
         )
         return uuid
@@ -122,6 +122,9 @@ def row_matches(row: Row, expected_row: Mapping[str, Any]) -> bool:
 def _sql_value(v: object) -> Any:
     if isinstance(v, UUID):
         return str(v)
+    elif isinstance(v, datetime.datetime):
+        # Naive dates are taken as UTC.
+        return db_datetime(v.replace(tzinfo=v.tzinfo or datetime.UTC))
     else:
         return v
 
@@ -1,7 +1,8 @@
+from collections.abc import AsyncGenerator
 from typing import Any, cast
 
 import pytest
-from ariadne import graphql
+from ariadne import graphql, subscribe
 from graphql import GraphQLSchema
 from starlette.requests import Request
 from starlette.types import Scope
@@ -29,6 +30,43 @@ class GQLFixture:
         assert "data" in response
         return cast(dict[str, Any], response["data"])
 
+    async def gql_errors(
+        self, query: str, variables: dict[str, Any] | None = None
+    ) -> list[dict[str, Any]]:
+        """Execute a query that is expected to fail and return its errors."""
+        request = Request(_scope())
+        body: dict[str, Any] = {"query": query}
+        if variables is not None:
+            body["variables"] = variables
+        _, response = await graphql(
+            self.schema, body, context_value={"request": request, "auth": True}
+        )
+        errors = response.get("errors", [])
+        assert len(errors) > 0, "GraphQL query succeeded unexpectedly"
+        return cast(list[dict[str, Any]], errors)
+
+    async def subscribe(
+        self, query: str, variables: dict[str, Any] | None = None
+    ) -> AsyncGenerator[dict[str, Any]]:
+        """Start a subscription and return a generator of its results."""
+        request = Request(_scope())
+        body: dict[str, Any] = {"query": query}
+        if variables is not None:
+            body["variables"] = variables
+        success, results = await subscribe(
+            self.schema, body, context_value={"request": request, "auth": True}
+        )
+        assert success, f"GraphQL subscription failed: {results}"
+        assert not isinstance(results, list)
+
+        async def data() -> AsyncGenerator[dict[str, Any]]:
+            async for result in results:
+                assert not result.errors, f"Unexpected error: {result.errors}"
+                assert result.data is not None
+                yield result.data
+
+        return data()
+
 
 def _scope() -> Scope:
     return {